@@ -0,0 +1,86 @@
+"""Measures the peak RSS for keeping all packages of a files database in memory.
+
+Compares the plain desc dicts with PackageRecords. Every variant runs in a
+separate process, which reports its peak RSS (Unix only).
+
+Usage: python benchmarks/bench_repo_records.py [path to a .files DB | number of packages]
+
+Without a path a synthetic database gets generated, with a layout similar to
+the mingw64 one. The real one can be downloaded from
+https://repo.msys2.org/mingw/mingw64/mingw64.files.tar.zst
+"""
+
+import io
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from msys2_devtools.db import iter_repo, iter_repo_records
+from msys2_devtools.exttarfile import tarfile
+
+
+def generate(count: int, path: str) -> None:
+    with tarfile.TarFile.open(path, mode="w:zst") as tar:
+        for i in range(count):
+            name = f"mingw-w64-x86_64-pkg{i}"
+            files = ["mingw64/", "mingw64/bin/", f"mingw64/bin/lib{name}-1.dll", "mingw64/include/",
+                     f"mingw64/include/{name}/", "mingw64/lib/", f"mingw64/lib/lib{name}.dll.a",
+                     "mingw64/lib/python3.12/", "mingw64/lib/python3.12/site-packages/",
+                     f"mingw64/lib/python3.12/site-packages/{name}/",
+                     f"mingw64/lib/python3.12/site-packages/{name}/__pycache__/"]
+            for j in range(i % 200):
+                files.append(f"mingw64/include/{name}/header{j}.h")
+                files.append(f"mingw64/lib/python3.12/site-packages/{name}/module{j}.py")
+                files.append(f"mingw64/lib/python3.12/site-packages/{name}/__pycache__/module{j}.cpython-312.pyc")
+            members = {
+                "desc": f"%FILENAME%\n{name}-1.0-1-any.pkg.tar.zst\n\n%NAME%\n{name}\n\n%BASE%\nmingw-w64-pkg{i}\n\n"
+                        f"%VERSION%\n1.0-1\n\n%DEPENDS%\nmingw-w64-x86_64-gcc-libs\nmingw-w64-x86_64-python\n\n",
+                "files": "%FILES%\n" + "".join(f + "\n" for f in files),
+            }
+            for member, text in members.items():
+                data = text.encode("utf-8")
+                info = tarfile.TarInfo(f"{name}-1.0-1/{member}")
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+
+
+def run_variant(variant: str, path: str) -> None:
+    start = time.perf_counter()
+    with open(path, "rb") as h:
+        if variant == "desc":
+            loaded = dict(iter_repo(h))
+            count = sum(len(d.get("%FILES%", [])) for d in loaded.values())
+        elif variant == "records":
+            loaded = list(iter_repo_records(h))
+            count = sum(len(r.files or []) for r in loaded)
+        else:
+            raise ValueError(variant)
+    duration = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        peak *= 1024
+    print(f"{variant:<10} {len(loaded):6} packages {count:9} files {duration:7.2f}s {peak / 1024 / 1024:8.1f} MiB peak RSS")
+
+
+def main(argv: list[str]) -> None:
+    if len(argv) > 2 and argv[1] == "--variant":
+        run_variant(argv[2], argv[3])
+        return
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if len(argv) > 1 and os.path.exists(argv[1]):
+            path = argv[1]
+        else:
+            count = int(argv[1]) if len(argv) > 1 else 5000
+            path = os.path.join(temp_dir, "test.files.tar.zst")
+            generate(count, path)
+        print(f"{path}: {os.path.getsize(path) / 1024 / 1024:.1f} MiB")
+        for variant in ["desc", "records"]:
+            subprocess.run([sys.executable, __file__, "--variant", variant, path], check=True)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,92 @@
+"""Measures the runtime and peak memory of "msys2-sbom fixup".
+
+Generates a synthetic SBOM and grype report, and compares the fixup with
+loading and writing the same SBOM through the cyclonedx library, which is
+what the fixup did before.
+
+Usage: python benchmarks/bench_sbom_fixup.py [number of components]
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from typing import Callable
+
+from cyclonedx.model.bom import Bom
+from cyclonedx.output.json import JsonV1Dot5
+
+from msys2_devtools.sbom import handle_fixup_command
+
+
+def generate(count: int, target_path: str, grype_path: str) -> None:
+    components = []
+    vulnerabilities = []
+    matches = []
+    for i in range(count):
+        ref = f"ref-{i}"
+        components.append({
+            "bom-ref": ref, "type": "library", "name": f"pkg{i}", "version": "1.0",
+            "properties": [{"name": "syft:location:0:path", "value": f"pkg{i}"}],
+        })
+        for j in range(3):
+            vuln_id = f"CVE-{i}-{j}"
+            vulnerabilities.append({"bom-ref": f"vuln-{i}-{j}", "id": vuln_id, "affects": [{"ref": ref}]})
+            matches.append({
+                "vulnerability": {
+                    "id": vuln_id, "description": "x" * 500,
+                    "fix": {"state": "fixed" if j else "not-fixed", "versions": ["1.1"] if j else []},
+                },
+                "relatedVulnerabilities": [], "matchDetails": [{"type": "exact-direct-match"}],
+                "artifact": {"name": f"pkg{i}", "version": "1.0", "locations": [{"path": f"pkg{i}"}]},
+            })
+
+    with open(target_path, "w", encoding="utf-8") as h:
+        json.dump({"bomFormat": "CycloneDX", "specVersion": "1.5", "version": 1,
+                   "components": components, "vulnerabilities": vulnerabilities}, h, indent=2)
+    with open(grype_path, "w", encoding="utf-8") as h:
+        json.dump({"matches": matches, "source": {"type": "sbom"}}, h, indent=2)
+
+
+def measure(name: str, func: Callable[[], None]) -> None:
+    # separate runs, since tracing slows things down a lot
+    start = time.perf_counter()
+    func()
+    duration = time.perf_counter() - start
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{name:<12} {duration:8.2f}s {peak / 1024 / 1024:10.1f} MiB peak")
+
+
+def main(argv: list[str]) -> None:
+    count = int(argv[1]) if len(argv) > 1 else 5000
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        target_path = os.path.join(temp_dir, "sbom.json")
+        grype_path = os.path.join(temp_dir, "grype.json")
+        generate(count, target_path, grype_path)
+        print(f"{count} components, SBOM {os.path.getsize(target_path) / 1024 / 1024:.1f} MiB, "
+              f"grype report {os.path.getsize(grype_path) / 1024 / 1024:.1f} MiB")
+
+        def cyclonedx() -> None:
+            with open(grype_path, "r", encoding="utf-8") as h:
+                json.loads(h.read())
+            with open(target_path, "r", encoding="utf-8") as h:
+                bom = Bom.from_json(json.loads(h.read()))
+            JsonV1Dot5(bom).output_as_string(indent=2)
+
+        def fixup() -> None:
+            handle_fixup_command(types.SimpleNamespace(
+                target_sbom=target_path, grype_json=grype_path, srcinfo_cache=None))
+
+        measure("cyclonedx", cyclonedx)
+        measure("fixup", fixup)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
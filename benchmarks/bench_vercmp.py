@@ -0,0 +1,178 @@
+"""Micro-benchmarks for vercmp() and VersionKey.
+
+Compares the original vercmp() implementation, kept here as a reference
+which the tests compare against as well, with the new one for pairwise
+comparisons and for sorting.
+
+Usage: python benchmarks/bench_vercmp.py [number of versions]
+"""
+
+import random
+import sys
+import timeit
+from functools import cmp_to_key
+from itertools import zip_longest
+from typing import Any, Callable
+
+from msys2_devtools.utils import VersionKey, vercmp, version_key
+
+
+def reference_vercmp(v1: str, v2: str) -> int:
+    """The original implementation of vercmp(), to compare against"""
+
+    def cmp(a: Any, b: Any) -> int:
+        res = (a > b) - (a < b)
+        assert isinstance(res, int)
+        return res
+
+    def split(v: str) -> tuple[str, str, str | None]:
+        if "~" in v:
+            e, v = v.split("~", 1)
+        else:
+            e, v = ("0", v)
+
+        r: str | None = None
+        if "-" in v:
+            v, r = v.rsplit("-", 1)
+        else:
+            v, r = (v, None)
+
+        return (e, v, r)
+
+    digit, alpha, other = range(3)
+
+    def get_type(c: str) -> int:
+        assert c
+        if c.isdigit():
+            return digit
+        elif c.isalpha():
+            return alpha
+        else:
+            return other
+
+    def parse(v: str) -> list[str]:
+        parts: list[str] = []
+        current = ""
+        for c in v:
+            if not current:
+                current += c
+            else:
+                if get_type(c) == get_type(current):
+                    current += c
+                else:
+                    parts.append(current)
+                    current = c
+
+        if current:
+            parts.append(current)
+
+        return parts
+
+    def rpmvercmp(v1: str, v2: str) -> int:
+        for p1, p2 in zip_longest(parse(v1), parse(v2), fillvalue=None):
+            if p1 is None:
+                assert p2 is not None
+                if get_type(p2) == alpha:
+                    return 1
+                return -1
+            elif p2 is None:
+                assert p1 is not None
+                if get_type(p1) == alpha:
+                    return -1
+                return 1
+
+            t1 = get_type(p1)
+            t2 = get_type(p2)
+            if t1 != t2:
+                if t1 == digit:
+                    return 1
+                elif t2 == digit:
+                    return -1
+                elif t1 == other:
+                    return 1
+                elif t2 == other:
+                    return -1
+            elif t1 == other:
+                ret = cmp(len(p1), len(p2))
+                if ret != 0:
+                    return ret
+            elif t1 == digit:
+                ret = cmp(int(p1), int(p2))
+                if ret != 0:
+                    return ret
+            elif t1 == alpha:
+                ret = cmp(p1, p2)
+                if ret != 0:
+                    return ret
+
+        return 0
+
+    e1, v1, r1 = split(v1)
+    e2, v2, r2 = split(v2)
+
+    ret = rpmvercmp(e1, e2)
+    if ret == 0:
+        ret = rpmvercmp(v1, v2)
+        if ret == 0 and r1 is not None and r2 is not None:
+            ret = rpmvercmp(r1, r2)
+
+    return ret
+
+
+def generate(count: int) -> list[str]:
+    rng = random.Random(42)
+    versions = []
+    for i in range(count):
+        kind = i % 4
+        if kind == 0:
+            version = ".".join(str(rng.randint(0, 20)) for _ in range(rng.randint(1, 4)))
+        elif kind == 1:
+            version = f"{rng.randint(2000, 2025)}.{rng.randint(1, 12):02d}.{rng.randint(1, 28):02d}"
+        elif kind == 2:
+            version = f"r{rng.randint(1, 5000)}.{rng.getrandbits(28):07x}"
+        else:
+            version = f"{rng.randint(0, 9)}.{rng.randint(0, 9)}{rng.choice(['a', 'b', 'rc', 'pre', ''])}{rng.randint(1, 5)}"
+        if rng.random() < 0.1:
+            version = f"{rng.randint(1, 3)}~{version}"
+        versions.append(f"{version}-{rng.randint(1, 5)}")
+    return versions
+
+
+def measure(name: str, func: Callable[[], object], number: int = 3) -> float:
+    seconds = min(timeit.repeat(func, number=1, repeat=number))
+    print(f"{name:<36} {seconds * 1000:10.1f} ms")
+    return seconds
+
+
+def main(argv: list[str]) -> None:
+    count = int(argv[1]) if len(argv) > 1 else 20000
+    versions = generate(count)
+    pairs = list(zip(versions, reversed(versions)))
+    print(f"{count} versions")
+
+    def compare_uncached() -> None:
+        for a, b in pairs:
+            VersionKey(a).compare(VersionKey(b))
+
+    def compare_cached() -> None:
+        for a, b in pairs:
+            vercmp(a, b)
+
+    def compare_reference() -> None:
+        for a, b in pairs:
+            reference_vercmp(a, b)
+
+    measure("vercmp (reference)", compare_reference)
+    measure("vercmp (uncached VersionKey)", compare_uncached)
+    version_key.cache_clear()
+    measure("vercmp (cached VersionKey)", compare_cached)
+
+    measure("sort, cmp_to_key(reference)", lambda: sorted(versions, key=cmp_to_key(reference_vercmp)))
+    measure("sort, cmp_to_key(vercmp)", lambda: sorted(versions, key=cmp_to_key(vercmp)))
+    measure("sort, key=VersionKey", lambda: sorted(versions, key=VersionKey))
+    version_key.cache_clear()
+    measure("sort, key=version_key", lambda: sorted(versions, key=version_key))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,314 @@
+"""Offline matching of SBOM components against vulnerability advisories.
+
+The advisories are read from a dump in the OSV format
+(https://ossf.github.io/osv-schema/): either a directory of JSON files, a
+JSON file containing a list of records, or a JSON lines file. In addition
+to "package.purl" and "package.ecosystem"/"package.name", the affected
+entries can contain a "package.cpe" for data derived from the NVD.
+
+The dump is converted into an index file once, which maps normalized CPEs
+(part, vendor and product) and PURLs (without version) to the affected
+entries. It gets memory-mapped, so matching only needs to load the entries
+for the keys of the components. The index stores a stamp of the dump files
+(names, sizes and mtimes), and gets rebuilt when they change.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import zlib
+from typing import Any, Iterable, Iterator, Optional
+
+from packageurl import PackageURL
+
+from .cpe import CPEAny, build_cpe22, normalize_cpe, parse_cpe
+from .utils import VersionKey, vercmp, version_key
+
+ADVISORY_INDEX_MAGIC = b"MSYS2-ADVISORIES-2\n"
+
+# index offset + index size
+_TRAILER = struct.Struct("<QQ")
+
+# OSV ecosystems to PURL types, for entries without a PURL
+ECOSYSTEM_PURL_TYPES = {
+    "PyPI": "pypi",
+    "npm": "npm",
+    "crates.io": "cargo",
+    "Go": "golang",
+    "Maven": "maven",
+    "RubyGems": "gem",
+    "NuGet": "nuget",
+    "Packagist": "composer",
+    "Hex": "hex",
+    "Pub": "pub",
+}
+
+
+def normalize_purl(purl: PackageURL) -> str:
+    """Returns the PURL without version, qualifiers and subpath, for comparison"""
+
+    name = purl.name
+    if purl.type == "pypi":
+        name = name.replace("_", "-").replace(".", "-").lower()
+    return PackageURL(type=purl.type.lower(), namespace=purl.namespace, name=name).to_string()
+
+
+def get_cpe_key(cpe: str) -> str:
+    """Returns the CPE without version, normalized with normalize_cpe()"""
+
+    part, vendor, product, version = parse_cpe(cpe)
+    return normalize_cpe(build_cpe22(part, vendor, product, CPEAny))
+
+
+def get_affected_key(affected: dict[str, Any]) -> Optional[str]:
+    """Returns the index key for an affected entry of an advisory"""
+
+    package = affected.get("package", {})
+    if "cpe" in package:
+        return get_cpe_key(package["cpe"])
+    if "purl" in package:
+        return normalize_purl(PackageURL.from_string(package["purl"]))
+    purl_type = ECOSYSTEM_PURL_TYPES.get(package.get("ecosystem", ""))
+    if purl_type is not None and package.get("name"):
+        namespace, _, name = package["name"].rpartition("/")
+        if purl_type == "maven":
+            namespace, _, name = package["name"].rpartition(":")
+        return normalize_purl(PackageURL(type=purl_type, namespace=namespace or None, name=name))
+    return None
+
+
+def get_component_keys(component: dict[str, Any]) -> list[tuple[str, str]]:
+    """Returns the index keys and versions for a CycloneDX component JSON"""
+
+    keys = []
+    if "cpe" in component:
+        version = parse_cpe(component["cpe"])[3]
+        if not isinstance(version, str):
+            version = component.get("version")
+        if isinstance(version, str):
+            keys.append((get_cpe_key(component["cpe"]), version))
+    if "purl" in component:
+        purl = PackageURL.from_string(component["purl"])
+        version = purl.version or component.get("version")
+        if version is not None:
+            keys.append((normalize_purl(purl), version))
+    return keys
+
+
+def is_affected(version: str, affected: dict[str, Any]) -> bool:
+    """If the version is affected according to the "versions" and "ranges"
+    of an affected entry. Versions are compared with vercmp(), git ranges are
+    ignored."""
+
+    if version in affected.get("versions", []):
+        return True
+
+    def event_key(event: dict[str, str]) -> VersionKey:
+        return version_key(next(iter(event.values())))
+
+    for range_ in affected.get("ranges", []):
+        if range_.get("type") == "GIT":
+            continue
+        status = False
+        for event in sorted(range_.get("events", []), key=event_key):
+            if "introduced" in event:
+                if event["introduced"] == "0" or vercmp(version, event["introduced"]) >= 0:
+                    status = True
+            elif "fixed" in event:
+                if vercmp(version, event["fixed"]) >= 0:
+                    status = False
+            elif "last_affected" in event:
+                if vercmp(version, event["last_affected"]) > 0:
+                    status = False
+        if status:
+            return True
+    return False
+
+
+def get_fixed_versions(affected: dict[str, Any]) -> list[str]:
+    fixed = []
+    for range_ in affected.get("ranges", []):
+        if range_.get("type") == "GIT":
+            continue
+        for event in range_.get("events", []):
+            if "fixed" in event:
+                fixed.append(event["fixed"])
+    return fixed
+
+
+def iter_advisory_files(path: str) -> Iterator[str]:
+    """Yields the paths of all files of an advisory dump"""
+
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if name.endswith(".json"):
+                    yield os.path.join(root, name)
+    else:
+        yield path
+
+
+def get_advisories_stamp(path: str) -> str:
+    """Returns a value which changes when any file of the advisory dump gets
+    added, removed or changed, without reading the files"""
+
+    h = hashlib.sha256()
+    for file_path in iter_advisory_files(path):
+        stat = os.stat(file_path)
+        h.update(f"{os.path.relpath(file_path, path)}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode("utf-8"))
+    return h.hexdigest()
+
+
+def iter_advisories(path: str) -> Iterator[dict[str, Any]]:
+    """Yields all OSV records of an advisory dump"""
+
+    if os.path.isdir(path):
+        for file_path in iter_advisory_files(path):
+            with open(file_path, "r", encoding="utf-8") as h:
+                yield json.load(h)
+    elif path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as h:
+            for line in h:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with open(path, "r", encoding="utf-8") as h:
+            yield from json.load(h)
+
+
+def dump_advisory_index(advisories: Iterable[dict[str, Any]], stamp: Optional[str] = None) -> bytes:
+    """Serializes the advisories into the index format, stamp is the one of the dump"""
+
+    parts = [ADVISORY_INDEX_MAGIC]
+    offset = len(ADVISORY_INDEX_MAGIC)
+    keys: dict[str, list[list[int]]] = {}
+    for advisory in advisories:
+        if advisory.get("withdrawn"):
+            continue
+        by_key: dict[str, list[dict[str, Any]]] = {}
+        for affected in advisory.get("affected", []):
+            key = get_affected_key(affected)
+            if key is not None:
+                by_key.setdefault(key, []).append(
+                    {k: affected[k] for k in ["ranges", "versions"] if k in affected})
+        for key, affected_list in by_key.items():
+            record = {
+                "id": advisory["id"],
+                "aliases": advisory.get("aliases", []),
+                "summary": advisory.get("summary", ""),
+                "affected": affected_list,
+            }
+            blob = zlib.compress(json.dumps(record, separators=(",", ":")).encode("utf-8"))
+            keys.setdefault(key, []).append([offset, len(blob)])
+            parts.append(blob)
+            offset += len(blob)
+
+    index_blob = zlib.compress(json.dumps({"stamp": stamp, "keys": keys}, separators=(",", ":")).encode("utf-8"))
+    parts.append(index_blob)
+    parts.append(_TRAILER.pack(offset, len(index_blob)))
+    return b"".join(parts)
+
+
+def write_advisory_index(path: str, advisories: Iterable[dict[str, Any]], stamp: Optional[str] = None) -> None:
+    """Atomically writes an index file for the advisories"""
+
+    data = dump_advisory_index(advisories, stamp)
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as h:
+        h.write(data)
+    os.replace(temp_path, path)
+
+
+class AdvisoryIndex:
+    """A memory-mapped advisory index file"""
+
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as h:
+            self._data = mmap.mmap(h.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._data[:len(ADVISORY_INDEX_MAGIC)] != ADVISORY_INDEX_MAGIC:
+            self._data.close()
+            raise ValueError("not an advisory index")
+        offset, size = _TRAILER.unpack(self._data[-_TRAILER.size:])
+        index = json.loads(zlib.decompress(self._data[offset:offset + size]))
+        self.stamp: Optional[str] = index["stamp"]
+        self._keys: dict[str, list[list[int]]] = index["keys"]
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def lookup(self, key: str) -> list[dict[str, Any]]:
+        """Returns the advisories for a key, with only the affected entries for it"""
+
+        result = []
+        for offset, size in self._keys.get(key, []):
+            result.append(json.loads(zlib.decompress(self._data[offset:offset + size])))
+        return result
+
+    def close(self) -> None:
+        self._data.close()
+
+    def __enter__(self) -> "AdvisoryIndex":
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+
+def open_advisory_index(index_path: str, advisories_path: str) -> AdvisoryIndex:
+    """Opens the index for the advisory dump, and (re)builds it first in case
+    it doesn't exist or was created from different files"""
+
+    stamp = get_advisories_stamp(advisories_path)
+    try:
+        index = AdvisoryIndex(index_path)
+    except (FileNotFoundError, ValueError):
+        pass
+    else:
+        if index.stamp == stamp:
+            return index
+        index.close()
+    write_advisory_index(index_path, iter_advisories(advisories_path), stamp)
+    return AdvisoryIndex(index_path)
+
+
+def get_component_pkgbase(component: dict[str, Any]) -> Optional[str]:
+    for prop in component.get("properties", []):
+        if prop["name"] == "msys2:pkgbase":
+            return prop.get("value")
+    return None
+
+
+def match_components(components: Iterable[dict[str, Any]], index: AdvisoryIndex,
+                     ignored: dict[str, set[str]]) -> list[dict[str, Any]]:
+    """Returns CycloneDX vulnerabilities for all affected components, one per
+    advisory and component. 'ignored' maps vulnerability IDs to the pkgbases
+    which are not affected by them."""
+
+    vulnerabilities = []
+    for component in components:
+        pkgbase = get_component_pkgbase(component)
+        found: dict[str, dict[str, Any]] = {}
+        for key, version in get_component_keys(component):
+            for advisory in index.lookup(key):
+                if advisory["id"] in found:
+                    continue
+                affected = [a for a in advisory["affected"] if is_affected(version, a)]
+                if not affected:
+                    continue
+                vuln: dict[str, Any] = {"id": advisory["id"]}
+                if advisory["summary"]:
+                    vuln["description"] = advisory["summary"]
+                target: dict[str, Any] = {"ref": component["bom-ref"]}
+                fixed = [v for a in affected for v in get_fixed_versions(a)]
+                if fixed:
+                    target["versions"] = [{"version": v, "status": "unaffected"} for v in dict.fromkeys(fixed)]
+                vuln["affects"] = [target]
+                ids = [advisory["id"]] + advisory["aliases"]
+                if pkgbase is not None and any(pkgbase in ignored.get(i, set()) for i in ids):
+                    vuln["analysis"] = {"state": "not_affected"}
+                found[advisory["id"]] = vuln
+        vulnerabilities.extend(found.values())
+    return vulnerabilities
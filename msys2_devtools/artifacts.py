@@ -0,0 +1,103 @@
+"""A local cache for downloaded files.
+
+Each file is stored together with the ETag and Last-Modified values of the
+response, which are used for conditional requests on the next fetch, so
+unchanged files are not transferred again.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, Optional
+
+import requests
+
+from .utils import get_cache_dir
+
+log = logging.getLogger(__name__)
+
+
+def get_default_artifact_dir() -> str:
+    return os.path.join(get_cache_dir(), "artifacts")
+
+
+class ArtifactCache:
+
+    def __init__(self, cache_dir: str, session: requests.Session) -> None:
+        self._cache_dir = cache_dir
+        self._session = session
+
+    def get_path(self, url: str) -> str:
+        """Returns the path of the local copy, which might not exist yet"""
+
+        name = os.path.basename(url.rstrip("/"))
+        digest = hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self._cache_dir, f"{digest}-{name}")
+
+    def _load_meta(self, path: str) -> Optional[dict[str, str]]:
+        try:
+            with open(path + ".json", "r", encoding="utf-8") as h:
+                meta = json.load(h)
+        except (FileNotFoundError, ValueError):
+            return None
+        if not os.path.exists(path):
+            return None
+        return meta
+
+    def fetch(self, url: str) -> str:
+        """Returns the path of an up to date local copy of the URL"""
+
+        path = self.get_path(url)
+        meta = self._load_meta(path)
+        headers = {}
+        if meta is not None:
+            if "etag" in meta:
+                headers["If-None-Match"] = meta["etag"]
+            if "last_modified" in meta:
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        with self._session.get(url, headers=headers, stream=True, timeout=60) as r:
+            if r.status_code == 304 and meta is not None:
+                log.info("Not modified: %s", url)
+                return path
+            r.raise_for_status()
+            log.info("Downloading: %s", url)
+
+            os.makedirs(self._cache_dir, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self._cache_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as h:
+                    for chunk in r.iter_content(1024 * 1024):
+                        h.write(chunk)
+                os.replace(temp_path, path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+
+            new_meta = {"url": url}
+            if "ETag" in r.headers:
+                new_meta["etag"] = r.headers["ETag"]
+            if "Last-Modified" in r.headers:
+                new_meta["last_modified"] = r.headers["Last-Modified"]
+            with open(path + ".json", "w", encoding="utf-8") as h:
+                json.dump(new_meta, h)
+
+        return path
+
+    def fetch_all(self, urls: Iterable[str], concurrency: int) -> Iterator[tuple[str, str]]:
+        """Fetches all URLs concurrently, and yields (url, path) in the order
+        of the URLs as soon as each is available. The remaining downloads
+        continue while the caller processes the results."""
+
+        urls = list(urls)
+        with ThreadPoolExecutor(max(1, min(concurrency, len(urls)))) as executor:
+            futures = [executor.submit(self.fetch, url) for url in urls]
+            try:
+                for url, future in zip(urls, futures):
+                    yield url, future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
@@ -0,0 +1,227 @@
+"""Backends for evaluating PKGBUILD files.
+
+The MSYS2 backend uses the bash and makepkg of an MSYS2 installation. The
+Linux backend uses a native bash and makepkg, and emulates the MSYS2
+environment by passing the per-arch variables from makepkg-mingw via a
+generated makepkg config file and environment variables.
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+from .bashpool import BashPool
+
+# The variables /etc/msystem and /etc/makepkg_mingw.conf set up for each environment
+MSYSTEMS: Dict[str, Dict[str, str]] = {
+    "msys": {
+        "MSYSTEM": "MSYS",
+        "MSYSTEM_PREFIX": "/usr",
+        "MSYSTEM_CARCH": "x86_64",
+        "MSYSTEM_CHOST": "x86_64-pc-msys",
+        "CARCH": "x86_64",
+        "CHOST": "x86_64-pc-msys",
+    },
+    "mingw32": {
+        "MSYSTEM": "MINGW32",
+        "MSYSTEM_PREFIX": "/mingw32",
+        "MSYSTEM_CARCH": "i686",
+        "MSYSTEM_CHOST": "i686-w64-mingw32",
+        "MINGW_CHOST": "i686-w64-mingw32",
+        "MINGW_PREFIX": "/mingw32",
+        "MINGW_PACKAGE_PREFIX": "mingw-w64-i686",
+        "CARCH": "i686",
+        "CHOST": "i686-w64-mingw32",
+    },
+    "mingw64": {
+        "MSYSTEM": "MINGW64",
+        "MSYSTEM_PREFIX": "/mingw64",
+        "MSYSTEM_CARCH": "x86_64",
+        "MSYSTEM_CHOST": "x86_64-w64-mingw32",
+        "MINGW_CHOST": "x86_64-w64-mingw32",
+        "MINGW_PREFIX": "/mingw64",
+        "MINGW_PACKAGE_PREFIX": "mingw-w64-x86_64",
+        "CARCH": "x86_64",
+        "CHOST": "x86_64-w64-mingw32",
+    },
+    "ucrt64": {
+        "MSYSTEM": "UCRT64",
+        "MSYSTEM_PREFIX": "/ucrt64",
+        "MSYSTEM_CARCH": "x86_64",
+        "MSYSTEM_CHOST": "x86_64-w64-mingw32",
+        "MINGW_CHOST": "x86_64-w64-mingw32",
+        "MINGW_PREFIX": "/ucrt64",
+        "MINGW_PACKAGE_PREFIX": "mingw-w64-ucrt-x86_64",
+        "CARCH": "x86_64",
+        "CHOST": "x86_64-w64-mingw32",
+    },
+    "clang64": {
+        "MSYSTEM": "CLANG64",
+        "MSYSTEM_PREFIX": "/clang64",
+        "MSYSTEM_CARCH": "x86_64",
+        "MSYSTEM_CHOST": "x86_64-w64-mingw32",
+        "MINGW_CHOST": "x86_64-w64-mingw32",
+        "MINGW_PREFIX": "/clang64",
+        "MINGW_PACKAGE_PREFIX": "mingw-w64-clang-x86_64",
+        "CARCH": "x86_64",
+        "CHOST": "x86_64-w64-mingw32",
+    },
+    "clang32": {
+        "MSYSTEM": "CLANG32",
+        "MSYSTEM_PREFIX": "/clang32",
+        "MSYSTEM_CARCH": "i686",
+        "MSYSTEM_CHOST": "i686-w64-mingw32",
+        "MINGW_CHOST": "i686-w64-mingw32",
+        "MINGW_PREFIX": "/clang32",
+        "MINGW_PACKAGE_PREFIX": "mingw-w64-clang-i686",
+        "CARCH": "i686",
+        "CHOST": "i686-w64-mingw32",
+    },
+    "clangarm64": {
+        "MSYSTEM": "CLANGARM64",
+        "MSYSTEM_PREFIX": "/clangarm64",
+        "MSYSTEM_CARCH": "aarch64",
+        "MSYSTEM_CHOST": "aarch64-w64-mingw32",
+        "MINGW_CHOST": "aarch64-w64-mingw32",
+        "MINGW_PREFIX": "/clangarm64",
+        "MINGW_PACKAGE_PREFIX": "mingw-w64-clang-aarch64",
+        "CARCH": "aarch64",
+        "CHOST": "aarch64-w64-mingw32",
+    },
+}
+
+
+class Backend(ABC):
+    """Knows how to run bash and makepkg for evaluating PKGBUILD files"""
+
+    libmakepkg: Optional[str] = None
+    """The libmakepkg directory as seen from bash, if it can be used directly instead of running makepkg"""
+
+    @abstractmethod
+    def create_pool(self, size: int) -> BashPool:
+        pass
+
+    @abstractmethod
+    def get_printsrcinfo_command(self, pkgbuild_name: str, arch: Optional[str]) -> Tuple[List[str], Dict[str, str]]:
+        """Returns the command and the extra environment for printing the SRCINFO.
+
+        arch is the MINGW_ARCH to use, or None for MSYS packages.
+        """
+
+    @abstractmethod
+    def get_makepkg_config(self, arch: Optional[str]) -> str:
+        """Returns the makepkg config for the MINGW_ARCH, or for MSYS packages if None.
+
+        Also accepts "@ARCH@" as a placeholder for the arch.
+        """
+
+    @abstractmethod
+    def find_libmakepkg(self) -> Optional[str]:
+        """Returns the libmakepkg directory belonging to the makepkg used, as seen
+        from bash, or None if not found"""
+
+    def get_bash_path(self, path: str) -> str:
+        """Returns the local path as seen from bash"""
+
+        return path
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self) -> "Backend":
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+
+class MsysBackend(Backend):
+    """Uses an MSYS2 installation, only works on Windows"""
+
+    def __init__(self, msys2_root: str, libmakepkg: Optional[str] = None) -> None:
+        """libmakepkg is the directory as seen from MSYS2, like /usr/share/makepkg"""
+
+        self.msys2_root = msys2_root
+        self.libmakepkg = libmakepkg
+        self._bash_paths: Dict[str, str] = {}
+
+    def create_pool(self, size: int) -> BashPool:
+        executable = os.path.join(self.msys2_root, 'usr', 'bin', 'bash.exe')
+        env = os.environ.copy()
+        env["CHERE_INVOKING"] = "1"
+        env["MSYSTEM"] = "MSYS"
+        env["MSYS2_PATH_TYPE"] = "minimal"
+        return BashPool(executable, size, ["-l"], env)
+
+    def get_printsrcinfo_command(self, pkgbuild_name: str, arch: Optional[str]) -> Tuple[List[str], Dict[str, str]]:
+        if arch is None:
+            return (["/usr/bin/makepkg", "--printsrcinfo", "-p", pkgbuild_name], {})
+        return (["/usr/bin/makepkg-mingw", "--printsrcinfo", "-p", pkgbuild_name], {"MINGW_ARCH": arch})
+
+    def get_makepkg_config(self, arch: Optional[str]) -> str:
+        # makepkg-mingw sets MSYSTEM, and the config derives everything else from it
+        return "/etc/makepkg.conf" if arch is None else "/etc/makepkg_mingw.conf"
+
+    def find_libmakepkg(self) -> Optional[str]:
+        if os.path.isfile(os.path.join(self.msys2_root, "usr", "share", "makepkg", "srcinfo.sh")):
+            return "/usr/share/makepkg"
+        return None
+
+    def get_bash_path(self, path: str) -> str:
+        # bash gets Windows paths as they are, which things like dirname don't handle
+        if path not in self._bash_paths:
+            executable = os.path.join(self.msys2_root, "usr", "bin", "cygpath.exe")
+            self._bash_paths[path] = subprocess.check_output(
+                [executable, "-u", path]).decode("utf-8").strip()
+        return self._bash_paths[path]
+
+
+class LinuxBackend(Backend):
+    """Uses a native bash and makepkg (or anything compatible with 'makepkg --printsrcinfo')"""
+
+    def __init__(self, bash: str = "bash", makepkg: str = "makepkg", libmakepkg: Optional[str] = None) -> None:
+        self.bash = shutil.which(bash) or bash
+        self.makepkg = makepkg
+        self.libmakepkg = libmakepkg
+        self._config_dir = tempfile.TemporaryDirectory(prefix="msys2-devtools-")
+        for name, variables in MSYSTEMS.items():
+            with open(self._get_config_path(name), "w", encoding="utf-8") as h:
+                for key, value in variables.items():
+                    h.write(f"export {key}=\"{value}\"\n")
+                h.write("PKGEXT='.pkg.tar.zst'\n")
+                h.write("SRCEXT='.src.tar.zst'\n")
+
+    def _get_config_path(self, name: str) -> str:
+        return os.path.join(self._config_dir.name, f"makepkg_{name}.conf")
+
+    def get_makepkg_config(self, arch: Optional[str]) -> str:
+        return self._get_config_path("msys" if arch is None else arch)
+
+    def create_pool(self, size: int) -> BashPool:
+        env = os.environ.copy()
+        env.update(MSYSTEMS["msys"])
+        return BashPool(self.bash, size, [], env)
+
+    def get_printsrcinfo_command(self, pkgbuild_name: str, arch: Optional[str]) -> Tuple[List[str], Dict[str, str]]:
+        name = "msys" if arch is None else arch
+        env = dict(MSYSTEMS[name])
+        if arch is not None:
+            env["MINGW_ARCH"] = arch
+        command = [self.makepkg, "--config", self.get_makepkg_config(arch), "--printsrcinfo", "-p", pkgbuild_name]
+        return (command, env)
+
+    def find_libmakepkg(self) -> Optional[str]:
+        # <prefix>/bin/makepkg comes with <prefix>/share/makepkg
+        path = shutil.which(self.makepkg)
+        if path is None:
+            return None
+        libmakepkg = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(path))), "share", "makepkg")
+        if os.path.isfile(os.path.join(libmakepkg, "srcinfo.sh")):
+            return libmakepkg
+        return None
+
+    def close(self) -> None:
+        self._config_dir.cleanup()
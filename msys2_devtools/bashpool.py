@@ -0,0 +1,134 @@
+"""A pool of long-lived bash processes for running shell commands.
+
+Starting a (login) shell is slow with Cygwin, so instead of spawning one per
+command we keep a few bash processes around which run each command in a
+subshell. See bashworker.sh for the protocol.
+"""
+
+import os
+import queue
+import secrets
+import subprocess
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence
+
+BASHWORKER = os.path.join(os.path.dirname(__file__), "bashworker.sh")
+
+
+class BashWorker:
+    """A single bash process running commands one after another"""
+
+    def __init__(self, executable: str, args: Sequence[str] = (), env: Optional[Dict[str, str]] = None) -> None:
+        self._marker = secrets.token_hex(16)
+        self._proc = subprocess.Popen(
+            [executable] + list(args) + [BASHWORKER, self._marker],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+
+    def is_alive(self) -> bool:
+        return self._proc.poll() is None
+
+    def run(self, args: Sequence[str], cwd: str, env: Optional[Dict[str, str]] = None) -> tuple[int, bytes]:
+        """Runs the command in a subshell and returns the exit status and stdout.
+
+        Raises RuntimeError if the worker died, the worker can't be used afterwards.
+        """
+
+        assert self._proc.stdin is not None and self._proc.stdout is not None
+
+        envs = [f"{k}={v}" for k, v in (env or {}).items()]
+        fields = [cwd, str(len(envs))] + envs + [str(len(args))] + [str(a) for a in args]
+        request = b"".join(f.encode("utf-8") + b"\0" for f in fields)
+        try:
+            self._proc.stdin.write(request)
+            self._proc.stdin.flush()
+        except OSError:
+            self._kill()
+            raise RuntimeError("bash worker exited unexpectedly")
+
+        # The output can't contain NUL, so the first one starts the terminator
+        output: List[bytes] = []
+        while True:
+            line = self._proc.stdout.readline()
+            if not line:
+                self._kill()
+                raise RuntimeError("bash worker exited unexpectedly")
+            data, sep, rest = line.partition(b"\0")
+            output.append(data)
+            if sep:
+                parts = rest.split()
+                if len(parts) != 2 or parts[0] != self._marker.encode("ascii"):
+                    self._kill()
+                    raise RuntimeError("invalid response from bash worker")
+                return int(parts[1]), b"".join(output)
+
+    def _kill(self) -> None:
+        # Out of sync or dead, so make sure is_alive() is false and the pool drops it
+        self._proc.kill()
+        self._proc.wait()
+
+    def check_output(self, args: Sequence[str], cwd: str, env: Optional[Dict[str, str]] = None) -> bytes:
+        """Like subprocess.check_output(), raises CalledProcessError on failure"""
+
+        status, output = self.run(args, cwd, env)
+        if status != 0:
+            raise subprocess.CalledProcessError(status, list(args), output)
+        return output
+
+    def close(self) -> None:
+        if self._proc.stdin is not None:
+            self._proc.stdin.close()
+        self._proc.wait()
+        if self._proc.stdout is not None:
+            self._proc.stdout.close()
+
+
+class BashPool:
+    """A thread-safe pool of BashWorker instances, created on demand"""
+
+    def __init__(self, executable: str, size: int, args: Sequence[str] = (),
+                 env: Optional[Dict[str, str]] = None) -> None:
+        self._executable = executable
+        self._args = list(args)
+        self._env = env
+        self._idle: queue.LifoQueue[BashWorker] = queue.LifoQueue()
+        self._workers: List[BashWorker] = []
+        self._semaphore = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def worker(self) -> Iterator[BashWorker]:
+        """Reserves a worker for the current thread"""
+
+        with self._semaphore:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                worker = BashWorker(self._executable, self._args, self._env)
+                with self._lock:
+                    self._workers.append(worker)
+            try:
+                yield worker
+            finally:
+                if worker.is_alive():
+                    self._idle.put(worker)
+                else:
+                    with self._lock:
+                        self._workers.remove(worker)
+
+    def check_output(self, args: Sequence[str], cwd: str, env: Optional[Dict[str, str]] = None) -> bytes:
+        with self.worker() as worker:
+            return worker.check_output(args, cwd, env)
+
+    def close(self) -> None:
+        with self._lock:
+            workers = list(self._workers)
+            self._workers.clear()
+        for worker in workers:
+            worker.close()
+
+    def __enter__(self) -> "BashPool":
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
@@ -0,0 +1,50 @@
+#!/bin/bash
+# Runs commands sent over stdin, each one in a separate subshell.
+# Usage: bashworker.sh MARKER
+#
+# A request consists of NUL terminated fields:
+#   cwd, number of env vars, "NAME=value"..., number of args, args...
+# The response is the stdout of the command followed by:
+#   "\0MARKER <exit status>\n"
+# stderr is passed through. Commands run with errexit enabled, like with
+# "bash -ce".
+
+marker="$1"
+
+# Helpers which can be used as commands, to avoid spawning extra processes
+
+msys2_get_mingw_arch_list() {
+    set +e
+    source "$1"
+    ! declare -p mingw_arch &>/dev/null
+    echo -n "$? ${mingw_arch[@]}"
+}
+
+read_field() {
+    IFS= read -r -d '' "$1"
+}
+
+while read_field cwd; do
+    read_field count
+    envs=()
+    for ((i = 0; i < count; i++)); do
+        read_field value
+        envs+=("$value")
+    done
+    read_field count
+    args=()
+    for ((i = 0; i < count; i++)); do
+        read_field value
+        args+=("$value")
+    done
+
+    (
+        set -e
+        cd "$cwd" || exit 1
+        for value in "${envs[@]}"; do
+            export "$value"
+        done
+        "${args[@]}"
+    ) </dev/null
+    printf '\0%s %d\n' "$marker" "$?"
+done
@@ -0,0 +1,72 @@
+import argparse
+import sys
+
+from .db import PathTable, iter_repo_records
+from .fileindex import FileIndex, get_repo_name, load_file_index, write_file_index
+
+
+def create_index(args):
+    table = PathTable()
+    repos = []
+    for path in args.db:
+        with open(path, "rb") as h:
+            repos.append((get_repo_name(path), list(iter_repo_records(h, table))))
+    index = FileIndex.from_records(repos)
+    write_file_index(args.index, index)
+    print(f"Indexed {len(index)} paths of {len(index.get_packages())} packages")
+
+
+def print_matches(matches):
+    found = False
+    for path, (repo, package_id) in matches:
+        print(f"{repo}/{package_id} {path}")
+        found = True
+    if not found:
+        raise SystemExit(1)
+
+
+def query_owner(args):
+    index = load_file_index(args.index)
+    print_matches((p.lstrip("/"), owner) for p in args.path for owner in index.owners(p))
+
+
+def query_glob(args):
+    index = load_file_index(args.index)
+    print_matches(index.glob(args.pattern))
+
+
+def query_prefix(args):
+    index = load_file_index(args.index)
+    print_matches(index.iter_prefix(args.prefix))
+
+
+def add_parser(subparsers):
+    sub = subparsers.add_parser("index", help="Create an index from files databases")
+    sub.add_argument("index", help="The index file to write")
+    sub.add_argument("db", nargs="+", help="Files databases, like ucrt64.files.tar.zst")
+    sub.set_defaults(func=create_index)
+
+    sub = subparsers.add_parser("owner", help="List the packages containing the paths")
+    sub.add_argument("index", help="The index file")
+    sub.add_argument("path", nargs="+", help="Paths like /ucrt64/bin/libfoo.dll, directories end with a '/'")
+    sub.set_defaults(func=query_owner)
+
+    sub = subparsers.add_parser("glob", help="List the paths matching a pattern")
+    sub.add_argument("index", help="The index file")
+    sub.add_argument("pattern", help="A fnmatch pattern like '/ucrt64/lib/python3.*/site-packages/*.py'")
+    sub.set_defaults(func=query_glob)
+
+    sub = subparsers.add_parser("prefix", help="List the paths starting with a prefix")
+    sub.add_argument("index", help="The index file")
+    sub.add_argument("prefix", help="A path prefix like /ucrt64/share/licenses/")
+    sub.set_defaults(func=query_prefix)
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Query the files of the repos", allow_abbrev=False)
+    parser.set_defaults(func=lambda *x: parser.print_help())
+    subparsers = parser.add_subparsers(title="subcommands")
+    add_parser(subparsers)
+
+    args = parser.parse_args(sys.argv[1:])
+    args.func(args)
@@ -1,79 +1,91 @@
-import requests
-import os
 import argparse
-import sys
-import gzip
 import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from tabulate import tabulate
+
+from .artifacts import ArtifactCache, get_default_artifact_dir
+from .fileindex import get_repo_name
+from .lint import Finding, LintResult, get_rules, lint_repo_file
+from .srcinfo import iter_entry_srcinfos
+from .srcinfo_store import SrcinfoCache, open_srcinfo_cache
+from .utils import create_session
+
+DEFAULT_CONCURRENCY = 6
+
+REPO_URLS = [
+    "https://repo.msys2.org/msys/x86_64/msys.files.tar.zst",
+    "https://repo.msys2.org/mingw/clang32/clang32.files.tar.zst",
+    "https://repo.msys2.org/mingw/clang64/clang64.files.tar.zst",
+    "https://repo.msys2.org/mingw/ucrt64/ucrt64.files.tar.zst",
+    "https://repo.msys2.org/mingw/mingw32/mingw32.files.tar.zst",
+    "https://repo.msys2.org/mingw/mingw64/mingw64.files.tar.zst",
+]
+
+
+def print_findings(findings: list[Finding], output_format: str):
+    for finding in findings:
+        if output_format == "json":
+            print(json.dumps(finding.to_json()))
+            continue
+        if output_format == "full":
+            print(f"{finding.repo}: {finding.package}: {finding.message} [{finding.rule}]")
+        elif finding.paths:
+            print(f"{finding.message} for {finding.package}:")
+        else:
+            print(f"{finding.message} for {finding.package}")
+        for path in finding.paths:
+            print(f"  {path}")
 
-from .db import parse_repo
-from .srcinfo import parse_srcinfo
-
-
-def check_base_missing(repo):
-    """Check that all packages have a pkgbase."""
-
-    for package_id, desc in repo.items():
-        if "%BASE%" not in desc:
-            print(f"pkgbase not found for {package_id}")
-
-
-def check_pycache_missing(repo):
-    """Check that all .py files have a corresponding .pyc file."""
-
-    for package_id, desc in repo.items():
-        files = desc["%FILES%"]
-
-        mapping = {}
-
-        for f in files:
-            if f.endswith(".pyc"):
-                basename = os.path.basename(f)
-                parent = os.path.dirname(f)
-                if os.path.basename(parent) == "__pycache__":
-                    grandparentdir = os.path.dirname(parent)
-                    srcname = basename.replace(".opt-1.pyc", ".pyc").replace(".opt-2.pyc", ".pyc").rsplit(".", 2)[0]
-                    srcpath = os.path.join(grandparentdir, srcname + ".py")
-                else:
-                    srcpath = f[:-1]
-                mapping[srcpath] = f
-
-        missing = []
-        for f in files:
-            if f.endswith(".py"):
-                if os.path.basename(os.path.dirname(f)) == "bin":
-                    continue
-                if f not in mapping:
-                    missing.append(f)
 
-        if missing:
-            print(f"Missing .pyc files for {package_id}:")
-            for f in missing:
-                print(f"  {f}")
+def print_stats(results: list[LintResult]):
+    stats: dict[str, list] = {}
+    for result in results:
+        for name, rule_stats in result.stats.items():
+            totals = stats.setdefault(name, [0.0, 0, 0])
+            totals[0] += rule_stats.seconds
+            totals[1] += rule_stats.packages
+            totals[2] += rule_stats.findings
+    table = [[name, packages, findings, f"{seconds:.3f}"]
+             for name, (seconds, packages, findings) in sorted(stats.items(), key=lambda i: -i[1][0])]
+    print(tabulate(table, headers=["Rule", "Packages", "Findings", "Seconds"],
+                   colalign=("left", "right", "right", "right")), file=sys.stderr)
 
 
 def lint_repos(args):
-    REPO_URLS = [
-        "https://repo.msys2.org/msys/x86_64/msys.files.tar.zst",
-        "https://repo.msys2.org/mingw/clang32/clang32.files.tar.zst",
-        "https://repo.msys2.org/mingw/clang64/clang64.files.tar.zst",
-        "https://repo.msys2.org/mingw/ucrt64/ucrt64.files.tar.zst",
-        "https://repo.msys2.org/mingw/mingw32/mingw32.files.tar.zst",
-        "https://repo.msys2.org/mingw/mingw64/mingw64.files.tar.zst",
-    ]
-    for url in REPO_URLS:
-        r = requests.get(url)
-        r.raise_for_status()
-        repo = parse_repo(r.content)
-
-        check_base_missing(repo)
-        check_pycache_missing(repo)
-
-
-def check_srcinfo_same_pkgbase(srcinfo):
-    for value in srcinfo.values():
+    if args.list_rules:
+        for cls in get_rules():
+            print(f"{cls.name}: {cls.description}")
+        return
+
+    try:
+        rule_names = [cls.name for cls in get_rules(args.rule)]
+    except ValueError as e:
+        raise SystemExit(e)
+
+    # every repo gets linted in a worker process as soon as it is downloaded
+    futures = []
+    with ProcessPoolExecutor(args.jobs) as executor:
+        with create_session(args.concurrency) as session:
+            cache = ArtifactCache(args.cache_dir, session)
+            for url, path in cache.fetch_all(REPO_URLS, args.concurrency):
+                futures.append(executor.submit(lint_repo_file, get_repo_name(url), path, rule_names, args.index))
+        results = []
+        for future in futures:
+            result = future.result()
+            print_findings(result.findings, args.format)
+            results.append(result)
+
+    if args.stats:
+        print_stats(results)
+
+
+def check_srcinfo_same_pkgbase(srcinfo: SrcinfoCache):
+    for key, value in srcinfo.iter_parsed_entries(["path"]):
         pkgbases = set()
-        for srcinfo in value["srcinfo"].values():
-            base = parse_srcinfo(srcinfo)[0]
+        for arch, base, packages in iter_entry_srcinfos(value):
             pkgbases.add(base["pkgbase"][0])
         if len(pkgbases) > 1:
             print(f"Multiple pkgbase values found for {value['path']}: {pkgbases}")
@@ -87,21 +99,40 @@ def lint_srcinfos(args):
         "https://github.com/msys2/MINGW-packages/releases/download/srcinfo-cache/srcinfo.json.gz",
         "https://github.com/msys2/MSYS2-packages/releases/download/srcinfo-cache/srcinfo.json.gz",
     ]
-    for url in SRCINFO_URLS:
-        r = requests.get(url)
-        r.raise_for_status()
+    with create_session(args.concurrency) as session:
+        cache = ArtifactCache(args.cache_dir, session)
+        for url, path in cache.fetch_all(SRCINFO_URLS, args.concurrency):
+            with open_srcinfo_cache(path) as srcinfo_cache:
+                check_srcinfo_same_pkgbase(srcinfo_cache)
 
-        data = gzip.decompress(r.content)
-        srcinfo_cache = json.loads(data)
 
-        check_srcinfo_same_pkgbase(srcinfo_cache)
+def add_download_arguments(sub):
+    sub.add_argument("--cache-dir", default=get_default_artifact_dir(),
+                     help="Where to keep the downloaded files (default: %(default)s)")
+    sub.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                     help="Number of parallel downloads (default: %(default)s)")
 
 
 def add_parser(subparsers):
     sub = subparsers.add_parser("repos", help="Lint the repos")
+    add_download_arguments(sub)
+    sub.add_argument("--rule", action="append",
+                     help="Only run this rule, can be given multiple times (default: all)")
+    sub.add_argument("--list-rules", action="store_true", help="List all rules and exit")
+    sub.add_argument("--format", choices=["text", "full", "json"], default="text",
+                     help="Output format, full adds the repo and the rule to each finding, "
+                          "json outputs one finding per line (default: %(default)s)")
+    sub.add_argument("--index",
+                     help="A file index of the repos written by 'msys2-files index', used instead of "
+                          "building one for each repo (default: build one)")
+    sub.add_argument("--stats", action="store_true",
+                     help="Print the time and the number of findings per rule to stderr")
+    sub.add_argument("--jobs", type=int, default=min(len(REPO_URLS), os.cpu_count() or 1),
+                     help="Number of repos to lint in parallel (default: %(default)s)")
     sub.set_defaults(func=lint_repos)
 
     sub = subparsers.add_parser("srcinfos", help="Lint the srcinfos")
+    add_download_arguments(sub)
     sub.set_defaults(func=lint_srcinfos)
 
 
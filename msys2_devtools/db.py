@@ -1,4 +1,8 @@
 import io
+import sys
+from array import array
+from collections.abc import Sequence
+from typing import IO, Iterable, Iterator, Optional, Union, overload
 
 from .exttarfile import tarfile
 
@@ -22,31 +26,212 @@ def parse_desc(t: str) -> dict[str, list[str]]:
     return d
 
 
-def parse_repo(data: bytes) -> dict[str, dict[str, list[str]]]:
-    sources: dict[str, dict[str, list[str]]] = {}
+def _parse_package(infos: dict[str, str]) -> dict[str, list[str]]:
+    return parse_desc("".join(text for name, text in sorted(infos.items())))
 
-    with io.BytesIO(data) as f:
-        with tarfile.TarFile.open(fileobj=f, mode="r") as tar:
-            packages: dict[str, list] = {}
-            for info in tar:
-                package_id = info.name.split("/", 1)[0]
+
+def _iter_members(fileobj: IO[bytes]) -> Iterator[tuple[str, Optional[tuple[str, str]]]]:
+    """Yields the package ID for each file in the database, with the name and
+    content if it is one we need"""
+
+    with tarfile.TarFile.open(fileobj=fileobj, mode="r|*") as tar:
+        for info in tar:
+            if not info.isfile():
+                continue
+            package_id = info.name.split("/", 1)[0]
+            if info.name.endswith(("/desc", "/depends", "/files")):
                 infofile = tar.extractfile(info)
-                if infofile is None:
-                    continue
+                assert infofile is not None
                 with infofile:
-                    packages.setdefault(package_id, []).append(
-                        (info.name, infofile.read()))
-
-    for package_id, infos in sorted(packages.items()):
-        t = ""
-        for name, data in sorted(infos):
-            if name.endswith("/desc"):
-                t += data.decode("utf-8")
-            elif name.endswith("/depends"):
-                t += data.decode("utf-8")
-            elif name.endswith("/files"):
-                t += data.decode("utf-8")
-        desc = parse_desc(t)
-        sources[package_id] = desc
-
-    return sources
+                    yield package_id, (info.name, infofile.read().decode("utf-8"))
+            else:
+                yield package_id, None
+
+
+def iter_repo(fileobj: IO[bytes]) -> Iterator[tuple[str, dict[str, list[str]]]]:
+    """Yields the package IDs and parsed descs of a repo database, in the
+    order they are stored in.
+
+    The file gets read sequentially, so it can also be a non-seekable stream,
+    like a HTTP response. Each package is yielded as soon as all of its
+    entries are read, which relies on them being stored next to each other,
+    as repo-add does. Raises ValueError if they aren't, see parse_repo() for
+    that case.
+    """
+
+    current = None
+    seen: set[str] = set()
+    infos: dict[str, str] = {}
+    for package_id, member in _iter_members(fileobj):
+        if package_id != current:
+            if package_id in seen:
+                raise ValueError(f"The entries of {package_id} are not stored next to each other")
+            if current is not None:
+                yield current, _parse_package(infos)
+            seen.add(package_id)
+            current = package_id
+            infos = {}
+        if member is not None:
+            name, text = member
+            infos[name] = text
+    if current is not None:
+        yield current, _parse_package(infos)
+
+
+def parse_repo(data: bytes) -> dict[str, dict[str, list[str]]]:
+    """Returns the parsed descs of all packages, sorted by package ID. Unlike
+    iter_repo(), works with any order of the entries."""
+
+    packages: dict[str, dict[str, str]] = {}
+    with io.BytesIO(data) as f:
+        for package_id, member in _iter_members(f):
+            infos = packages.setdefault(package_id, {})
+            if member is not None:
+                name, text = member
+                infos[name] = text
+    return {package_id: _parse_package(infos) for package_id, infos in sorted(packages.items())}
+
+
+class PathTable:
+    """Stores each directory only once, shared by all FileLists of a repo"""
+
+    __slots__ = ("_index", "_dirs")
+
+    def __init__(self) -> None:
+        self._index: dict[str, int] = {}
+        self._dirs: list[str] = []
+
+    def add(self, directory: str) -> int:
+        index = self._index.get(directory)
+        if index is None:
+            index = len(self._dirs)
+            self._dirs.append(directory)
+            self._index[directory] = index
+        return index
+
+    def __getitem__(self, index: int) -> str:
+        return self._dirs[index]
+
+    def __len__(self) -> int:
+        return len(self._dirs)
+
+
+class FileList(Sequence[str]):
+    """The file paths of a package, as directory indices into a PathTable and
+    the base names joined into one string. Directory entries keep their
+    trailing slash as part of the base name."""
+
+    __slots__ = ("_table", "_dirs", "_names", "_ends")
+
+    def __init__(self, table: PathTable, paths: Iterable[str] = ()) -> None:
+        self._table = table
+        dirs = []
+        ends = []
+        names = []
+        end = 0
+        # files are sorted, so the directory is usually the same as before
+        last_dir = None
+        last_index = 0
+        for path in paths:
+            i = path.rfind("/", 0, len(path) - 1) + 1
+            directory = path[:i]
+            if directory != last_dir:
+                last_dir = directory
+                last_index = table.add(directory)
+            dirs.append(last_index)
+            names.append(path[i:])
+            end += len(path) - i
+            ends.append(end)
+        self._dirs = array("I", dirs)
+        self._ends = array("I", ends)
+        self._names = "".join(names)
+
+    def __len__(self) -> int:
+        return len(self._ends)
+
+    def _get_name(self, index: int) -> str:
+        start = self._ends[index - 1] if index else 0
+        return self._names[start:self._ends[index]]
+
+    @overload
+    def __getitem__(self, index: int) -> str: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> list[str]: ...
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[str, list[str]]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self._table[self._dirs[index]] + self._get_name(index)
+
+    def __iter__(self) -> Iterator[str]:
+        for directory, name in self.iter_split():
+            yield directory + name
+
+    @property
+    def table(self) -> PathTable:
+        return self._table
+
+    def iter_split(self) -> Iterator[tuple[str, str]]:
+        """Yields (directory, base name) for all paths"""
+
+        table = self._table
+        for directory, name in self.iter_indexed():
+            yield table[directory], name
+
+    def iter_indexed(self) -> Iterator[tuple[int, str]]:
+        """Yields (directory index in the table, base name) for all paths"""
+
+        names = self._names
+        start = 0
+        for directory, end in zip(self._dirs, self._ends):
+            yield directory, names[start:end]
+            start = end
+
+
+class PackageRecord:
+    """A compact version of a package desc. The file list is stored as a
+    FileList (None for databases without files), all other fields as tuples
+    with interned keys."""
+
+    __slots__ = ("package_id", "fields", "files")
+
+    def __init__(self, package_id: str, fields: dict[str, tuple[str, ...]], files: Optional[FileList]) -> None:
+        self.package_id = package_id
+        self.fields = fields
+        self.files = files
+
+    @classmethod
+    def from_desc(cls, package_id: str, desc: dict[str, list[str]], table: PathTable) -> "PackageRecord":
+        fields = {sys.intern(k): tuple(v) for k, v in desc.items() if k != "%FILES%"}
+        files = FileList(table, desc["%FILES%"]) if "%FILES%" in desc else None
+        return cls(package_id, fields, files)
+
+    def get(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        """Returns the first value of a field"""
+
+        values = self.fields.get(key)
+        return values[0] if values else default
+
+    def to_desc(self) -> dict[str, list[str]]:
+        desc = {k: list(v) for k, v in self.fields.items()}
+        if self.files is not None:
+            desc["%FILES%"] = list(self.files)
+        return desc
+
+    def __repr__(self) -> str:
+        return f"<{type(self).__name__} {self.package_id}>"
+
+
+def iter_repo_records(fileobj: IO[bytes], table: Optional[PathTable] = None) -> Iterator[PackageRecord]:
+    """Like iter_repo(), but yields PackageRecords. Pass the same table for
+    multiple repos to share the directories between them."""
+
+    if table is None:
+        table = PathTable()
+    for package_id, desc in iter_repo(fileobj):
+        yield PackageRecord.from_desc(package_id, desc, table)
@@ -0,0 +1,144 @@
+"""A persistent index of the packages in local repo databases.
+
+Stores the desc fields of all packages of the "*.db" files found in a
+directory tree in a SQLite database, so tools working on the repo mirror
+don't have to decompress and parse every database on each run. A database
+only gets re-read if its mtime or size changed since it was last indexed.
+"""
+
+import fnmatch
+import json
+import os
+import sqlite3
+from typing import Iterable, Iterator, Optional
+
+from .db import iter_repo
+from .utils import get_cache_dir
+
+# Bump in case the schema or the stored content changes
+SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE dbs (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE packages (
+    db TEXT NOT NULL REFERENCES dbs(path) ON DELETE CASCADE,
+    package_id TEXT NOT NULL,
+    filename TEXT,
+    name TEXT,
+    base TEXT,
+    version TEXT,
+    desc TEXT NOT NULL,
+    PRIMARY KEY (db, package_id)
+);
+"""
+
+
+def get_default_index_path() -> str:
+    return os.path.join(get_cache_dir(), "dbindex.sqlite")
+
+
+def find_dbs(target_dir: str) -> list[str]:
+    """Recursively look for DB files. The "*.db" files are usually symlinks
+    to the real DB files, and the paths of the symlinks are returned."""
+
+    db_paths = set()
+    target_dir = os.path.realpath(target_dir)
+    for root, dirs, files in os.walk(target_dir):
+        for name in files:
+            if fnmatch.fnmatch(name, "*.db"):
+                db_paths.add(os.path.join(root, name))
+
+    return sorted(db_paths)
+
+
+def _get_value(desc: dict[str, list[str]], key: str) -> Optional[str]:
+    values = desc.get(key)
+    return values[0] if values else None
+
+
+class DBIndex:
+    """The package index, see open_db_index()"""
+
+    def __init__(self, path: str) -> None:
+        self._conn = sqlite3.connect(path, timeout=60)
+        self._conn.execute("PRAGMA foreign_keys = ON")
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            with self._conn:
+                self._conn.execute("DROP TABLE IF EXISTS packages")
+                self._conn.execute("DROP TABLE IF EXISTS dbs")
+                self._conn.executescript(_SCHEMA)
+                self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def update(self, db_paths: Iterable[str]) -> list[str]:
+        """Re-indexes the DBs which changed since the last time, and removes
+        all DBs which no longer exist. Returns the paths of the re-indexed DBs."""
+
+        updated = []
+        known = {path: (mtime_ns, size) for path, mtime_ns, size in self._conn.execute(
+            "SELECT path, mtime_ns, size FROM dbs")}
+        for db_path in db_paths:
+            stat = os.stat(db_path)
+            if known.get(db_path) == (stat.st_mtime_ns, stat.st_size):
+                continue
+            with open(db_path, "rb") as h:
+                rows = []
+                for package_id, desc in iter_repo(h):
+                    rows.append((
+                        db_path, package_id, _get_value(desc, "%FILENAME%"), _get_value(desc, "%NAME%"),
+                        _get_value(desc, "%BASE%"), _get_value(desc, "%VERSION%"),
+                        json.dumps(desc, separators=(",", ":"))))
+            with self._conn:
+                self._conn.execute("DELETE FROM dbs WHERE path = ?", (db_path,))
+                self._conn.execute("INSERT INTO dbs VALUES (?, ?, ?)", (db_path, stat.st_mtime_ns, stat.st_size))
+                self._conn.executemany("INSERT INTO packages VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            updated.append(db_path)
+
+        with self._conn:
+            for db_path in known:
+                if not os.path.exists(db_path):
+                    self._conn.execute("DELETE FROM dbs WHERE path = ?", (db_path,))
+
+        return updated
+
+    def get_filenames(self, db_path: str) -> list[str]:
+        """Returns the package file names of a DB"""
+
+        return [r[0] for r in self._conn.execute(
+            "SELECT filename FROM packages WHERE db = ? ORDER BY package_id", (db_path,))]
+
+    def iter_packages(self, db_path: str) -> Iterator[tuple[str, dict[str, list[str]]]]:
+        """Yields the package IDs and descs of a DB"""
+
+        for package_id, desc in self._conn.execute(
+                "SELECT package_id, desc FROM packages WHERE db = ? ORDER BY package_id", (db_path,)):
+            yield package_id, json.loads(desc)
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self) -> "DBIndex":
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+
+def open_db_index(db_paths: Iterable[str], index_path: Optional[str] = None) -> DBIndex:
+    """Opens the index, creating it if needed, and brings it up to date for
+    the given DBs"""
+
+    if index_path is None:
+        index_path = get_default_index_path()
+    os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+    index = DBIndex(index_path)
+    try:
+        index.update(db_paths)
+    except BaseException:
+        index.close()
+        raise
+    return index
@@ -0,0 +1,253 @@
+"""An index of the files in the repo files databases, for ownership queries.
+
+Like in the FileLists of the package records, paths are split into the
+directory and the base name, with directory entries keeping their trailing
+slash as part of the base name. The directories are stored once in a sorted
+list, and for each directory the base names of its entries are stored sorted,
+so exact and prefix lookups are a binary search. Results are ordered by
+directory, then base name. Glob patterns use the part before the first
+wildcard as a prefix, so patterns starting with a directory are fast, while
+patterns starting with a wildcard have to look at all paths.
+
+Paths are relative to the root, like in the databases, a leading "/" in
+queries is ignored.
+"""
+
+import fnmatch
+import json
+import os
+import re
+import struct
+import zlib
+from array import array
+from bisect import bisect_left
+from typing import Iterable, Iterator, Optional
+
+from .db import PackageRecord
+
+FILE_INDEX_MAGIC = b"MSYS2-FILES-2\n"
+
+# sizes of the packages, directories, directory starts, names and owners blobs
+_HEADER = struct.Struct("<QQQQQ")
+
+# repo name and package ID
+Owner = tuple[str, str]
+
+_WILDCARD = re.compile(r"[*?\[]")
+
+
+def _normalize(path: str) -> str:
+    return path.lstrip("/")
+
+
+def _split(path: str) -> tuple[str, str]:
+    """Splits like FileList, the trailing slash of directories stays in the name"""
+
+    i = path.rfind("/", 0, len(path) - 1) + 1
+    return path[:i], path[i:]
+
+
+class FileIndex:
+
+    def __init__(self, packages: list[Owner], dirs: list[str], starts: array, names: list[str],
+                 owners: array) -> None:
+        """The entries of dirs[i] are names[starts[i]:starts[i + 1]] and the
+        matching owners, which are indices into packages"""
+
+        self._packages = packages
+        self._dirs = dirs
+        self._starts = starts
+        self._names = names
+        self._owners = owners
+
+    @classmethod
+    def from_records(cls, repos: Iterable[tuple[str, Iterable[PackageRecord]]]) -> "FileIndex":
+        """Builds the index from (repo name, records) pairs"""
+
+        packages: list[Owner] = []
+        dir_ids: dict[str, int] = {}
+        # the entry indices for each directory ID
+        entries: list[array] = []
+        names: list[str] = []
+        owners = array("I")
+        # PathTable indices to directory IDs, per table
+        table_ids: dict[int, dict[int, int]] = {}
+        for repo, records in repos:
+            for record in records:
+                owner = len(packages)
+                packages.append((repo, record.package_id))
+                if record.files is None:
+                    continue
+                table = record.files.table
+                mapping = table_ids.setdefault(id(table), {})
+                for directory, name in record.files.iter_indexed():
+                    dir_id = mapping.get(directory)
+                    if dir_id is None:
+                        dir_id = dir_ids.setdefault(table[directory], len(dir_ids))
+                        if dir_id == len(entries):
+                            entries.append(array("I"))
+                        mapping[directory] = dir_id
+                    entries[dir_id].append(len(names))
+                    names.append(name)
+                    owners.append(owner)
+
+        sorted_dirs = sorted(dir_ids)
+        starts = array("I", [0])
+        sorted_names: list[str] = []
+        sorted_owners = array("I")
+        for directory in sorted_dirs:
+            for i in sorted(entries[dir_ids[directory]], key=names.__getitem__):
+                sorted_names.append(names[i])
+                sorted_owners.append(owners[i])
+            starts.append(len(sorted_names))
+        return cls(packages, sorted_dirs, starts, sorted_names, sorted_owners)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def get_packages(self) -> list[Owner]:
+        return list(self._packages)
+
+    def _iter_dir(self, index: int, name_prefix: str = "") -> Iterator[tuple[str, Owner]]:
+        directory = self._dirs[index]
+        names = self._names
+        end = self._starts[index + 1]
+        i = bisect_left(names, name_prefix, self._starts[index], end)
+        while i < end and names[i].startswith(name_prefix):
+            yield directory + names[i], self._packages[self._owners[i]]
+            i += 1
+
+    def _find_dir(self, directory: str) -> Optional[int]:
+        i = bisect_left(self._dirs, directory)
+        if i < len(self._dirs) and self._dirs[i] == directory:
+            return i
+        return None
+
+    def _iter_range(self, prefix: str) -> Iterator[tuple[str, Owner]]:
+        # paths in a shorter directory, which can only be the one of the prefix
+        directory, name = _split(prefix)
+        index = self._find_dir(directory)
+        if index is not None:
+            yield from self._iter_dir(index, name)
+        # all paths in directories starting with the prefix
+        dirs = self._dirs
+        i = bisect_left(dirs, prefix)
+        while i < len(dirs) and dirs[i].startswith(prefix):
+            if i != index:
+                yield from self._iter_dir(i)
+            i += 1
+
+    def owners(self, path: str) -> list[Owner]:
+        """Returns the packages containing the path. Directories end with a "/"."""
+
+        path = _normalize(path)
+        directory, name = _split(path)
+        index = self._find_dir(directory)
+        if index is None:
+            return []
+        return [owner for p, owner in self._iter_dir(index, name) if p == path]
+
+    def iter_prefix(self, prefix: str) -> Iterator[tuple[str, Owner]]:
+        """Yields (path, owner) for all paths starting with the prefix"""
+
+        return self._iter_range(_normalize(prefix))
+
+    def glob(self, pattern: str) -> Iterator[tuple[str, Owner]]:
+        """Yields (path, owner) for all paths matching the fnmatch pattern.
+        Like with fnmatch, "*" also matches "/"."""
+
+        pattern = _normalize(pattern)
+        match = _WILDCARD.search(pattern)
+        if match is None:
+            prefix = pattern
+        else:
+            prefix = pattern[:match.start()]
+        regex = re.compile(fnmatch.translate(pattern))
+        for path, owner in self._iter_range(prefix):
+            if regex.match(path):
+                yield path, owner
+
+    def dumps(self) -> bytes:
+        blobs = [
+            zlib.compress(json.dumps(self._packages, separators=(",", ":")).encode("utf-8")),
+            zlib.compress("\n".join(self._dirs).encode("utf-8")),
+            zlib.compress(self._starts.tobytes()),
+            zlib.compress("\n".join(self._names).encode("utf-8")),
+            zlib.compress(self._owners.tobytes()),
+        ]
+        return FILE_INDEX_MAGIC + _HEADER.pack(*map(len, blobs)) + b"".join(blobs)
+
+    @classmethod
+    def loads(cls, data: bytes) -> "FileIndex":
+        if not data.startswith(FILE_INDEX_MAGIC):
+            raise ValueError("not a file index")
+        offset = len(FILE_INDEX_MAGIC)
+        sizes = _HEADER.unpack_from(data, offset)
+        offset += _HEADER.size
+        blobs = []
+        for size in sizes:
+            blobs.append(zlib.decompress(data[offset:offset + size]))
+            offset += size
+        packages = [(repo, package_id) for repo, package_id in json.loads(blobs[0])]
+        starts = array("I")
+        starts.frombytes(blobs[2])
+        # the top level directory is an empty string, so this can't use split() for the directories
+        dirs = blobs[1].decode("utf-8").split("\n") if len(starts) > 1 else []
+        names = blobs[3].decode("utf-8").split("\n") if blobs[3] else []
+        owners = array("I")
+        owners.frombytes(blobs[4])
+        return cls(packages, dirs, starts, names, owners)
+
+
+def write_file_index(path: str, index: FileIndex) -> None:
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as h:
+        h.write(index.dumps())
+    os.replace(temp_path, path)
+
+
+def load_file_index(path: str) -> FileIndex:
+    with open(path, "rb") as h:
+        return FileIndex.loads(h.read())
+
+
+def get_repo_name(path: str) -> str:
+    """Returns the repo name for a files DB path, like "ucrt64" for "ucrt64.files.tar.zst" """
+
+    name = os.path.basename(path)
+    return name.split(".files", 1)[0]
+
+
+def get_pycache_source(path: str) -> Optional[str]:
+    """Returns the .py file a .pyc file belongs to, or None"""
+
+    if not path.endswith(".pyc"):
+        return None
+    parent, basename = path.rsplit("/", 1) if "/" in path else ("", path)
+    if parent.rsplit("/", 1)[-1] == "__pycache__":
+        grandparent = parent.rsplit("/", 1)[0] if "/" in parent else ""
+        srcname = basename.replace(".opt-1.pyc", ".pyc").replace(".opt-2.pyc", ".pyc").rsplit(".", 2)[0]
+        return (grandparent + "/" if grandparent else "") + srcname + ".py"
+    return path[:-1]
+
+
+def find_missing_pycache(index: FileIndex, repo: Optional[str] = None) -> dict[Owner, list[str]]:
+    """Returns all .py files for which the same package doesn't contain a
+    .pyc file, excluding the ones in "bin" directories. Optionally only for
+    the packages of one repo."""
+
+    missing: dict[Owner, list[str]] = {}
+    for path, owner in index.glob("*.py"):
+        if repo is not None and owner[0] != repo:
+            continue
+        directory, _, basename = path.rpartition("/")
+        if directory.rsplit("/", 1)[-1] == "bin":
+            continue
+        prefix = (directory + "/" if directory else "") + "__pycache__/" + basename[:-3] + "."
+        candidates = list(index.iter_prefix(prefix)) + [(path + "c", o) for o in index.owners(path + "c")]
+        for candidate, candidate_owner in candidates:
+            if candidate_owner == owner and get_pycache_source(candidate) == path:
+                break
+        else:
+            missing.setdefault(owner, []).append(path)
+    return missing
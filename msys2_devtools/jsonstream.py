@@ -0,0 +1,98 @@
+"""Incremental reading of large JSON files.
+
+Allows iterating over the items of an array in a JSON object, without
+loading the whole document into memory.
+"""
+
+import json
+import re
+from typing import Any, IO, Iterator
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+_decoder = json.JSONDecoder()
+
+
+class _Reader:
+    """A buffer over a text file, which gets refilled as needed"""
+
+    def __init__(self, fileobj: IO[str], chunk_size: int) -> None:
+        self._fileobj = fileobj
+        self._chunk_size = chunk_size
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self) -> bool:
+        if self._eof:
+            return False
+        chunk = self._fileobj.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Returns the next non-whitespace character, or an empty string at the end"""
+
+        while True:
+            self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, chars: str) -> str:
+        c = self.peek()
+        if not c or c not in chars:
+            raise ValueError(f"expected one of {chars!r}, got {c!r}")
+        self._pos += 1
+        return c
+
+    def decode(self) -> Any:
+        """Decodes the next JSON value"""
+
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                # maybe just incomplete, try again with more data
+                if not self._fill():
+                    raise
+                continue
+            # a number could continue in the next chunk
+            if end == len(self._buffer) and not self._eof and isinstance(value, (int, float)):
+                if self._fill():
+                    continue
+            self._pos = end
+            return value
+
+
+def iter_object_array(fileobj: IO[str], key: str, chunk_size: int = 1024 * 1024) -> Iterator[Any]:
+    """Yields the items of the array at 'key' of the top level JSON object in
+    the file, loading one item at a time. All other values of the object
+    are skipped."""
+
+    reader = _Reader(fileobj, chunk_size)
+    reader.expect("{")
+    if reader.peek() == "}":
+        return
+    while True:
+        name = reader.decode()
+        reader.expect(":")
+        if name == key and reader.peek() == "[":
+            reader.expect("[")
+            if reader.peek() != "]":
+                while True:
+                    yield reader.decode()
+                    if reader.expect(",]") == "]":
+                        break
+            else:
+                reader.expect("]")
+        else:
+            reader.decode()
+        if reader.expect(",}") == "}":
+            break
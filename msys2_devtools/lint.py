@@ -0,0 +1,170 @@
+"""Rules for linting the packages of a repo.
+
+Every rule is a class registered with register_rule(). For each repo a new
+instance of each selected rule gets fed all package records in a single
+pass, and can report findings per package and once all packages are seen.
+Rules which need to look at the files of all packages get a FileIndex of the
+repo, which is built in the same pass, or an existing one which contains it.
+"""
+
+import time
+from functools import lru_cache
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+from .db import PackageRecord, iter_repo_records
+from .fileindex import FileIndex, find_missing_pycache, load_file_index
+
+
+class Finding(NamedTuple):
+    rule: str
+    repo: str
+    package: str
+    message: str
+    paths: tuple[str, ...] = ()
+
+    def to_json(self) -> dict:
+        return self._asdict() | {"paths": list(self.paths)}
+
+
+class RuleStats(NamedTuple):
+    seconds: float
+    packages: int
+    findings: int
+
+
+class LintResult(NamedTuple):
+    repo: str
+    findings: list[Finding]
+    stats: dict[str, RuleStats]
+
+
+class Rule:
+
+    name: str
+    description: str
+
+    uses_index = False
+    """If check_index() should be called"""
+
+    def __init__(self, repo: str) -> None:
+        self.repo = repo
+
+    def finding(self, package: str, message: str, paths: Iterable[str] = ()) -> Finding:
+        return Finding(self.name, self.repo, package, message, tuple(paths))
+
+    def check_package(self, record: PackageRecord) -> Iterable[Finding]:
+        """Called for every package of the repo"""
+
+        return ()
+
+    def check_index(self, index: FileIndex) -> Iterable[Finding]:
+        """Called with a file index containing the repo after all packages were
+        passed to check_package(), if uses_index is set. The index can contain
+        other repos as well."""
+
+        return ()
+
+    def finish(self) -> Iterable[Finding]:
+        """Called after all packages of the repo were passed to check_package()"""
+
+        return ()
+
+
+RULES: dict[str, type[Rule]] = {}
+
+
+def register_rule(cls: type[Rule]) -> type[Rule]:
+    RULES[cls.name] = cls
+    return cls
+
+
+def get_rules(names: Optional[Iterable[str]] = None) -> list[type[Rule]]:
+    """Returns the rules with the given names, or all of them"""
+
+    if names is None:
+        return list(RULES.values())
+    rules = []
+    for name in names:
+        if name not in RULES:
+            raise ValueError(f"Unknown rule: {name}")
+        rules.append(RULES[name])
+    return rules
+
+
+@register_rule
+class BaseMissing(Rule):
+
+    name = "base-missing"
+    description = "Check that all packages have a pkgbase"
+
+    def check_package(self, record: PackageRecord) -> Iterable[Finding]:
+        if "%BASE%" not in record.fields:
+            yield self.finding(record.package_id, "pkgbase not found")
+
+
+@register_rule
+class PycacheMissing(Rule):
+
+    name = "pycache-missing"
+    description = "Check that all .py files have a corresponding .pyc file"
+    uses_index = True
+
+    def check_index(self, index: FileIndex) -> Iterable[Finding]:
+        for (repo, package_id), missing in sorted(find_missing_pycache(index, self.repo).items()):
+            yield self.finding(package_id, "Missing .pyc files", missing)
+
+
+def lint_records(repo: str, records: Iterable[PackageRecord], rule_names: Optional[Iterable[str]] = None,
+                 index: Optional[FileIndex] = None) -> LintResult:
+    """Runs the rules over all packages of a repo, in one pass. The findings
+    are grouped by rule. In case no file index containing the repo is passed,
+    one gets built if needed."""
+
+    rules = [cls(repo) for cls in get_rules(rule_names)]
+    findings: dict[str, list[Finding]] = {r.name: [] for r in rules}
+    seconds = dict.fromkeys([r.name for r in rules], 0.0)
+    packages = 0
+
+    def run(rule: Rule, result: Iterable[Finding]) -> None:
+        start = time.perf_counter()
+        found = list(result)
+        seconds[rule.name] += time.perf_counter() - start
+        findings[rule.name].extend(found)
+
+    def iter_checked() -> Iterator[PackageRecord]:
+        nonlocal packages
+        for record in records:
+            packages += 1
+            for rule in rules:
+                run(rule, rule.check_package(record))
+            yield record
+
+    # the index only keeps the file names, not the records
+    if index is None and any(rule.uses_index for rule in rules):
+        index = FileIndex.from_records([(repo, iter_checked())])
+    else:
+        for record in iter_checked():
+            pass
+
+    for rule in rules:
+        if index is not None and rule.uses_index:
+            run(rule, rule.check_index(index))
+        run(rule, rule.finish())
+
+    stats = {r.name: RuleStats(seconds[r.name], packages, len(findings[r.name])) for r in rules}
+    return LintResult(repo, [f for r in rules for f in findings[r.name]], stats)
+
+
+@lru_cache(maxsize=1)
+def _load_file_index(path: str) -> FileIndex:
+    return load_file_index(path)
+
+
+def lint_repo_file(repo: str, path: str, rule_names: Optional[list[str]] = None,
+                   index_path: Optional[str] = None) -> LintResult:
+    """Like lint_records() for a repo database file, can be run in a worker process.
+    index_path is a file index written by "msys2-files index" containing the repo."""
+
+    index = _load_file_index(index_path) if index_path is not None else None
+    with open(path, "rb") as h:
+        return lint_records(repo, iter_repo_records(h), rule_names, index)
@@ -1,20 +1,19 @@
-from typing import Collection, Dict, Union
+from typing import Collection, Dict, Optional, Union
 import json
 import subprocess
 import os
 
 PKGBUILD2JSON = os.path.join(os.path.dirname(__file__), "pkgbuild2json.sh")
+PKGBUILDDUMP = os.path.join(os.path.dirname(__file__), "pkgbuilddump.sh")
 
+EXTRA_META_PREFIXES = ["mingw_", "msys2_"]
 
-def get_extra_meta_for_pkgbuild(msys2_root: str, pkgbuild_path: str) -> \
-        Dict[str, Union[str, Collection[str], Dict[str, Union[str, None]]]]:
-    """Returns a dict with the MSYS2 specific metadata from the PKGBUILD file"""
+ExtraMeta = Dict[str, Union[str, Collection[str], Dict[str, Union[str, None]]]]
+
+
+def parse_extra_meta(out: str) -> ExtraMeta:
+    """Returns the MSYS2 specific metadata from the output of pkgbuild2json.sh"""
 
-    executable = os.path.join(msys2_root, 'usr', 'bin', 'bash.exe')
-    prefixes = ["mingw_", "msys2_"]
-    out = subprocess.check_output(
-        [executable, PKGBUILD2JSON, pkgbuild_path] + prefixes,
-        text=True, encoding="utf-8")
     data = json.loads(out)
 
     meta = {}
@@ -25,3 +24,20 @@ def get_extra_meta_for_pkgbuild(msys2_root: str, pkgbuild_path: str) -> \
             key = key.split("_", 1)[-1]
             meta[key] = value
     return meta
+
+
+def get_extra_meta_for_pkgbuild(msys2_root: Optional[str], pkgbuild_path: str, bash: Optional[str] = None) -> ExtraMeta:
+    """Returns a dict with the MSYS2 specific metadata from the PKGBUILD file.
+
+    Uses the bash from msys2_root, or the one passed via 'bash'.
+    """
+
+    if bash is not None:
+        executable = bash
+    else:
+        assert msys2_root is not None
+        executable = os.path.join(msys2_root, 'usr', 'bin', 'bash.exe')
+    out = subprocess.check_output(
+        [executable, PKGBUILD2JSON, pkgbuild_path] + EXTRA_META_PREFIXES,
+        text=True, encoding="utf-8")
+    return parse_extra_meta(out)
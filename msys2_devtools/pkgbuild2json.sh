@@ -6,8 +6,8 @@
 #   "prefix1_name1": "value1",
 #   "prefix2_name2": ["element1", "element2", ...]
 # }
-
-set -e
+#
+# Can also be sourced without arguments, to only define the functions.
 
 escape_json_string() {
     local json_string
@@ -81,4 +81,7 @@ main() {
     get_variables_as_json "$pkgbuild" "$@"
 }
 
-main "$@"
+if [[ $# -gt 0 ]]; then
+    set -e
+    main "$@"
+fi
@@ -0,0 +1,68 @@
+#!/bin/bash
+# Outputs the SRCINFO for each arch and the extra metadata of a PKGBUILD,
+# using libmakepkg directly instead of starting makepkg once per arch.
+# Needs to be sourced from bashworker.sh, using the path as seen from bash.
+# Usage: source pkgbuilddump.sh PKGBUILD MODE LIBRARY CONFIG DEFAULT_ARCHES [prefix1 prefix2...]
+#
+# MODE is "msys" or "mingw", LIBRARY the libmakepkg directory and CONFIG the
+# makepkg config to use, with "@ARCH@" getting replaced by the arch.
+# DEFAULT_ARCHES is a space separated list of arches, used in case the
+# PKGBUILD doesn't set mingw_arch.
+#
+# Each part of the output starts with "\x1e" and a header line:
+#   "srcinfo ARCH": the output of "makepkg --printsrcinfo" for the arch
+#   "extra": the output of pkgbuild2json.sh for the prefixes
+
+# makepkg and pkgbuild2json.sh don't use errexit either
+set +e
+
+_msys2_pkgbuild="$1"
+_msys2_mode="$2"
+_msys2_library="$3"
+_msys2_config="$4"
+_msys2_default_arches="$5"
+_msys2_prefixes=("${@:6}")
+
+# without arguments, otherwise it would get ours and run on them
+set --
+source "$(dirname "${BASH_SOURCE[0]}")/pkgbuild2json.sh"
+
+printf '\x1eextra\n'
+( get_variables_as_json "$_msys2_pkgbuild" "${_msys2_prefixes[@]}" ) || exit
+
+if [[ "$_msys2_mode" == "mingw" ]]; then
+    read -r _msys2_exists _msys2_arches <<< "$(msys2_get_mingw_arch_list "$_msys2_pkgbuild")" || exit
+    if [[ "$_msys2_exists" == "0" ]]; then
+        _msys2_arches="$_msys2_default_arches"
+    fi
+else
+    _msys2_arches="msys"
+fi
+
+for _msys2_lib in "$_msys2_library"/*.sh; do
+    source "$_msys2_lib" || exit
+done
+shopt -s extglob
+
+# Does what makepkg --printsrcinfo does after parsing its arguments
+for _msys2_arch in $_msys2_arches; do
+    printf '\x1esrcinfo %s\n' "$_msys2_arch"
+    (
+        if [[ "$_msys2_mode" == "mingw" ]]; then
+            export MSYSTEM="${_msys2_arch^^}" MINGW_ARCH="$_msys2_arch"
+        fi
+        source "${_msys2_config//@ARCH@/$_msys2_arch}" || exit
+        startdir="$PWD"
+        srcdir="$startdir/src"
+        pkgdir="$startdir/pkg"
+        if declare -F source_buildfile >/dev/null; then
+            source_buildfile "$_msys2_pkgbuild"
+        else
+            source_safe "$_msys2_pkgbuild"
+        fi
+        pkgbase=${pkgbase:-${pkgname[0]}}
+        epoch=${epoch:-0}
+        lint_pkgbuild || exit
+        write_srcinfo_content
+    ) || exit
+done
@@ -1,5 +1,8 @@
+import hashlib
+import json
+from functools import cache, lru_cache
 from pydantic import BaseModel, Field
-from typing import Sequence, Collection
+from typing import Any, Mapping, Sequence, Collection
 
 
 class PkgExtraEntry(BaseModel):
@@ -43,6 +46,39 @@ def convert_mapping(array: Sequence[str]) -> dict[str, list[str | None]]:
     return converted
 
 
+@lru_cache(maxsize=4096)
+def _convert_references(array: tuple[str, ...]) -> dict[str, list[str | None]]:
+    return convert_mapping(array)
+
+
+def get_references(data: Mapping[str, Any]) -> Mapping[str, list[str | None]]:
+    """Returns the same as extra_to_pkgextra_entry(data).references, without
+    creating and validating the whole entry. The result is shared between
+    calls, so it must not be modified.
+    """
+
+    value = data.get("references")
+    if not value:
+        return {}
+    assert isinstance(value, list)
+    return _convert_references(tuple(value))
+
+
+# Bump in case extra_to_pkgextra_entry() validates differently, without a schema change
+VALIDATION_VERSION = 1
+
+
+@cache
+def get_schema_version() -> str:
+    """Returns an identifier which changes when the PkgExtraEntry schema or
+    VALIDATION_VERSION changes, to know if extra data validated in the past
+    needs to be validated again"""
+
+    schema = json.dumps(PkgExtraEntry.model_json_schema(), sort_keys=True)
+    h = hashlib.sha256(f"{VALIDATION_VERSION}\n{schema}".encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
 def extra_to_pkgextra_entry(data: dict[str, str | Collection[str]]) -> PkgExtraEntry:
     mappings = ["references"]
 
@@ -4,23 +4,54 @@ Extracts the pypi project names from the srcinfo file and then fetches all
 project related information from the PyPI API. The results are stored in a cache
 file. Repeated runs will only fetch the data for new packages or packages that
 have been updated on PyPI.
+
+The cache file also stores the last global PyPI serial seen, so later runs
+only need to ask PyPI for the projects changed since then, instead of loading
+the serials of all projects on PyPI.
 """
 
 import requests
 import json
 import gzip
 import logging
+import os
 import sys
 import re
 import argparse
-from typing import Dict, List
+import xmlrpc.client
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from xml.parsers.expat import ExpatError
 
 from packageurl import PackageURL
 
-from .pkgextra import extra_to_pkgextra_entry
+from .pkgextra import get_references
+from .srcinfo_store import open_srcinfo_cache
+from .utils import create_session
 
 log = logging.getLogger(__name__)
 
+PYPI_URL = "https://pypi.org"
+
+DEFAULT_CONCURRENCY = 8
+
+Projection = Dict[str, Optional[List[str]]]
+
+# The parts of the project metadata we store. None keeps the whole value, a
+# list of keys keeps only those keys of an object, or of each object in a list.
+DEFAULT_PROJECTION: Projection = {
+    "info": [
+        "name", "version", "summary", "home_page", "project_urls", "license", "license_expression",
+        "requires_python", "yanked", "yanked_reason", "package_url", "project_url", "release_url",
+    ],
+    "urls": [
+        "filename", "packagetype", "python_version", "requires_python", "digests", "size", "url",
+        "upload_time_iso_8601", "yanked", "yanked_reason",
+    ],
+    "vulnerabilities": None,
+    "last_serial": None,
+}
+
 
 def normalize(name):
     # https://packaging.python.org/en/latest/specifications/name-normalization/
@@ -30,19 +61,16 @@ def normalize(name):
 def get_project_names(srcinfo_path: str):
     """Returns all pypi project names from the PKGMETA.yml file."""
 
-    with open(srcinfo_path, "rb") as h:
-        cache = json.loads(gzip.decompress(h.read()))
-
     names = []
-    for entry in cache.values():
-        if "extra" in entry:
-            pkgextra = extra_to_pkgextra_entry(entry["extra"])
-            if "pypi" in pkgextra.references:
-                for value in pkgextra.references["pypi"]:
+    with open_srcinfo_cache(srcinfo_path) as cache:
+        for key, extra in cache.iter_field("extra"):
+            references = get_references(extra)
+            if "pypi" in references:
+                for value in references["pypi"]:
                     if value is not None:
                         names.append(normalize(value))
-            if "purl" in pkgextra.references:
-                for value in pkgextra.references["purl"]:
+            if "purl" in references:
+                for value in references["purl"]:
                     if value is not None:
                         purl = PackageURL.from_string(value)
                         if purl.type == "pypi":
@@ -50,8 +78,8 @@ def get_project_names(srcinfo_path: str):
     return names
 
 
-def get_all_serials() -> dict[str, int]:
-    """Get the last serial for each package on PyPI.
+def get_all_serials(session: requests.Session, base_url: str = PYPI_URL) -> tuple[dict[str, int], Optional[int]]:
+    """Get the last serial for each package on PyPI, and the global last serial.
 
     It looks like this can be out of date for up to one day compared to
     the other API, so the serials might be outdated slightly for recently
@@ -60,8 +88,8 @@ def get_all_serials() -> dict[str, int]:
 
     log.info("Getting all serials from PyPI")
     # https://peps.python.org/pep-0691
-    r = requests.get(
-        "https://pypi.org/simple",
+    r = session.get(
+        f"{base_url}/simple/",
         headers={"Accept": "application/vnd.pypi.simple.v1+json"})
     r.raise_for_status()
     index = r.json()
@@ -69,72 +97,205 @@ def get_all_serials() -> dict[str, int]:
     serials = {}
     for project in projects:
         serials[normalize(project["name"])] = project["_last-serial"]
-    return serials
+    last_serial = r.headers.get("X-PyPI-Last-Serial")
+    return serials, int(last_serial) if last_serial is not None else None
 
 
-def get_project_metadata(project_name: str) -> dict:
-    """Get the metadata for a single project on PyPI."""
+def call_xmlrpc(session: requests.Session, method: str, *params: object, base_url: str = PYPI_URL) -> object:
+    r = session.post(
+        f"{base_url}/pypi", data=xmlrpc.client.dumps(params, method),
+        headers={"Content-Type": "text/xml"})
+    r.raise_for_status()
+    # raises Fault in case the server returned one instead of a result
+    result, _ = xmlrpc.client.loads(r.content)
+    if len(result) != 1:
+        raise xmlrpc.client.ResponseError(f"unexpected response for {method}: {result!r}")
+    return result[0]
+
+
+def get_changed_projects(session: requests.Session, serial: int, base_url: str = PYPI_URL) -> tuple[set[str], int]:
+    """Returns the names of all projects changed on PyPI since the global serial,
+    and the new global serial."""
+
+    log.info(f"Getting changes on PyPI since serial {serial}")
+    # https://docs.pypi.org/api/changelog/
+    changed = set()
+    while True:
+        # returns a limited amount of events per call, so repeat until there are none
+        events = call_xmlrpc(session, "changelog_since_serial", serial, base_url=base_url)
+        assert isinstance(events, list)
+        if not events:
+            break
+        for name, version, timestamp, action, event_serial in events:
+            changed.add(normalize(name))
+            serial = max(serial, event_serial)
+    log.info(f"{len(changed)} projects changed, now at serial {serial}")
+    return changed, serial
+
+
+def get_project_metadata(session: requests.Session, project_name: str, base_url: str = PYPI_URL,
+                         etag: Optional[str] = None) -> tuple[Optional[dict], Optional[str]]:
+    """Get the metadata for a single project on PyPI, and its ETag.
+
+    If an ETag is passed and the metadata hasn't changed since, returns None
+    instead of the metadata.
+    """
 
     log.info(f"Getting metadata for {project_name}")
     # https://warehouse.pypa.io/api-reference/json.html
-    r = requests.get(
-        f"https://pypi.org/pypi/{project_name}/json")
+    headers = {"If-None-Match": etag} if etag is not None else {}
+    r = session.get(
+        f"{base_url}/pypi/{project_name}/json", headers=headers)
+    if r.status_code == 304:
+        return None, etag
+    if r.status_code == 404:
+        raise Exception(f"Project {project_name!r} not found on PyPI")
     r.raise_for_status()
     payload = r.json()
     # by removing the deprecated "releases" part we make it
     # the same as <project_name>/<version>/json
     del payload["releases"]
-    return payload
+    return payload, r.headers.get("ETag")
 
 
-def dump_pypi_metadata(project_names: list[str], output_path: str):
-    """Dump the metadata for a list of projects on PyPI.
+def project_metadata(project: dict, projection: Optional[Projection]) -> dict:
+    """Returns only the parts of the project metadata selected by the projection.
+    "last_serial" is always included."""
+
+    if projection is None:
+        return project
+
+    def project_keys(value, keys):
+        if keys is None:
+            return value
+        elif isinstance(value, list):
+            return [project_keys(v, keys) for v in value]
+        elif isinstance(value, dict):
+            return {k: value[k] for k in keys if k in value}
+        return value
+
+    projected = {}
+    for key, keys in projection.items():
+        if key in project:
+            projected[key] = project_keys(project[key], keys)
+    projected["last_serial"] = project["last_serial"]
+    return projected
 
-    If output_path already exists its content will be re-used if possible.
-    """
 
-    serials = get_all_serials()
+def load_pypi_metadata(path: str, projection: Optional[Projection]) -> Dict:
+    """Loads an existing cache file, if there is one, and applies the projection
+    to it. In case the file was created with a different projection, the
+    projects are dropped, since they might be missing fields."""
 
-    old_metadata: Dict = {"projects": {}}
     try:
-        with open(output_path, "rb") as h:
-            old_metadata = json.loads(gzip.decompress(h.read()))
+        with open(path, "rb") as h:
+            metadata = json.loads(gzip.decompress(h.read()))
     except FileNotFoundError:
-        pass
+        return {"projects": {}}
 
-    # Check first to fail fast if any project is not found
-    for project_name in project_names:
-        if project_name not in serials:
-            raise Exception(f"Project {project_name!r} not found on PyPI")
+    # files from before projections existed contain the full metadata
+    old_projection = metadata.get("projection")
+    if old_projection is not None and old_projection != projection:
+        log.info("The projection has changed, ignoring the existing metadata")
+        return {"projects": {}}
+    if old_projection is None and projection is not None:
+        metadata["projects"] = {
+            n: project_metadata(p, projection) for n, p in metadata["projects"].items()}
+    return metadata
 
-    new_metadata: Dict = {"projects": {}}
-    for project_name in project_names:
-        project = None
 
-        # if the project is already in the metadata file, and the serial
-        # hasn't changed, we can just copy the old metadata
-        if project_name in old_metadata["projects"]:
-            old_project = old_metadata["projects"][project_name]
-            if old_project["last_serial"] == serials[project_name]:
-                project = old_project
+def dump_pypi_metadata(project_names: list[str], output_path: str, concurrency: int = DEFAULT_CONCURRENCY,
+                       base_url: str = PYPI_URL, projection: Optional[Projection] = DEFAULT_PROJECTION):
+    """Dump the metadata for a list of projects on PyPI.
+
+    If output_path already exists its content will be re-used if possible.
+    Up to 'concurrency' projects are fetched at the same time. Only the parts
+    selected by the projection are stored, or everything if it is None.
+    """
 
-        if project is None:
-            project = get_project_metadata(project_name)
+    old_metadata = load_pypi_metadata(output_path, projection)
+    old_projects = old_metadata["projects"]
+    old_etags = old_metadata.get("etags", {})
+    old_serial = old_metadata.get("last_serial")
 
-        new_metadata["projects"][project_name] = project
+    project_names = list(dict.fromkeys(project_names))
+    # the only POST requests are read-only XML-RPC calls, so they can be retried
+    session = create_session(concurrency, ["GET", "POST"])
+    revalidate = False
+    if old_serial is None:
+        # first run, so we need the serials of all projects
+        serials, last_serial = get_all_serials(session, base_url)
 
-    with open(output_path, "wb") as h:
-        h.write(gzip.compress(json.dumps(new_metadata, indent=2).encode("utf-8")))
+        # Check first to fail fast if any project is not found
+        for project_name in project_names:
+            if project_name not in serials:
+                raise Exception(f"Project {project_name!r} not found on PyPI")
+
+        # if the project is already in the metadata file, and the serial
+        # hasn't changed, we can just copy the old metadata
+        unchanged = {n for n in project_names if n in old_projects and old_projects[n]["last_serial"] == serials[n]}
+    else:
+        try:
+            changed, last_serial = get_changed_projects(session, old_serial, base_url)
+            unchanged = {n for n in project_names if n in old_projects and n not in changed}
+        except (requests.RequestException, xmlrpc.client.Error, ExpatError) as e:
+            # ask for every project, but only download the ones that have changed
+            log.warning(f"Getting the changes failed ({e}), falling back to conditional requests")
+            last_serial = old_serial
+            unchanged = set()
+            revalidate = True
+
+    def fetch(project_name: str) -> tuple[Optional[dict], Optional[str]]:
+        etag = old_etags.get(project_name) if revalidate and project_name in old_projects else None
+        return get_project_metadata(session, project_name, base_url, etag)
+
+    to_fetch = [n for n in project_names if n not in unchanged]
+    fetched = {}
+    with session, ThreadPoolExecutor(concurrency) as executor:
+        for project_name, (project, etag) in zip(to_fetch, executor.map(fetch, to_fetch)):
+            if project is not None:
+                project = project_metadata(project, projection)
+            fetched[project_name] = (project, etag)
+
+    # keeps the order of project_names, independent of when the fetches finished
+    new_metadata: Dict = {"last_serial": last_serial, "projection": projection, "projects": {}, "etags": {}}
+    for project_name in project_names:
+        project, etag = fetched.get(project_name, (None, old_etags.get(project_name)))
+        new_metadata["projects"][project_name] = project if project is not None else old_projects[project_name]
+        if etag is not None:
+            new_metadata["etags"][project_name] = etag
+
+    data = gzip.compress(json.dumps(new_metadata, separators=(",", ":")).encode("utf-8"), mtime=0)
+    temp_path = output_path + ".tmp"
+    with open(temp_path, "wb") as h:
+        h.write(data)
+    os.replace(temp_path, output_path)
 
 
 def main(argv: List[str]) -> None:
     parser = argparse.ArgumentParser(description="Create a pypi package cache for all packages in a repo", allow_abbrev=False)
     parser.add_argument("srcinfo_cache", help="The path to the srcinfo.json.gz file")
     parser.add_argument("pypi_cache", help="The path to the json.gz file used to fetch/store the results")
+    parser.add_argument(
+        "--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+        help="The maximum number of requests to PyPI at the same time (default: %(default)s)")
+    parser.add_argument(
+        "--projection", help="A JSON file with the parts of the metadata to store, "
+        "in the same format as DEFAULT_PROJECTION, instead of the default ones")
+    parser.add_argument(
+        "--full", action="store_true", help="Store the full metadata instead of only some parts of it")
     args = parser.parse_args(argv[1:])
 
+    projection: Optional[Projection] = DEFAULT_PROJECTION
+    if args.full:
+        projection = None
+    elif args.projection is not None:
+        with open(args.projection, "r", encoding="utf-8") as h:
+            projection = json.load(h)
+
     logging.basicConfig(level="INFO")
-    dump_pypi_metadata(get_project_names(args.srcinfo_cache), args.pypi_cache)
+    dump_pypi_metadata(
+        get_project_names(args.srcinfo_cache), args.pypi_cache, args.concurrency, projection=projection)
 
 
 def run() -> None:
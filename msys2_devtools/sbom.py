@@ -2,19 +2,30 @@ import sys
 import os
 import argparse
 import logging
-import json
 import gzip
+import json
+import uuid
+from datetime import datetime, timezone
 
 from packageurl import PackageURL
 from cyclonedx.model.bom import Bom
 from cyclonedx.model.component import Component, ComponentType, Property
-from cyclonedx.model.vulnerability import BomTargetVersionRange, VulnerabilityAnalysis, ImpactAnalysisState
-from cyclonedx.model.impact_analysis import ImpactAnalysisAffectedStatus
+from cyclonedx.model.vulnerability import ImpactAnalysisState
 from cyclonedx.output.json import JsonV1Dot5, Json as JsonOutputter
+from cyclonedx.schema import SchemaVersion
 
-from .srcinfo import parse_srcinfo
-from .pkgextra import extra_to_pkgextra_entry
+from .srcinfo import get_entry_base
+from .pkgextra import get_references
 from .cpe import parse_cpe, build_cpe22
+from .advisories import match_components, open_advisory_index
+from .jsonstream import iter_object_array
+from .srcinfo_store import open_srcinfo_cache
+
+# Needs to be increased when generate_components() changes, to invalidate
+# the components cache
+COMPONENTS_CACHE_VERSION = 1
+
+BOM_REF_NAMESPACE = uuid.UUID("9f0c3c1e-5d6b-4b8e-9a55-1f6f0c7d2b41")
 
 
 def extract_upstream_version(version: str) -> str:
@@ -27,18 +38,13 @@ def extract_upstream_version(version: str) -> str:
 
 
 def generate_components(value) -> list[Component]:
-    components = []
+    components: list[Component] = []
 
-    if not value["srcinfo"].values():
+    base = get_entry_base(value)
+    if base is None:
         return components
-
-    pkgver = ""
-    pkgbase = ""
-    for srcinfo in value["srcinfo"].values():
-        base = parse_srcinfo(srcinfo)[0]
-        pkgver = extract_upstream_version(base["pkgver"][0])
-        pkgbase = base["pkgbase"][0]
-        break
+    pkgver = extract_upstream_version(base["pkgver"][0])
+    pkgbase = base["pkgbase"][0]
 
     purls: list[PackageURL] = []
     cpes: list[str] = []
@@ -50,8 +56,7 @@ def generate_components(value) -> list[Component]:
     ]
 
     if "extra" in value and "references" in value["extra"]:
-        pkgextra = extra_to_pkgextra_entry(value["extra"])
-        for extra_key, extra_values in pkgextra.references.items():
+        for extra_key, extra_values in get_references(value["extra"]).items():
             for extra_value in extra_values:
                 if extra_value is None:
                     continue
@@ -98,14 +103,12 @@ def write_sbom(srcinfo_cache: str, sbom: str) -> None:
     )
 
     srcinfo_cache = os.path.abspath(srcinfo_cache)
-    with open(srcinfo_cache, "rb") as h:
-        cache = json.loads(gzip.decompress(h.read()))
-
-    for value in cache.values():
-        components = generate_components(value)
-        for component in components:
-            bom.components.add(component)
-            bom.register_dependency(root_component, [component])
+    with open_srcinfo_cache(srcinfo_cache) as cache:
+        for key, value in cache.iter_parsed_entries(["extra"]):
+            components = generate_components(value)
+            for component in components:
+                bom.components.add(component)
+                bom.register_dependency(root_component, [component])
 
     my_json_outputter: 'JsonOutputter' = JsonV1Dot5(bom)
     serialized_json = my_json_outputter.output_as_string(indent=2)
@@ -113,6 +116,128 @@ def write_sbom(srcinfo_cache: str, sbom: str) -> None:
         file.write(serialized_json)
 
 
+def component_to_json(component: Component) -> dict:
+    """Returns the CycloneDX 1.5 JSON for a component without the bom-ref, the
+    same as the cyclonedx library would, for the fields used by generate_components()"""
+
+    data: dict = {"type": component.type.value, "name": component.name}
+    if component.version is not None:
+        data["version"] = component.version
+    if component.cpe is not None:
+        data["cpe"] = component.cpe
+    if component.purl is not None:
+        data["purl"] = component.purl.to_string()
+    if component.properties:
+        data["properties"] = [{"name": p.name, "value": p.value} for p in component.properties]
+    return data
+
+
+def get_components_json(value) -> list[dict]:
+    """Returns generate_components() as JSON, see component_to_json().
+    Equal components get merged, like the Bom does it."""
+
+    result = []
+    for component in generate_components(value):
+        data = component_to_json(component)
+        if data not in result:
+            result.append(data)
+    return result
+
+
+def get_bom_ref(data: dict) -> str:
+    """Returns a bom-ref derived from the component JSON, so it is stable
+    between runs, and the same for equal components"""
+
+    return str(uuid.uuid5(BOM_REF_NAMESPACE, json.dumps(data, sort_keys=True)))
+
+
+def load_components_cache(path: str) -> dict[str, list[dict]]:
+    """Returns the components per srcinfo cache key from a previous run, if
+    there was one, and it was created by the same version"""
+
+    try:
+        with open(path, "rb") as h:
+            data = json.loads(gzip.decompress(h.read()))
+    except FileNotFoundError:
+        return {}
+    if data.get("version") != COMPONENTS_CACHE_VERSION:
+        return {}
+    return data["entries"]
+
+
+def write_components_cache(path: str, entries: dict[str, list[dict]]) -> None:
+    data = {"version": COMPONENTS_CACHE_VERSION, "entries": entries}
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as h:
+        h.write(gzip.compress(json.dumps(data, separators=(",", ":")).encode("utf-8")))
+    os.replace(temp_path, path)
+
+
+def write_sbom_streaming(srcinfo_cache: str, sbom: str, components_cache: str | None = None) -> None:
+    """Like write_sbom(), but writes the components to the file as they are
+    created, without building a Bom. Only the bom-refs are kept in memory.
+
+    If components_cache is given, the components are stored there per srcinfo
+    cache key, and only generated for new keys the next time.
+    """
+
+    root_component = Component(name='MSYS2', type=ComponentType.OPERATING_SYSTEM)
+    root_json = component_to_json(root_component)
+    root_ref = get_bom_ref(root_json)
+    header = {
+        "$schema": "http://cyclonedx.org/schema/bom-1.5.schema.json",
+        "bomFormat": "CycloneDX",
+        "specVersion": SchemaVersion.V1_5.to_version(),
+        "serialNumber": uuid.uuid4().urn,
+        "version": 1,
+        "metadata": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "component": {"bom-ref": root_ref, **root_json},
+        },
+    }
+
+    old_components = load_components_cache(components_cache) if components_cache is not None else {}
+    new_components = {}
+    reused = 0
+
+    refs: dict[str, None] = {}
+    srcinfo_cache = os.path.abspath(srcinfo_cache)
+    with open_srcinfo_cache(srcinfo_cache) as cache, open(sbom, "w", encoding="utf-8") as h:
+        h.write("{\n")
+        for name, value in header.items():
+            h.write(f"  {json.dumps(name)}: {json.dumps(value)},\n")
+        h.write('  "components": [')
+        for key in cache:
+            if key in old_components:
+                components = old_components[key]
+                reused += 1
+            else:
+                components = get_components_json(cache.get_parsed_entry(key, ["extra"]))
+            if components_cache is not None:
+                new_components[key] = components
+
+            for data in components:
+                ref = get_bom_ref(data)
+                if ref in refs:
+                    continue
+                h.write(",\n    " if refs else "\n    ")
+                h.write(json.dumps({"bom-ref": ref, **data}))
+                refs[ref] = None
+
+        h.write('\n  ],\n  "dependencies": [\n    ')
+        root_dependency: dict = {"ref": root_ref}
+        if refs:
+            root_dependency["dependsOn"] = list(refs)
+        h.write(json.dumps(root_dependency))
+        for ref in refs:
+            h.write(",\n    " + json.dumps({"ref": ref}))
+        h.write("\n  ]\n}\n")
+
+    if components_cache is not None:
+        logging.info(f"Reused the components of {reused} of {len(new_components)} packages")
+        write_components_cache(components_cache, new_components)
+
+
 def handle_create_command(args) -> None:
     """Create an SBOM for all packages in the repo.
 
@@ -122,7 +247,10 @@ def handle_create_command(args) -> None:
     """
 
     logging.basicConfig(level="INFO")
-    write_sbom(args.srcinfo_cache, args.sbom)
+    if args.writer == "cyclonedx":
+        write_sbom(args.srcinfo_cache, args.sbom)
+    else:
+        write_sbom_streaming(args.srcinfo_cache, args.sbom, args.components_cache)
 
 
 def add_create_subcommand(subparsers) -> None:
@@ -134,103 +262,121 @@ def add_create_subcommand(subparsers) -> None:
     )
     parser.add_argument("srcinfo_cache", help="The path to the srcinfo.json.gz file")
     parser.add_argument("sbom", help="The path to the SBOM json file used to store the results")
+    parser.add_argument(
+        "--writer", choices=["cyclonedx", "streaming"], default="cyclonedx",
+        help="Build the whole SBOM with the cyclonedx library first (the default), "
+             "or write the components while they are created, using less memory")
+    parser.add_argument(
+        "--components-cache",
+        help="A file for keeping the generated components between runs, "
+             "so only the ones of new srcinfo cache entries have to be generated (streaming writer only)",
+        default=None
+    )
     parser.set_defaults(func=handle_create_command)
 
 
-def include_unaffected_from_grype(grype_data: dict, target_bom: Bom) -> None:
-    # mapping of vulnerability ID to list of fixed versions
-    fixed_mapping = {}
-    for match in grype_data["matches"]:
-        vuln = match["vulnerability"]
-        vuln_id = vuln["id"]
-        vuln_state = vuln["fix"]["state"]
-        vuln_versions = vuln["fix"]["versions"]
-        if vuln_state == "fixed":
-            fixed_mapping[vuln_id] = vuln_versions
-
-    # In the cdx sbom expose them as unaffected versions
-    for vuln in target_bom.vulnerabilities:
-        if vuln.id not in fixed_mapping:
-            continue
-        versions = fixed_mapping[vuln.id]
-        for target in vuln.affects:
-            target_versions = [
-                BomTargetVersionRange(version=version, status=ImpactAnalysisAffectedStatus.UNAFFECTED)
-                for version in versions
-            ]
-            target.versions = target_versions
+def get_fixed_versions_from_grype(grype_path: str) -> dict[str, list[str]]:
+    """Returns a mapping of vulnerability ID to the fixed versions, for all
+    matches in the grype json file. The matches are parsed one by one, to
+    not have the whole report in memory."""
 
+    fixed_mapping = {}
+    with open(grype_path, "r", encoding="utf-8") as h:
+        for match in iter_object_array(h, "matches"):
+            vuln = match["vulnerability"]
+            if vuln["fix"]["state"] == "fixed":
+                fixed_mapping[vuln["id"]] = vuln["fix"]["versions"]
+    return fixed_mapping
+
+
+def get_ignored_vulnerabilities(srcinfo_cache: str) -> dict[str, set[str]]:
+    """Returns a mapping of vulnerability ID to the pkgbases ignoring it"""
+
+    ignored: dict[str, set[str]] = {}
+    with open_srcinfo_cache(os.path.abspath(srcinfo_cache)) as cache:
+        for key, extra in cache.iter_field("extra"):
+            ignore_vulnerabilities = extra.get("ignore_vulnerabilities", [])
+            if not ignore_vulnerabilities:
+                continue
+            pkgbase = cache.get_pkgbase(key)
+            for vuln_id in ignore_vulnerabilities:
+                ignored.setdefault(vuln_id, set()).add(pkgbase)
+    return ignored
 
-def handle_fixup_command(args) -> None:
-    """Adjust the target SBOM by rewriting component properties and
-    adding unaffected versions from a grype json file, and marking
-    unaffected components."""
-
-    logging.basicConfig(level="INFO")
-
-    with open(args.target_sbom, "r", encoding="utf-8") as h:
-        target_bom: Bom = Bom.from_json(json.loads(h.read()))
 
-    if args.grype_json is not None:
-        with open(args.grype_json, "r", encoding="utf-8") as h:
-            grype_data = json.loads(h.read())
-        include_unaffected_from_grype(grype_data, target_bom)
+def fixup_sbom(target_bom: dict, fixed_mapping: dict[str, list[str]], ignored: dict[str, set[str]]) -> None:
+    """Changes the CycloneDX JSON in place, see handle_fixup_command()"""
 
     # mapping of bom_ref to pkgbase
     pkgbase_mapping = {}
 
     # Rewrite the msys2:pkgbase property to match the syft:location:0:path property
     # We use syft:location:0:path to funnel the package name through grype
-    for component in target_bom.components:
+    for component in target_bom.get("components", []):
+        properties = component.get("properties", [])
         value = None
         existing_prop = None
-        for prop in component.properties:
-            if prop.name == "syft:location:0:path":
-                value = prop.value
-            elif prop.name == "msys2:pkgbase":
+        for prop in properties:
+            if prop["name"] == "syft:location:0:path":
+                value = prop.get("value")
+            elif prop["name"] == "msys2:pkgbase":
                 existing_prop = prop
 
         if value is not None:
-            pkgbase_mapping[component.bom_ref.value] = value
+            pkgbase_mapping[component.get("bom-ref")] = value
             if existing_prop is not None:
-                existing_prop.value = value
+                existing_prop["value"] = value
             else:
-                component.properties.add(Property(name="msys2:pkgbase", value=value))
+                properties.append({"name": "msys2:pkgbase", "value": value})
+                component["properties"] = properties
+
+    for vuln in target_bom.get("vulnerabilities", []):
+        vuln_id = vuln.get("id")
+        affects = vuln.get("affects", [])
+
+        # In the cdx sbom expose the fixed versions as unaffected versions
+        if vuln_id in fixed_mapping:
+            for target in affects:
+                target["versions"] = [{"version": v, "status": "unaffected"} for v in fixed_mapping[vuln_id]]
+
+        # Apply the vulnerability status to the vulnerabilities in the target SBOM
+        vuln.pop("analysis", None)
+        if vuln_id in ignored:
+            pkgbases = ignored[vuln_id]
+            for target in affects:
+                if pkgbase_mapping.get(target["ref"]) in pkgbases:
+                    vuln["analysis"] = {"state": ImpactAnalysisState.NOT_AFFECTED.value}
+                    break
+
+
+def handle_fixup_command(args) -> None:
+    """Adjust the target SBOM by rewriting component properties and
+    adding unaffected versions from a grype json file, and marking
+    unaffected components."""
+
+    logging.basicConfig(level="INFO")
+
+    fixed_mapping = {}
+    if args.grype_json is not None:
+        fixed_mapping = get_fixed_versions_from_grype(args.grype_json)
 
-    # Gives a VulnerabilityAnalysis per package, per vuln ID
-    vulnerability_status = {}
+    # Gives the pkgbases per vuln ID, which are not affected
+    ignored = {}
     if args.srcinfo_cache is not None:
-        srcinfo_cache = os.path.abspath(args.srcinfo_cache)
-        with open(srcinfo_cache, "rb") as h:
-            cache = json.loads(gzip.decompress(h.read()))
-
-        for value in cache.values():
-            pkgbase = ""
-            for srcinfo in value["srcinfo"].values():
-                base = parse_srcinfo(srcinfo)[0]
-                pkgbase = base["pkgbase"][0]
-                break
-            ignore_vulnerabilities = value.get("extra", {}).get("ignore_vulnerabilities", [])
-            for vuln_id in ignore_vulnerabilities:
-                vulnerability_status.setdefault(vuln_id, {})[pkgbase] = \
-                    VulnerabilityAnalysis(state=ImpactAnalysisState.NOT_AFFECTED)
-
-    # Apply the vulnerability status to the vulnerabilities in the target SBOM
-    for vuln in target_bom.vulnerabilities:
-        analysis = None
-        if vuln.id in vulnerability_status:
-            status = vulnerability_status[vuln.id]
-            for target in vuln.affects:
-                pkgbase = pkgbase_mapping.get(target.ref, None)
-                if pkgbase is not None and pkgbase in status:
-                    analysis = status[pkgbase]
-                    break
-        vuln.analysis = analysis
+        ignored = get_ignored_vulnerabilities(args.srcinfo_cache)
 
-    my_json_outputter: 'JsonOutputter' = JsonV1Dot5(target_bom)
-    serialized_json = my_json_outputter.output_as_string(indent=2)
-    with open(args.target_sbom, 'w', encoding="utf-8") as file:
-        file.write(serialized_json)
+    with open(args.target_sbom, "r", encoding="utf-8") as h:
+        target_bom = json.load(h)
+
+    fixup_sbom(target_bom, fixed_mapping, ignored)
+    write_sbom_json(args.target_sbom, target_bom)
+
+
+def write_sbom_json(path: str, data: dict) -> None:
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as h:
+        json.dump(data, h, indent=2)
+    os.replace(temp_path, path)
 
 
 def add_fixup_subcommand(subparsers) -> None:
@@ -254,12 +400,65 @@ def add_fixup_subcommand(subparsers) -> None:
     parser.set_defaults(func=handle_fixup_command)
 
 
+def handle_match_command(args) -> None:
+    """Match the components of the target SBOM against a local advisory dump,
+    and replace the vulnerabilities in it with the results."""
+
+    logging.basicConfig(level="INFO")
+
+    index_path = args.index
+    if index_path is None:
+        index_path = args.advisories.rstrip("/\\") + ".index"
+    if args.rebuild_index and os.path.exists(index_path):
+        os.remove(index_path)
+
+    ignored = {}
+    if args.srcinfo_cache is not None:
+        ignored = get_ignored_vulnerabilities(args.srcinfo_cache)
+
+    with open(args.target_sbom, "r", encoding="utf-8") as h:
+        target_bom = json.load(h)
+
+    with open_advisory_index(index_path, args.advisories) as index:
+        vulnerabilities = match_components(target_bom.get("components", []), index, ignored)
+    logging.info(f"Found {len(vulnerabilities)} vulnerabilities")
+
+    target_bom["vulnerabilities"] = vulnerabilities
+    write_sbom_json(args.target_sbom, target_bom)
+
+
+def add_match_subcommand(subparsers) -> None:
+    parser = subparsers.add_parser(
+        "match",
+        description="Match the SBOM components against a local OSV advisory dump, "
+                    "and write the found vulnerabilities into the SBOM",
+        allow_abbrev=False
+    )
+    parser.add_argument("target_sbom", help="The target SBOM to change")
+    parser.add_argument(
+        "advisories", help="A directory of OSV JSON files, a JSON file with a list of them, or a JSON lines file")
+    parser.add_argument(
+        "--index",
+        help="Where to store the index for the advisories, rebuilt if the advisory files changed "
+             "(default: next to the advisories)",
+        default=None
+    )
+    parser.add_argument("--rebuild-index", action="store_true", help="Rebuild the index even if it is up to date")
+    parser.add_argument(
+        "--srcinfo-cache",
+        help="Include additional info for the vulnerability status",
+        default=None
+    )
+    parser.set_defaults(func=handle_match_command)
+
+
 def main(argv: list[str]) -> None:
     parser = argparse.ArgumentParser(description="SBOM tools", allow_abbrev=False)
     subparsers = parser.add_subparsers(dest="command", required=True)
 
     add_create_subcommand(subparsers)
     add_fixup_subcommand(subparsers)
+    add_match_subcommand(subparsers)
 
     args = parser.parse_args(argv[1:])
     args.func(args)
@@ -1,8 +1,14 @@
-def parse_srcinfo(srcinfo: str) -> tuple[dict[str, list[str]], dict[str, dict[str, list[str]]]]:
-    """Parse a SRCINFO file. All values are lists of strings."""
+from typing import Any, Iterator, Mapping
+
+SrcinfoBase = dict[str, list[str]]
+SrcinfoPackages = dict[str, dict[str, list[str]]]
+
 
-    base: dict[str, list[str]] = {}
-    sub: dict[str, dict[str, list[str]]] = {}
+def _parse_srcinfo_sections(srcinfo: str) -> tuple[SrcinfoBase, SrcinfoPackages]:
+    """Like parse_srcinfo(), but the packages only contain the values set for them"""
+
+    base: SrcinfoBase = {}
+    sub: SrcinfoPackages = {}
     current = None
     for line in srcinfo.splitlines():
         line = line.strip()
@@ -24,10 +30,74 @@ def parse_srcinfo(srcinfo: str) -> tuple[dict[str, list[str]], dict[str, dict[st
 
         current.setdefault(key, []).extend(values)
 
+    return base, sub
+
+
+def _inherit_base(base: SrcinfoBase, sub: SrcinfoPackages) -> SrcinfoPackages:
     # everything not set in the packages, take from the base
     for bkey, bvalue in base.items():
         for items in sub.values():
             if bkey not in items:
                 items[bkey] = bvalue
+    return sub
 
-    return base, sub
+
+def parse_srcinfo(srcinfo: str) -> tuple[SrcinfoBase, SrcinfoPackages]:
+    """Parse a SRCINFO file. All values are lists of strings."""
+
+    base, sub = _parse_srcinfo_sections(srcinfo)
+    return base, _inherit_base(base, sub)
+
+
+def compact_srcinfos(srcinfos: Mapping[str, str]) -> dict[str, Any]:
+    """Returns a parsed form of the per-arch SRCINFO files, for storing in the cache.
+
+    Packages only contain the values not inherited from the base, and arches
+    with the same parsed result share one variant.
+    """
+
+    variants: list[dict[str, Any]] = []
+    arches: dict[str, int] = {}
+    for arch, srcinfo in srcinfos.items():
+        base, sub = _parse_srcinfo_sections(srcinfo)
+        variant = {"base": base, "packages": sub}
+        if variant in variants:
+            arches[arch] = variants.index(variant)
+        else:
+            arches[arch] = len(variants)
+            variants.append(variant)
+    return {"variants": variants, "arches": arches}
+
+
+def iter_entry_srcinfos(entry: Mapping[str, Any]) -> Iterator[tuple[str, SrcinfoBase, SrcinfoPackages]]:
+    """Yields (arch, base, packages) like parse_srcinfo() for all SRCINFOs of a cache entry.
+
+    Uses the pre-parsed data if the entry has it. The results share lists with
+    the entry, so they should not be modified.
+    """
+
+    if "parsed" in entry:
+        parsed = entry["parsed"]
+        variants = parsed["variants"]
+        for arch, index in parsed["arches"].items():
+            variant = variants[index]
+            base = variant["base"]
+            sub = {name: dict(values) for name, values in variant["packages"].items()}
+            yield arch, base, _inherit_base(base, sub)
+    else:
+        for arch, srcinfo in entry.get("srcinfo", {}).items():
+            yield (arch, *parse_srcinfo(srcinfo))
+
+
+def get_entry_base(entry: Mapping[str, Any]) -> SrcinfoBase | None:
+    """Returns the parsed base of the first SRCINFO of a cache entry, if there is one"""
+
+    if "parsed" in entry:
+        parsed = entry["parsed"]
+        for index in parsed["arches"].values():
+            return parsed["variants"][index]["base"]
+        return None
+
+    for srcinfo in entry.get("srcinfo", {}).values():
+        return _parse_srcinfo_sections(srcinfo)[0]
+    return None
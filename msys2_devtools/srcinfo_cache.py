@@ -2,23 +2,27 @@ import sys
 import argparse
 import os
 import json
-from collections import OrderedDict
+from collections import ChainMap, deque
+from itertools import chain
 import hashlib
 import time
-import shlex
+from datetime import datetime, timezone
 import subprocess
-import gzip
-from concurrent.futures import ThreadPoolExecutor
-from functools import partial
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
 
-from typing import List, Iterator, Tuple, Dict, Optional, Union, Collection, Sequence, Any
-from .pkgbuild import get_extra_meta_for_pkgbuild
-from .pkgextra import extra_to_pkgextra_entry
+from typing import List, Iterator, Tuple, Dict, Optional, Union, Collection, NamedTuple, Mapping, Set
+from .backend import Backend, MsysBackend, LinuxBackend
+from .bashpool import BashPool, BashWorker
+from .pkgbuild import PKGBUILD2JSON, PKGBUILDDUMP, EXTRA_META_PREFIXES, ExtraMeta, parse_extra_meta
+from .pkgextra import extra_to_pkgextra_entry, get_schema_version
+from .srcinfo import compact_srcinfos
+from .srcinfo_store import (SrcinfoCache, JsonSrcinfoCache, open_srcinfo_cache, get_srcinfo_cache_format,
+                            write_srcinfo_cache)
 
 
 CacheEntry = Dict[str, Union[str, Collection[str]]]
 CacheTuple = Tuple[str, CacheEntry]
-Cache = Dict[str, CacheEntry]
+Cache = Mapping[str, CacheEntry]
 
 
 def normalize_repo(repo: str) -> str:
@@ -31,37 +35,36 @@ def normalize_path(path: str) -> str:
     return path.replace("\\", "/")
 
 
-def get_mingw_arch_list(msys2_root: str, dir: str, pkgbuild_path: str) -> List[str]:
+DEFAULT_MINGW_ARCH_LIST = ["mingw32", "mingw64", "ucrt64", "clang64", "clang32"]
+
+
+def get_mingw_arch_list(worker: BashWorker, dir: str, pkgbuild_path: str) -> List[str]:
     assert not os.path.isabs(pkgbuild_path)
-    executable = os.path.join(msys2_root, 'usr', 'bin', 'bash.exe')
-    sub_commands = [
-        shlex.join(['source', pkgbuild_path]),
-        '! declare -p mingw_arch &>/dev/null',
-        'echo -n "$? ${mingw_arch[@]}"'
-    ]
-    env = os.environ.copy()
-    env["CHERE_INVOKING"] = "1"
-    env["MSYSTEM"] = "MSYS"
-    env["MSYS2_PATH_TYPE"] = "minimal"
-    out = subprocess.check_output(
-        [executable, '-lc', ';'.join(sub_commands)], universal_newlines=True, env=env, cwd=dir)
+    out = worker.check_output(
+        ["msys2_get_mingw_arch_list", pkgbuild_path], cwd=dir).decode("utf-8")
     first, *arch_list = out.strip().split()
     list_exists = bool(int(first))
     if not list_exists:
         assert not arch_list
-        arch_list = ["mingw32", "mingw64", "ucrt64", "clang64", "clang32"]
+        arch_list = list(DEFAULT_MINGW_ARCH_LIST)
     return arch_list
 
 
-def check_output_msys(msys2_root: str, args: Sequence[str], **kwargs: Any):
-    executable = os.path.join(msys2_root, 'usr', 'bin', 'bash.exe')
-    env = kwargs.pop("env", os.environ.copy())
-    env["CHERE_INVOKING"] = "1"
-    env["MSYSTEM"] = "MSYS"
-    env["MSYS2_PATH_TYPE"] = "minimal"
-    return subprocess.check_output(
-        [executable, '-lce'] + [shlex.join([str(a) for a in args])],
-        env=env, **kwargs)
+def parse_pkgbuild_dump(out: str) -> Tuple[Dict[str, str], ExtraMeta]:
+    """Parses the output of pkgbuilddump.sh"""
+
+    srcinfos = {}
+    extra_meta: ExtraMeta = {}
+    for part in out.split("\x1e")[1:]:
+        header, content = part.split("\n", 1)
+        kind, *args = header.split()
+        if kind == "srcinfo":
+            srcinfos[args[0]] = content
+        elif kind == "extra":
+            extra_meta = parse_extra_meta(content)
+        else:
+            raise ValueError(f"unknown part {header!r}")
+    return srcinfos, extra_meta
 
 
 def get_cache_key(pkgbuild_path: str) -> str:
@@ -87,60 +90,307 @@ def get_cache_key(pkgbuild_path: str) -> str:
     return h.hexdigest()
 
 
-def get_srcinfo_for_pkgbuild(msys2_root: str, args: Tuple[str, str]) -> Optional[CacheTuple]:
-    pkgbuild_path, mode = args
-    pkgbuild_path = os.path.abspath(pkgbuild_path)
-    git_cwd = os.path.dirname(pkgbuild_path)
-    git_path = os.path.relpath(pkgbuild_path, git_cwd)
-    key = get_cache_key(pkgbuild_path)
+class RepoIndex:
+    """Git metadata for all files in a repo, fetched with a few bulk git calls.
+
+    Allows computing the same cache keys and metadata as the per-file git
+    calls without spawning git processes per PKGBUILD. Files not in the index
+    (untracked, or in a nested repo) fall back to per-file git calls.
+    """
+
+    def __init__(self, repo_path: str) -> None:
+        self._repo_path = repo_path = os.path.abspath(repo_path)
+        self._fileinfo: Dict[str, str] = {}
+        self._full_names: Dict[str, str] = {}
+        self._dates: Dict[str, str] = {}
+
+        self.prefix = prefix = subprocess.check_output(
+            ["git", "rev-parse", "--show-prefix"],
+            cwd=repo_path).decode("utf-8").strip()
+
+        out = subprocess.check_output(
+            ["git", "ls-files", "-s", "--full-name"],
+            cwd=repo_path).decode("utf-8")
+        for line in out.splitlines():
+            full_name = line.split("\t", 1)[-1]
+            # quoted paths would need unescaping, leave them to the fallback
+            if full_name.startswith('"') or not full_name.startswith(prefix):
+                continue
+            path = os.path.normcase(os.path.join(repo_path, *full_name[len(prefix):].split("/")))
+            self._fileinfo[path] = line
+            self._full_names[path] = full_name
 
-    print("Parsing %r" % pkgbuild_path)
-    try:
-        srcinfos = {}
-
-        if mode == "mingw":
-            for name in get_mingw_arch_list(msys2_root, git_cwd, git_path):
-                env = os.environ.copy()
-                env["MINGW_ARCH"] = name
-                srcinfo = check_output_msys(
-                    msys2_root,
-                    ["/usr/bin/makepkg-mingw",
-                     "--printsrcinfo", "-p", git_path],
-                    cwd=git_cwd,
-                    env=env).decode("utf-8")
-                assert srcinfo
-                srcinfos[name] = srcinfo
-        else:
-            srcinfo = check_output_msys(
-                msys2_root,
-                ["/usr/bin/makepkg",
-                 "--printsrcinfo", "-p", git_path],
-                cwd=git_cwd).decode("utf-8")
-            assert srcinfo
-            srcinfos["msys"] = srcinfo
+        repo = subprocess.check_output(
+            ["git", "ls-remote", "--get-url", "origin"],
+            cwd=repo_path).decode("utf-8").strip()
+        self.repo = normalize_repo(repo)
+
+    def get_cache_key(self, pkgbuild_path: str) -> str:
+        pkgbuild_path = os.path.abspath(pkgbuild_path)
+        fileinfo = self._fileinfo.get(os.path.normcase(pkgbuild_path))
+        if fileinfo is None:
+            return get_cache_key(pkgbuild_path)
+
+        h = hashlib.new("SHA1")
+        with open(pkgbuild_path, "rb") as f:
+            h.update(f.read())
+        h.update(normalize_path(fileinfo).encode("utf-8"))
+        h.update(self.repo.encode("utf-8"))
+        return h.hexdigest()
+
+    def get_repo(self, pkgbuild_path: str) -> str:
+        """The normalized URL of the repo containing the file"""
+
+        pkgbuild_path = os.path.abspath(pkgbuild_path)
+        if os.path.normcase(pkgbuild_path) in self._full_names:
+            return self.repo
 
         repo = subprocess.check_output(
             ["git", "ls-remote", "--get-url", "origin"],
-            cwd=git_cwd).decode("utf-8").strip()
-        repo = normalize_repo(repo)
+            cwd=os.path.dirname(pkgbuild_path)).decode("utf-8").strip()
+        return normalize_repo(repo)
+
+    def get_relpath(self, pkgbuild_path: str) -> str:
+        """The directory of the file, relative to the repo root"""
+
+        pkgbuild_path = os.path.abspath(pkgbuild_path)
+        full_name = self._full_names.get(os.path.normcase(pkgbuild_path))
+        if full_name is None:
+            git_cwd = os.path.dirname(pkgbuild_path)
+            full_name = subprocess.check_output(
+                ["git", "ls-files", "--full-name", os.path.relpath(pkgbuild_path, git_cwd)],
+                cwd=git_cwd).decode("utf-8").strip()
+        return normalize_path(os.path.dirname(full_name))
+
+    def load_dates(self, pkgbuild_paths: Collection[str]) -> None:
+        """Looks up the last author dates for all the files with one git log call.
+
+        Stops walking the history once all files are found. Merge commits list
+        the files which differ from all parents, like "git log -1 FILE" shows
+        a merge only if it differs from all parents.
+        """
+
+        pending: Dict[str, str] = {}
+        for pkgbuild_path in pkgbuild_paths:
+            path = os.path.normcase(os.path.abspath(pkgbuild_path))
+            full_name = self._full_names.get(path)
+            if full_name is not None and path not in self._dates:
+                pending[full_name] = path
+        if not pending:
+            return
+
+        args = ["git", "log", "--format=%x00%aI", "--name-only", "-c", "--", "."]
+        with subprocess.Popen(args, cwd=self._repo_path, stdout=subprocess.PIPE) as proc:
+            assert proc.stdout is not None
+            date = ""
+            for raw_line in proc.stdout:
+                line = raw_line.decode("utf-8").rstrip("\n")
+                if line.startswith("\0"):
+                    date = line[1:]
+                    continue
+                path = pending.pop(line, None)
+                if path is not None:
+                    self._dates[path] = date
+                    if not pending:
+                        proc.kill()
+                        break
+            else:
+                # read everything, so git is done, and all files not found aren't committed yet
+                if proc.wait() != 0:
+                    raise subprocess.CalledProcessError(proc.returncode, args)
+
+        # not committed yet
+        for path in pending.values():
+            self._dates[path] = ""
+
+    def get_date(self, pkgbuild_path: str) -> str:
+        """The author date of the last commit changing the file"""
+
+        pkgbuild_path = os.path.abspath(pkgbuild_path)
+        date = self._dates.get(os.path.normcase(pkgbuild_path))
+        if date is None:
+            git_cwd = os.path.dirname(pkgbuild_path)
+            date = subprocess.check_output(
+                ["git", "log", "-1", "--format=%aI", os.path.relpath(pkgbuild_path, git_cwd)],
+                cwd=git_cwd).decode("utf-8").strip()
+        return date
+
+
+def get_head_commit(repo_path: str) -> Optional[str]:
+    """Returns the commit checked out, or None if there are uncommitted changes"""
+
+    status = subprocess.check_output(
+        ["git", "status", "--porcelain", "--untracked-files=no", "--", "."],
+        cwd=repo_path).decode("utf-8").strip()
+    if status:
+        return None
+    return subprocess.check_output(
+        ["git", "rev-parse", "HEAD"], cwd=repo_path).decode("utf-8").strip()
 
-        relpath = subprocess.check_output(
-            ["git", "ls-files", "--full-name", git_path],
-            cwd=git_cwd).decode("utf-8").strip()
-        relpath = normalize_path(os.path.dirname(relpath))
 
-        date = subprocess.check_output(
-            ["git", "log", "-1", "--format=%aI", git_path],
-            cwd=git_cwd).decode("utf-8").strip()
+def get_changed_package_dirs(repo_path: str, prefix: str, old_commit: str) -> Optional[Tuple[Set[str], List[str]]]:
+    """Returns the package directories changed since old_commit, including
+    uncommitted changes and untracked files in the working tree.
+
+    The result contains all directories (relative to the repo root) which
+    contain changed files, and the paths of the PKGBUILD files that need to be
+    looked at again. Returns None in case old_commit isn't available.
+    """
+
+    repo_path = os.path.abspath(repo_path)
+    if subprocess.call(
+            ["git", "cat-file", "-e", old_commit + "^{commit}"],
+            cwd=repo_path, stderr=subprocess.DEVNULL) != 0:
+        return None
+
+    out = subprocess.check_output(
+        ["git", "diff", "--name-status", "--no-renames", "-z", old_commit, "--", "."],
+        cwd=repo_path).decode("utf-8")
+    # status and path alternate
+    changed = out.split("\0")[1::2]
+    out = subprocess.check_output(
+        ["git", "ls-files", "--others", "--exclude-standard", "--full-name", "-z", "--", "."],
+        cwd=repo_path).decode("utf-8")
+    changed.extend(p for p in out.split("\0") if p)
+
+    touched_dirs: Set[str] = set()
+    pkgbuild_paths: Set[str] = set()
+    for full_name in changed:
+        parts = full_name[len(prefix):].split("/")[:-1]
+        # the outermost directory with a PKGBUILD is the package, like in iter_pkgbuild_paths()
+        found = False
+        for i in range(1, len(parts) + 1):
+            touched_dirs.add(prefix + "/".join(parts[:i]))
+            pkgbuild_path = os.path.join(repo_path, *parts[:i], "PKGBUILD")
+            if not found and os.path.isfile(pkgbuild_path):
+                pkgbuild_paths.add(pkgbuild_path)
+                found = True
+
+    return touched_dirs, sorted(pkgbuild_paths)
+
+
+class ParseJob(NamedTuple):
+    """Everything needed for creating a cache entry for a PKGBUILD"""
+
+    pkgbuild_path: str
+    mode: str
+    key: str
+    repo: str
+    path: str
+    date: str
+
+
+class Skipped(NamedTuple):
+    """Yielded by iter_srcinfo() for a PKGBUILD which wasn't parsed because of the time limit"""
+
+    pkgbuild_path: str
+
+
+def run_makepkg(backend: Backend, worker: BashWorker, mode: str, git_cwd: str,
+                git_path: str) -> Tuple[Dict[str, str], ExtraMeta]:
+    """Returns the SRCINFOs and the extra metadata, running makepkg once per arch"""
+
+    srcinfos = {}
+    if mode == "mingw":
+        for name in get_mingw_arch_list(worker, git_cwd, git_path):
+            command, env = backend.get_printsrcinfo_command(git_path, name)
+            srcinfo = worker.check_output(command, cwd=git_cwd, env=env).decode("utf-8")
+            assert srcinfo
+            srcinfos[name] = srcinfo
+    else:
+        command, env = backend.get_printsrcinfo_command(git_path, None)
+        srcinfo = worker.check_output(command, cwd=git_cwd, env=env).decode("utf-8")
+        assert srcinfo
+        srcinfos["msys"] = srcinfo
+
+    extra_meta = parse_extra_meta(worker.check_output(
+        ["source", backend.get_bash_path(PKGBUILD2JSON), git_path] + EXTRA_META_PREFIXES,
+        cwd=git_cwd).decode("utf-8"))
+
+    return srcinfos, extra_meta
+
+
+def run_pkgbuilddump(backend: Backend, worker: BashWorker, mode: str, git_cwd: str,
+                     git_path: str) -> Tuple[Dict[str, str], ExtraMeta]:
+    """Like run_makepkg(), but everything in one command, using libmakepkg directly.
+
+    Raises ValueError in case the output is incomplete.
+    """
+
+    assert backend.libmakepkg is not None
+    config = backend.get_makepkg_config("@ARCH@" if mode == "mingw" else None)
+    out = worker.check_output(
+        ["source", backend.get_bash_path(PKGBUILDDUMP), git_path, mode, backend.libmakepkg, config,
+         " ".join(DEFAULT_MINGW_ARCH_LIST)] + EXTRA_META_PREFIXES,
+        cwd=git_cwd).decode("utf-8")
+    srcinfos, extra_meta = parse_pkgbuild_dump(out)
+    if not srcinfos or not all(srcinfos.values()):
+        raise ValueError("empty SRCINFO")
+    return srcinfos, extra_meta
+
+
+def run_parse(backend: Backend, worker: BashWorker, mode: str, git_cwd: str,
+              git_path: str) -> Tuple[Dict[str, str], ExtraMeta]:
+    """Uses run_pkgbuilddump() if libmakepkg is available, and run_makepkg()
+    otherwise, or if that fails"""
+
+    if backend.libmakepkg is not None:
+        try:
+            return run_pkgbuilddump(backend, worker, mode, git_cwd, git_path)
+        except (subprocess.CalledProcessError, ValueError):
+            pass
+    return run_makepkg(backend, worker, mode, git_cwd, git_path)
+
+
+def split_pkgbuild_path(pkgbuild_path: str) -> Tuple[str, str]:
+    """Returns the directory of the PKGBUILD and its path relative to it"""
+
+    pkgbuild_path = os.path.abspath(pkgbuild_path)
+    git_cwd = os.path.dirname(pkgbuild_path)
+    return git_cwd, os.path.relpath(pkgbuild_path, git_cwd)
+
 
-        extra_meta = get_extra_meta_for_pkgbuild(msys2_root, pkgbuild_path)
+def check_libmakepkg(backend: Backend, pool: BashPool, jobs: List[ParseJob], tries: int = 5) -> bool:
+    """Returns if the libmakepkg path gives the same result as makepkg for the
+    first PKGBUILD makepkg can handle, in case pkgbuilddump.sh doesn't work with
+    the installed libmakepkg version. Also True if there is nothing to compare."""
 
-        meta = {"repo": repo, "path": relpath, "date": date, "srcinfo": srcinfos, "extra": extra_meta}
+    assert backend.libmakepkg is not None
+    for job in jobs[:tries]:
+        git_cwd, git_path = split_pkgbuild_path(job.pkgbuild_path)
+        with pool.worker() as worker:
+            try:
+                expected = run_makepkg(backend, worker, job.mode, git_cwd, git_path)
+            except subprocess.CalledProcessError:
+                continue
+            try:
+                return run_pkgbuilddump(backend, worker, job.mode, git_cwd, git_path) == expected
+            except (subprocess.CalledProcessError, ValueError):
+                return False
+    return True
+
+
+def get_srcinfo_for_pkgbuild(backend: Backend, pool: BashPool, job: ParseJob) -> Optional[CacheTuple]:
+    pkgbuild_path = os.path.abspath(job.pkgbuild_path)
+    git_cwd, git_path = split_pkgbuild_path(pkgbuild_path)
+
+    print("Parsing %r" % pkgbuild_path)
+    start = time.monotonic()
+    try:
+        with pool.worker() as worker:
+            srcinfos, extra_meta = run_parse(backend, worker, job.mode, git_cwd, git_path)
+
+        meta = {"repo": job.repo, "path": job.path, "date": job.date, "srcinfo": srcinfos, "extra": extra_meta,
+                "duration": round(time.monotonic() - start, 2)}
     except subprocess.CalledProcessError as e:
         print("ERROR: %s %s" % (pkgbuild_path, e.output.splitlines()))
         return None
+    except RuntimeError as e:
+        # the worker died, the pool replaces it for the next job
+        print("ERROR: %s %s" % (pkgbuild_path, e))
+        return None
 
-    return (key, meta)
+    return (job.key, meta)
 
 
 def iter_pkgbuild_paths(repo_path: str) -> Iterator[str]:
@@ -155,72 +405,356 @@ def iter_pkgbuild_paths(repo_path: str) -> Iterator[str]:
                 yield path
 
 
-def get_srcinfo_from_cache(args: Tuple[str, Cache]) -> Tuple[str, Optional[CacheTuple]]:
-    pkgbuild_path, cache = args
-    key = get_cache_key(pkgbuild_path)
+def get_srcinfo_from_cache(args: Tuple[str, Cache, RepoIndex]) -> Tuple[str, str, Optional[CacheTuple]]:
+    pkgbuild_path, cache, index = args
+    key = index.get_cache_key(pkgbuild_path)
     if key in cache:
-        return (pkgbuild_path, (key, cache[key]))
+        return (pkgbuild_path, key, (key, cache[key]))
     else:
-        return (pkgbuild_path, None)
-
-
-def iter_srcinfo(msys2_root: str, repo_path: str, mode: str, cache: Cache) -> Iterator[Optional[CacheTuple]]:
-    with ThreadPoolExecutor() as executor:
+        return (pkgbuild_path, key, None)
+
+
+def sort_jobs(jobs: List[ParseJob], order: str, previous: Mapping[str, CacheEntry]) -> List[Tuple[ParseJob, float]]:
+    """Returns the jobs in the order they should be run, with their expected duration.
+
+    'previous' maps package paths to the stats of the last time the package
+    was parsed, see read_stats(), which are used to estimate the cost. Unknown
+    packages are assumed to take the median time.
+
+    * walk: the order the PKGBUILD files were found in
+    * cost: the cheapest packages first
+    * stale: the packages parsed the longest time ago first, new packages before that
+    """
+
+    durations = sorted(
+        float(e["duration"]) for e in previous.values() if isinstance(e.get("duration"), (int, float)))
+    median = durations[len(durations) // 2] if durations else 0.0
+
+    def get_cost(job: ParseJob) -> float:
+        duration = previous.get(job.path, {}).get("duration")
+        return float(duration) if isinstance(duration, (int, float)) else median
+
+    costs = [(job, get_cost(job)) for job in jobs]
+    if order == "cost":
+        costs.sort(key=lambda c: c[1])
+    elif order == "stale":
+        costs.sort(key=lambda c: str(previous.get(c[0].path, {}).get("generated", "")))
+    elif order != "walk":
+        raise ValueError(f"unknown order {order!r}")
+    return costs
+
+
+def iter_srcinfo(backend: Backend, repo_path: str, mode: str, cache: Cache,
+                 order: str = "walk", previous: Optional[Mapping[str, CacheEntry]] = None,
+                 deadline: Optional[float] = None, index: Optional[RepoIndex] = None,
+                 pkgbuild_paths: Optional[Collection[str]] = None) -> Iterator[Union[CacheTuple, Skipped, None]]:
+    """Yields cache entries for all PKGBUILD files in the repo, or only the given ones.
+
+    If a deadline (in time.monotonic() time) is given, no new PKGBUILD gets
+    parsed once its expected duration would exceed the deadline.
+    Yields None for every PKGBUILD that failed to parse, and Skipped for every
+    one not parsed because of the deadline.
+    """
+
+    if index is None:
+        index = RepoIndex(repo_path)
+    if pkgbuild_paths is None:
+        pkgbuild_paths = list(iter_pkgbuild_paths(repo_path))
+    max_workers = min(32, (os.cpu_count() or 1) + 4)
+    with ThreadPoolExecutor(max_workers) as executor, backend.create_pool(max_workers) as pool:
         to_parse: List[Tuple[str, str]] = []
         pool_iter = executor.map(
-            get_srcinfo_from_cache, ((p, cache) for p in iter_pkgbuild_paths(repo_path)))
-        for pkgbuild_path, srcinfo in pool_iter:
+            get_srcinfo_from_cache, ((p, cache, index) for p in pkgbuild_paths))
+        for pkgbuild_path, key, srcinfo in pool_iter:
             if srcinfo is not None:
                 yield srcinfo
             else:
-                to_parse.append((pkgbuild_path, mode))
+                to_parse.append((pkgbuild_path, key))
 
-        print("Parsing PKGBUILD files...")
-        for srcinfo in executor.map(partial(get_srcinfo_for_pkgbuild, msys2_root), to_parse):
-            yield srcinfo
+        print("Looking up PKGBUILD metadata...")
+        index.load_dates([p for p, k in to_parse])
+        jobs = [
+            ParseJob(p, mode, k, index.get_repo(p), index.get_relpath(p), index.get_date(p))
+            for p, k in to_parse]
 
+        if backend.libmakepkg is not None and jobs and not check_libmakepkg(backend, pool, jobs):
+            print("WARNING: libmakepkg gives a different result than makepkg, using makepkg instead")
+            backend.libmakepkg = None
+
+        print("Parsing PKGBUILD files...")
+        pending = deque(sort_jobs(jobs, order, previous or {}))
+        running: Set[Future] = set()
+        start = time.monotonic()
+        parsed = 0
+        stopped = False
+        while running or (pending and not stopped):
+            while pending and not stopped and len(running) < max_workers:
+                job, cost = pending[0]
+                if deadline is not None and time.monotonic() + cost > deadline:
+                    print("time limit reached, not starting any new jobs")
+                    stopped = True
+                    break
+                pending.popleft()
+                running.add(executor.submit(get_srcinfo_for_pkgbuild, backend, pool, job))
+            if not running:
+                break
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                parsed += 1
+                yield future.result()
+
+        elapsed = time.monotonic() - start
+        if parsed:
+            print("Parsed %d PKGBUILD files in %.1fs (%.2f/s), %d remaining" % (
+                parsed, elapsed, parsed / elapsed, len(pending)))
+        for job, cost in pending:
+            yield Skipped(job.pkgbuild_path)
+
+
+def validate_srcinfo(entry: CacheEntry) -> None:
+    """Validates the extra metadata, raises ValidationError if invalid"""
 
-def validate_srcinfo(entry: CacheEntry):
     if "extra" in entry:
         extra_to_pkgextra_entry(entry["extra"])
 
 
+def add_parsed_field(entry: CacheEntry) -> None:
+    """Adds the pre-parsed SRCINFOs, for entries written before they existed"""
+
+    if "parsed" not in entry:
+        entry["parsed"] = compact_srcinfos(entry["srcinfo"])
+
+
+def get_stats_path(cache_path: str) -> str:
+    return cache_path + ".stats.json"
+
+
+def read_stats(stats_path: str) -> Dict[str, Dict[str, Union[float, str]]]:
+    """Returns the stats of the last time each package was parsed, by package
+    path. They are kept out of the cache, so the cache only depends on the
+    repo content. Contains the "duration" in seconds and when it was
+    "generated", as an ISO 8601 UTC timestamp.
+    """
+
+    try:
+        with open(stats_path, "r", encoding="utf-8") as h:
+            return json.load(h)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def write_stats(stats_path: str, stats: Dict[str, Dict[str, Union[float, str]]]) -> None:
+    temp_path = stats_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as h:
+        json.dump(stats, h, indent=2, sort_keys=True)
+    os.replace(temp_path, stats_path)
+
+
+def get_validated_path(cache_path: str) -> str:
+    return cache_path + ".validated"
+
+
+def read_validated(validated_path: str, cache_path: str) -> bool:
+    """Returns if all entries of the cache file were validated against the
+    current schema version. This is kept next to the cache, which works for
+    every format, and only applies as long as the cache file is unchanged.
+    """
+
+    try:
+        with open(validated_path, "r", encoding="utf-8") as h:
+            marker = json.load(h)
+        stat = os.stat(cache_path)
+    except (FileNotFoundError, ValueError):
+        return False
+    return marker == {"schema": get_schema_version(), "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def write_validated(validated_path: str, cache_path: str) -> None:
+    """Records that all entries of the cache file were validated, see read_validated()"""
+
+    stat = os.stat(cache_path)
+    temp_path = validated_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as h:
+        json.dump({"schema": get_schema_version(), "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}, h)
+    os.replace(temp_path, validated_path)
+
+
+def get_journal_path(cache_path: str) -> str:
+    return cache_path + ".journal"
+
+
+def read_journal(journal_path: str) -> Tuple[List[CacheTuple], int]:
+    """Returns all valid entries from the journal, in case it exists, and the
+    offset after the last complete line, where appending should continue"""
+
+    entries: List[CacheTuple] = []
+    end = 0
+    try:
+        with open(journal_path, "rb") as h:
+            for line in h:
+                # the last line might be incomplete if we got killed while writing it
+                if not line.endswith(b"\n"):
+                    break
+                end += len(line)
+                try:
+                    key, entry = json.loads(line)
+                except ValueError:
+                    print("WARNING: skipping invalid journal entry at offset %d in %r" % (end - len(line), journal_path))
+                    continue
+                entries.append((key, entry))
+    except FileNotFoundError:
+        pass
+    return entries, end
+
+
+class Journal:
+    """An append-only log of new cache entries, flushed to disk after each entry"""
+
+    def __init__(self, journal_path: str, end: int) -> None:
+        """end is the offset returned by read_journal(), anything after it gets dropped"""
+
+        self._file = open(journal_path, "a+b")
+        self._file.truncate(end)
+
+    def append(self, entry: CacheTuple) -> None:
+        self._file.write(json.dumps(entry).encode("utf-8") + b"\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._file.close()
+
+
 def main(argv: List[str]) -> None:
     parser = argparse.ArgumentParser(description="Create SRCINFOs for all packages in a repo", allow_abbrev=False)
     parser.add_argument('mode', choices=['msys', 'mingw'], help="The type of the repo")
-    parser.add_argument("msys2_root", help="The path to MSYS2")
+    parser.add_argument("msys2_root", help="The path to MSYS2, not used with --backend=linux")
     parser.add_argument("repo_path", help="The path to GIT repo")
     parser.add_argument("json_cache", help="The path to the json.gz file used to fetch/store the results")
+    parser.add_argument(
+        "--format", choices=["json", "indexed"], default=None,
+        help="The format of the cache file to write, defaults to the format of the existing file, or json")
     parser.add_argument(
         "--time-limit", action="store",
         type=int, dest="time_limit", default=0,
         help='time after which it will stop and save, 0 means no limit')
+    parser.add_argument(
+        "--order", choices=["walk", "cost", "stale"], default="walk",
+        help="the order in which to parse PKGBUILD files: as found, cheapest first, or parsed longest ago first")
+    parser.add_argument(
+        "--backend", choices=["msys", "linux"], default="msys",
+        help="use the bash/makepkg from MSYS2, or the native ones on Linux with an emulated MSYS2 environment")
+    parser.add_argument("--bash", default="bash", help="the bash executable for --backend=linux")
+    parser.add_argument("--makepkg", default="makepkg", help="the makepkg executable for --backend=linux")
+    parser.add_argument(
+        "--libmakepkg", help="the libmakepkg directory (as seen from bash, like /usr/share/makepkg) to use "
+        "instead of running makepkg for each arch, defaults to the one belonging to makepkg")
+    parser.add_argument(
+        "--no-libmakepkg", action="store_true", help="always run makepkg for each arch")
+    parser.add_argument(
+        "--incremental", action="store_true",
+        help="only look at packages changed since the commit the cache was created from, "
+             "needs the indexed format")
     args = parser.parse_args(argv[1:])
 
     t = time.monotonic()
 
     srcinfo_path = os.path.abspath(args.json_cache)
-    cache: Cache = {}
+    cache_format = args.format or get_srcinfo_cache_format(srcinfo_path) or "json"
+    # the json format has no place for the commit
+    if args.incremental and cache_format != "indexed":
+        parser.error("--incremental needs the indexed format, see --format")
+    cache_file: SrcinfoCache
     try:
-        with open(srcinfo_path, "rb") as h:
-            cache = json.loads(gzip.decompress(h.read()))
+        cache_file = open_srcinfo_cache(srcinfo_path)
     except FileNotFoundError:
-        pass
+        cache_file = JsonSrcinfoCache({})
+
+    # Results of a previous run which didn't finish
+    journal_path = get_journal_path(srcinfo_path)
+    journal_list, journal_end = read_journal(journal_path)
+    journal_entries = dict(journal_list)
+    if journal_entries:
+        print("Replayed %d entries from %r" % (len(journal_entries), journal_path))
+    cache = ChainMap(journal_entries, cache_file)
+
+    # All entries of the cache were validated against the current schema before
+    validated_path = get_validated_path(srcinfo_path)
+    validated = read_validated(validated_path, srcinfo_path)
+
+    # How long parsing took the last time, for ordering the packages
+    stats_path = get_stats_path(srcinfo_path)
+    stats = read_stats(stats_path)
+
+    index = RepoIndex(args.repo_path)
+    head_commit = get_head_commit(args.repo_path)
+
+    # Only look at changed packages and take everything else from the cache
+    pkgbuild_paths = None
+    carried: List[CacheTuple] = []
+    if args.incremental:
+        old_commit = cache_file.meta.get("commit")
+        changed = None
+        if old_commit is not None:
+            changed = get_changed_package_dirs(args.repo_path, index.prefix, old_commit)
+        if changed is None:
+            print("No usable commit recorded in the cache, doing a full scan")
+        else:
+            touched_dirs, pkgbuild_paths = changed
+            print("%d packages changed since %s" % (len(pkgbuild_paths), old_commit))
+            for key, entry in cache_file.iter_entries(["path"]):
+                if entry.get("path") not in touched_dirs:
+                    carried.append((key, cache_file[key]))
+
+    backend: Backend
+    if args.backend == "linux":
+        backend = LinuxBackend(args.bash, args.makepkg, args.libmakepkg)
+    else:
+        backend = MsysBackend(args.msys2_root, args.libmakepkg)
+    if backend.libmakepkg is None and not args.no_libmakepkg:
+        backend.libmakepkg = backend.find_libmakepkg()
 
+    deadline = t + args.time_limit if args.time_limit else None
     srcinfos = []
-    for entry in iter_srcinfo(args.msys2_root, args.repo_path, args.mode, cache):
-        if entry is None:
-            continue
-        validate_srcinfo(entry[1])
-        srcinfos.append(entry)
-        # So we stop before CI times out
-        if args.time_limit and time.monotonic() - t > args.time_limit:
-            print("time limit reached, stopping")
-            break
-
-    srcinfos_dict = OrderedDict(sorted(srcinfos))
-    with open(srcinfo_path, "wb") as h:
-        h.write(gzip.compress(json.dumps(srcinfos_dict, indent=2).encode("utf-8")))
+    complete = True
+    journal = Journal(journal_path, journal_end)
+    try:
+        for srcinfo in chain(carried, iter_srcinfo(
+                backend, args.repo_path, args.mode, cache, args.order, stats, deadline,
+                index, pkgbuild_paths)):
+            # Failed PKGBUILDs are left out, and with --incremental only retried
+            # once they change. Skipped ones are missing, so we can't build on it.
+            if isinstance(srcinfo, Skipped):
+                complete = False
+                continue
+            if srcinfo is None:
+                continue
+            key, entry = srcinfo
+            if not (validated and key in cache_file):
+                validate_srcinfo(entry)
+            add_parsed_field(entry)
+            if key not in cache:
+                journal.append(srcinfo)
+            # only new entries have it, the journal keeps it in case we get interrupted
+            if "duration" in entry:
+                generated = datetime.now(timezone.utc).isoformat(timespec="seconds")
+                stats[entry["path"]] = {"duration": entry.pop("duration"), "generated": generated}
+            srcinfos.append(srcinfo)
+    finally:
+        journal.close()
+        cache_file.close()
+        backend.close()
+
+    # Only if all packages are included can the next run build on top of it
+    meta: Dict[str, str] = {}
+    if complete and head_commit is not None:
+        meta["commit"] = head_commit
+    write_srcinfo_cache(srcinfo_path, srcinfos, cache_format, meta)
+    # everything written got validated
+    write_validated(validated_path, srcinfo_path)
+    paths = {entry.get("path") for key, entry in srcinfos}
+    write_stats(stats_path, {path: value for path, value in stats.items() if path in paths})
+    os.remove(journal_path)
 
     return None
 
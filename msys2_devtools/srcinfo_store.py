@@ -0,0 +1,261 @@
+"""Reading and writing srcinfo cache files.
+
+There are two formats:
+
+* "json": A gzip compressed JSON object mapping cache keys to entries. This is
+  what gets published and can be loaded by anything, but has to be loaded
+  completely.
+* "indexed": Every field of every entry is compressed separately, followed by
+  an index containing the offsets for each cache key and the pkgbase. This
+  allows looking up single entries or fields without loading everything.
+
+Use open_srcinfo_cache() to get a SrcinfoCache for either format.
+"""
+
+import gzip
+import json
+import mmap
+import os
+import struct
+import zlib
+from abc import abstractmethod
+from collections.abc import Mapping
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from .srcinfo import get_entry_base
+
+CacheEntry = Dict[str, Any]
+
+INDEXED_MAGIC = b"MSYS2-SRCINFO-1\n"
+
+# index offset + index size
+_TRAILER = struct.Struct("<QQ")
+
+Buffer = Union[bytes, mmap.mmap]
+
+
+def get_entry_pkgbase(entry: CacheEntry) -> str:
+    """Returns the pkgbase of a cache entry, or an empty string"""
+
+    base = get_entry_base(entry)
+    if base is None:
+        return ""
+    return base["pkgbase"][0]
+
+
+class SrcinfoCache(Mapping):
+    """Read-only mapping of cache keys to cache entries.
+
+    In addition to the mapping interface it allows loading only some fields
+    of the entries, and looking up entries by pkgbase.
+    """
+
+    meta: Dict[str, Any]
+    """Extra information about the cache as a whole. Only the indexed format
+    can store it, with the json format it is always empty."""
+
+    @abstractmethod
+    def get_fields(self, key: str, fields: Iterable[str]) -> CacheEntry:
+        """Returns the entry for the key, only containing the given fields (if they exist)"""
+
+    @abstractmethod
+    def get_pkgbase(self, key: str) -> str:
+        pass
+
+    @abstractmethod
+    def __getitem__(self, key: str) -> CacheEntry:
+        pass
+
+    def iter_entries(self, fields: Optional[Iterable[str]] = None) -> Iterator[Tuple[str, CacheEntry]]:
+        """Yields (key, entry) for all entries, optionally only with some of the fields"""
+
+        if fields is None:
+            for key in self:
+                yield (key, self[key])
+        else:
+            fields = list(fields)
+            for key in self:
+                yield (key, self.get_fields(key, fields))
+
+    def iter_field(self, field: str) -> Iterator[Tuple[str, Any]]:
+        """Yields (key, value) for all entries which have the field"""
+
+        for key, entry in self.iter_entries([field]):
+            if field in entry:
+                yield (key, entry[field])
+
+    def get_parsed_entry(self, key: str, fields: Iterable[str] = ()) -> CacheEntry:
+        """Like get_fields(), but also includes the pre-parsed SRCINFOs, or the raw
+        ones for caches written before entries had them. To be used with
+        srcinfo.iter_entry_srcinfos().
+        """
+
+        entry = self.get_fields(key, list(fields) + ["parsed"])
+        if "parsed" not in entry:
+            entry.update(self.get_fields(key, ["srcinfo"]))
+        return entry
+
+    def iter_parsed_entries(self, fields: Iterable[str] = ()) -> Iterator[Tuple[str, CacheEntry]]:
+        """Like iter_entries(), but the entries are like from get_parsed_entry()"""
+
+        fields = list(fields)
+        for key in self:
+            yield (key, self.get_parsed_entry(key, fields))
+
+    def find_pkgbase(self, pkgbase: str) -> List[str]:
+        """Returns the keys of all entries with the given pkgbase"""
+
+        return [key for key in self if self.get_pkgbase(key) == pkgbase]
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self) -> "SrcinfoCache":
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+
+class JsonSrcinfoCache(SrcinfoCache):
+    """A cache fully loaded from the json format"""
+
+    def __init__(self, entries: Dict[str, CacheEntry]) -> None:
+        self._entries = entries
+        self._pkgbases: Dict[str, str] = {}
+        # the format has no place for it
+        self.meta = {}
+
+    def __getitem__(self, key: str) -> CacheEntry:
+        return self._entries[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._entries)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_fields(self, key: str, fields: Iterable[str]) -> CacheEntry:
+        entry = self._entries[key]
+        return {f: entry[f] for f in fields if f in entry}
+
+    def get_pkgbase(self, key: str) -> str:
+        if key not in self._pkgbases:
+            self._pkgbases[key] = get_entry_pkgbase(self._entries[key])
+        return self._pkgbases[key]
+
+
+class IndexedSrcinfoCache(SrcinfoCache):
+    """A cache in the indexed format, loading fields on demand"""
+
+    def __init__(self, data: Buffer) -> None:
+        if data[:len(INDEXED_MAGIC)] != INDEXED_MAGIC:
+            raise ValueError("not an indexed srcinfo cache")
+        offset, size = _TRAILER.unpack(data[-_TRAILER.size:])
+        index = json.loads(zlib.decompress(data[offset:offset + size]))
+
+        self._data = data
+        self.meta = index["meta"]
+        self._index: Dict[str, Dict[str, Any]] = index["entries"]
+        self._by_pkgbase: Dict[str, List[str]] = {}
+        for key, item in self._index.items():
+            self._by_pkgbase.setdefault(item["pkgbase"], []).append(key)
+
+    def _load_field(self, location: List[int]) -> Any:
+        offset, size = location
+        return json.loads(zlib.decompress(self._data[offset:offset + size]))
+
+    def __getitem__(self, key: str) -> CacheEntry:
+        fields = self._index[key]["fields"]
+        return {f: self._load_field(loc) for f, loc in fields.items()}
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._index)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._index
+
+    def get_fields(self, key: str, fields: Iterable[str]) -> CacheEntry:
+        locations = self._index[key]["fields"]
+        return {f: self._load_field(locations[f]) for f in fields if f in locations}
+
+    def get_pkgbase(self, key: str) -> str:
+        return self._index[key]["pkgbase"]
+
+    def find_pkgbase(self, pkgbase: str) -> List[str]:
+        return list(self._by_pkgbase.get(pkgbase, []))
+
+    def close(self) -> None:
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+
+
+def parse_srcinfo_cache(data: bytes) -> SrcinfoCache:
+    """Returns a SrcinfoCache for the content of a cache file in either format"""
+
+    if data.startswith(INDEXED_MAGIC):
+        return IndexedSrcinfoCache(data)
+    return JsonSrcinfoCache(json.loads(gzip.decompress(data)))
+
+
+def open_srcinfo_cache(path: str) -> SrcinfoCache:
+    """Opens a cache file in either format. Raises FileNotFoundError if it doesn't exist."""
+
+    with open(path, "rb") as h:
+        if h.read(len(INDEXED_MAGIC)) == INDEXED_MAGIC:
+            return IndexedSrcinfoCache(mmap.mmap(h.fileno(), 0, access=mmap.ACCESS_READ))
+        h.seek(0)
+        return JsonSrcinfoCache(json.loads(gzip.decompress(h.read())))
+
+
+def get_srcinfo_cache_format(path: str) -> Optional[str]:
+    """Returns the format of an existing cache file, or None if it doesn't exist"""
+
+    try:
+        with open(path, "rb") as h:
+            return "indexed" if h.read(len(INDEXED_MAGIC)) == INDEXED_MAGIC else "json"
+    except FileNotFoundError:
+        return None
+
+
+def dump_srcinfo_cache(entries: Iterable[Tuple[str, CacheEntry]], format: str = "json",
+                       meta: Optional[Dict[str, Any]] = None) -> bytes:
+    """Serializes the (key, entry) pairs, sorted by key, in the given format"""
+
+    sorted_entries = sorted(entries, key=lambda e: e[0])
+
+    if format == "json":
+        return gzip.compress(json.dumps(dict(sorted_entries), indent=2).encode("utf-8"))
+    elif format != "indexed":
+        raise ValueError(f"unknown format {format!r}")
+
+    parts = [INDEXED_MAGIC]
+    offset = len(INDEXED_MAGIC)
+    index: Dict[str, Dict[str, Any]] = {}
+    for key, entry in sorted_entries:
+        fields = {}
+        for name, value in entry.items():
+            blob = zlib.compress(json.dumps(value, separators=(",", ":")).encode("utf-8"))
+            fields[name] = [offset, len(blob)]
+            parts.append(blob)
+            offset += len(blob)
+        index[key] = {"pkgbase": get_entry_pkgbase(entry), "fields": fields}
+
+    index_blob = zlib.compress(json.dumps({"meta": meta or {}, "entries": index}).encode("utf-8"))
+    parts.append(index_blob)
+    parts.append(_TRAILER.pack(offset, len(index_blob)))
+    return b"".join(parts)
+
+
+def write_srcinfo_cache(path: str, entries: Iterable[Tuple[str, CacheEntry]], format: str = "json",
+                        meta: Optional[Dict[str, Any]] = None) -> None:
+    """Atomically writes a cache file in the given format"""
+
+    data = dump_srcinfo_cache(entries, format, meta)
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as h:
+        h.write(data)
+    os.replace(temp_path, path)
@@ -1,103 +1,149 @@
-from typing import Any
-from itertools import zip_longest
+import os
+import re
+from functools import lru_cache
+from itertools import groupby
+from typing import Any, Collection
 
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-def vercmp(v1: str, v2: str) -> int:
 
-    def cmp(a: Any, b: Any) -> int:
-        res = (a > b) - (a < b)
-        assert isinstance(res, int)
-        return res
+# Segment ranks, so that comparing (rank, value) tuples gives the rpmvercmp
+# order: a version which ended is newer than one continuing with letters, but
+# older than one continuing with anything else.
+_ALPHA, _END, _OTHER, _DIGIT = range(4)
+
+_END_SEGMENT = (_END,)
+
+_ASCII_SEGMENTS = re.compile(r"[0-9]+|[A-Za-z]+|[^0-9A-Za-z]+")
+
+Segments = tuple[tuple[Any, ...], ...]
+
+
+def _get_type(c: str) -> int:
+    if c.isdigit():
+        return _DIGIT
+    elif c.isalpha():
+        return _ALPHA
+    else:
+        return _OTHER
+
+
+def _parse_segments(v: str) -> Segments:
+    """Splits a version part into (rank, value) tuples, followed by an end
+    marker. Digits compare by value, letters as strings and other characters
+    only by their count."""
+
+    segments: list[tuple[Any, ...]] = []
+    if v.isascii():
+        for part in _ASCII_SEGMENTS.findall(v):
+            c = part[0]
+            if c.isdigit():
+                segments.append((_DIGIT, int(part)))
+            elif c.isalpha():
+                segments.append((_ALPHA, part))
+            else:
+                segments.append((_OTHER, len(part)))
+    else:
+        for k, g in groupby(v, _get_type):
+            part = "".join(g)
+            if k == _DIGIT:
+                segments.append((_DIGIT, int(part)))
+            elif k == _ALPHA:
+                segments.append((_ALPHA, part))
+            else:
+                segments.append((_OTHER, len(part)))
+    segments.append(_END_SEGMENT)
+    return tuple(segments)
+
+
+class VersionKey:
+    """A parsed version, compares like vercmp()
+
+    The release only gets compared if both versions have one, so "1.0" is
+    equal to both "1.0-1" and "1.0-2". Because of that this isn't a plain
+    tuple, but sorting works the same way as with vercmp().
+    """
 
-    def split(v: str) -> tuple[str, str, str | None]:
+    __slots__ = ("epoch", "version", "release", "_main")
+
+    def __init__(self, v: str) -> None:
         if "~" in v:
             e, v = v.split("~", 1)
         else:
-            e, v = ("0", v)
+            e = "0"
 
         r: str | None = None
         if "-" in v:
             v, r = v.rsplit("-", 1)
-        else:
-            v, r = (v, None)
 
-        return (e, v, r)
+        self.epoch = _parse_segments(e)
+        self.version = _parse_segments(v)
+        self.release = _parse_segments(r) if r is not None else None
+        self._main = (self.epoch, self.version)
 
-    digit, alpha, other = range(3)
+    def compare(self, other: "VersionKey") -> int:
+        a: Any = self._main
+        b: Any = other._main
+        if a == b:
+            if self.release is None or other.release is None:
+                return 0
+            a = self.release
+            b = other.release
+        return (a > b) - (a < b)
 
-    def get_type(c: str) -> int:
-        assert c
-        if c.isdigit():
-            return digit
-        elif c.isalpha():
-            return alpha
-        else:
-            return other
-
-    def parse(v: str) -> list[str]:
-        parts: list[str] = []
-        current = ""
-        for c in v:
-            if not current:
-                current += c
-            else:
-                if get_type(c) == get_type(current):
-                    current += c
-                else:
-                    parts.append(current)
-                    current = c
-
-        if current:
-            parts.append(current)
-
-        return parts
-
-    def rpmvercmp(v1: str, v2: str) -> int:
-        for p1, p2 in zip_longest(parse(v1), parse(v2), fillvalue=None):
-            if p1 is None:
-                assert p2 is not None
-                if get_type(p2) == alpha:
-                    return 1
-                return -1
-            elif p2 is None:
-                assert p1 is not None
-                if get_type(p1) == alpha:
-                    return -1
-                return 1
-
-            t1 = get_type(p1)
-            t2 = get_type(p2)
-            if t1 != t2:
-                if t1 == digit:
-                    return 1
-                elif t2 == digit:
-                    return -1
-                elif t1 == other:
-                    return 1
-                elif t2 == other:
-                    return -1
-            elif t1 == other:
-                ret = cmp(len(p1), len(p2))
-                if ret != 0:
-                    return ret
-            elif t1 == digit:
-                ret = cmp(int(p1), int(p2))
-                if ret != 0:
-                    return ret
-            elif t1 == alpha:
-                ret = cmp(p1, p2)
-                if ret != 0:
-                    return ret
-
-        return 0
-
-    e1, v1, r1 = split(v1)
-    e2, v2, r2 = split(v2)
-
-    ret = rpmvercmp(e1, e2)
-    if ret == 0:
-        ret = rpmvercmp(v1, v2)
-        if ret == 0 and r1 is not None and r2 is not None:
-            ret = rpmvercmp(r1, r2)
-
-    return ret
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, VersionKey):
+            return NotImplemented
+        return self.compare(other) == 0
+
+    def __lt__(self, other: "VersionKey") -> bool:
+        if self._main != other._main:
+            return self._main < other._main
+        return self.release is not None and other.release is not None and self.release < other.release
+
+    def __le__(self, other: "VersionKey") -> bool:
+        return not other < self
+
+    def __gt__(self, other: "VersionKey") -> bool:
+        return other < self
+
+    def __ge__(self, other: "VersionKey") -> bool:
+        return not self < other
+
+    def __hash__(self) -> int:
+        return hash(self._main)
+
+
+@lru_cache(maxsize=16384)
+def version_key(v: str) -> VersionKey:
+    """Returns the VersionKey for a version, cached. Can be used as a sort key."""
+
+    return VersionKey(v)
+
+
+def vercmp(v1: str, v2: str) -> int:
+    return version_key(v1).compare(version_key(v2))
+
+
+def get_cache_dir() -> str:
+    """Returns the directory for persistent caches of all tools"""
+
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_dir, "msys2-devtools")
+
+
+def create_session(concurrency: int, retry_methods: Collection[str] = ("GET",)) -> requests.Session:
+    """Returns a session which keeps up to 'concurrency' connections alive, and
+    retries requests with the given methods with backoff on rate limiting and
+    server errors. Only pass methods which are idempotent for all requests made."""
+
+    retry = Retry(
+        total=5, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=list(retry_methods), respect_retry_after_header=True)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=concurrency, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
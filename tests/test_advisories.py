@@ -0,0 +1,134 @@
+import json
+import os
+import types
+
+from cyclonedx.model.bom import Bom
+
+from msys2_devtools.advisories import AdvisoryIndex, get_affected_key, get_component_keys, is_affected, \
+    write_advisory_index, open_advisory_index
+from msys2_devtools.sbom import handle_match_command, write_sbom_streaming
+from msys2_devtools.srcinfo_store import write_srcinfo_cache
+
+ADVISORIES = [
+    {
+        "id": "GHSA-1", "aliases": ["CVE-2024-1"], "summary": "django issue",
+        "affected": [{
+            "package": {"ecosystem": "PyPI", "name": "Django"},
+            "ranges": [{"type": "ECOSYSTEM", "events": [{"introduced": "0"}, {"fixed": "1.2"}]}],
+        }],
+    },
+    {
+        "id": "CVE-2024-2",
+        "affected": [{
+            "package": {"cpe": "cpe:2.3:a:zlib:zlib:*"},
+            "ranges": [{"type": "ECOSYSTEM", "events": [
+                {"introduced": "1.2"}, {"last_affected": "1.3"}, {"introduced": "2.0"}, {"fixed": "2.1"}]}],
+        }],
+    },
+    {
+        "id": "CVE-2024-3",
+        "affected": [{"package": {"purl": "pkg:pypi/django"}, "versions": ["1.0"]}],
+    },
+    {
+        "id": "CVE-2024-4", "withdrawn": "2024-01-01T00:00:00Z",
+        "affected": [{"package": {"purl": "pkg:pypi/django"}, "versions": ["1.0"]}],
+    },
+]
+
+
+def test_is_affected():
+    zlib = ADVISORIES[1]["affected"][0]
+    assert not is_affected("1.1", zlib)
+    assert is_affected("1.2", zlib)
+    assert is_affected("1.3", zlib)
+    assert not is_affected("1.3.1", zlib)
+    assert is_affected("2.0.5", zlib)
+    assert not is_affected("2.1", zlib)
+    assert is_affected("0.1", ADVISORIES[0]["affected"][0])
+    assert not is_affected("1.2", ADVISORIES[0]["affected"][0])
+
+
+def test_keys():
+    assert get_affected_key(ADVISORIES[0]["affected"][0]) == "pkg:pypi/django"
+    assert get_affected_key(ADVISORIES[1]["affected"][0]) == "cpe:/a:zlib:zlib"
+    assert get_component_keys({"cpe": "cpe:/a:zlib:zlib:1.3", "purl": "pkg:pypi/Django@1.0"}) == [
+        ("cpe:/a:zlib:zlib", "1.3"), ("pkg:pypi/django", "1.0")]
+    # both sides are normalized the same way, regardless of CPE version and case
+    assert get_affected_key({"package": {"cpe": "cpe:2.3:a:GNU:g\\+\\+:*:*"}}) == \
+        get_component_keys({"cpe": "cpe:/a:gnu:g%2B%2B:1.0"})[0][0] == "cpe:/a:gnu:g%2b%2b"
+
+
+def test_index(tmp_path):
+    path = str(tmp_path / "index")
+    write_advisory_index(path, ADVISORIES)
+    with AdvisoryIndex(path) as index:
+        assert len(index) == 2
+        assert [a["id"] for a in index.lookup("pkg:pypi/django")] == ["GHSA-1", "CVE-2024-3"]
+        assert index.lookup("pkg:pypi/other") == []
+
+
+def test_open_advisory_index(tmp_path):
+    advisories_path = tmp_path / "advisories"
+    advisories_path.mkdir()
+    for advisory in ADVISORIES:
+        (advisories_path / f"{advisory['id']}.json").write_text(json.dumps(advisory))
+    index_path = str(tmp_path / "advisories.index")
+
+    def lookup():
+        with open_advisory_index(index_path, str(advisories_path)) as index:
+            return [a["id"] for a in index.lookup("pkg:pypi/django")]
+
+    assert lookup() == ["CVE-2024-3", "GHSA-1"]
+    mtime = os.stat(index_path).st_mtime_ns
+    assert lookup() == ["CVE-2024-3", "GHSA-1"]
+    assert os.stat(index_path).st_mtime_ns == mtime
+
+    # a changed file gets noticed, even if it is older than the index
+    changed = advisories_path / "CVE-2024-3.json"
+    changed.write_text(json.dumps(dict(ADVISORIES[2], withdrawn="2024-01-01T00:00:00Z")))
+    os.utime(changed, ns=(0, 0))
+    assert lookup() == ["GHSA-1"]
+
+    # and a removed one as well
+    os.remove(advisories_path / "GHSA-1.json")
+    assert lookup() == []
+
+
+def test_match_command(tmp_path):
+    entries = [
+        ("a", {"srcinfo": {"ucrt64": "pkgbase = mingw-w64-zlib\npkgver = 1.3-1"},
+               "extra": {"references": ["cpe: cpe:/a:zlib:zlib"]}}),
+        ("b", {"srcinfo": {"ucrt64": "pkgbase = mingw-w64-python-django\npkgver = 1.0-1"},
+               "extra": {"references": ["purl: pkg:pypi/django"], "ignore_vulnerabilities": ["CVE-2024-1"]}}),
+        ("c", {"srcinfo": {"ucrt64": "pkgbase = mingw-w64-other\npkgver = 1.0-1"}}),
+    ]
+    cache_path = str(tmp_path / "srcinfo.json.gz")
+    write_srcinfo_cache(cache_path, entries)
+    sbom_path = str(tmp_path / "sbom.json")
+    write_sbom_streaming(cache_path, sbom_path)
+    advisories_path = tmp_path / "advisories"
+    advisories_path.mkdir()
+    for advisory in ADVISORIES:
+        (advisories_path / f"{advisory['id']}.json").write_text(json.dumps(advisory))
+
+    for i in range(2):
+        handle_match_command(types.SimpleNamespace(
+            target_sbom=sbom_path, advisories=str(advisories_path), index=None, rebuild_index=False,
+            srcinfo_cache=cache_path))
+        assert (tmp_path / "advisories.index").exists()
+
+        with open(sbom_path, encoding="utf-8") as h:
+            sbom = json.load(h)
+        refs = {c["name"]: c["bom-ref"] for c in sbom["components"]}
+        vulns = {v["id"]: v for v in sbom["vulnerabilities"]}
+        assert sorted(vulns) == ["CVE-2024-2", "CVE-2024-3", "GHSA-1"]
+        assert vulns["CVE-2024-2"]["affects"] == [
+            {"ref": refs["zlib"], "versions": [{"version": "2.1", "status": "unaffected"}]}]
+        assert "analysis" not in vulns["CVE-2024-2"]
+        assert vulns["GHSA-1"]["affects"] == [
+            {"ref": refs["django"], "versions": [{"version": "1.2", "status": "unaffected"}]}]
+        assert vulns["GHSA-1"]["analysis"] == {"state": "not_affected"}
+        assert vulns["GHSA-1"]["description"] == "django issue"
+
+    bom = Bom.from_json(sbom)
+    assert len(bom.vulnerabilities) == 3
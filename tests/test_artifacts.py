@@ -0,0 +1,105 @@
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from msys2_devtools.artifacts import ArtifactCache
+from msys2_devtools.utils import create_session
+
+
+class FileServer(ThreadingHTTPServer):
+    """Serves files from a dict, with ETag or Last-Modified validators"""
+
+    def __init__(self) -> None:
+        super().__init__(("127.0.0.1", 0), FileHandler)
+        self.files: dict[str, tuple[bytes, int]] = {}
+        self.requests: list[tuple[str, int]] = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return "http://%s:%d" % self.server_address[:2]
+
+
+class FileHandler(BaseHTTPRequestHandler):
+
+    server: FileServer
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        server = self.server
+        if self.path not in server.files:
+            status = 404
+        else:
+            data, version = server.files[self.path]
+            etag = '"%d"' % version
+            last_modified = formatdate(1000000000 + version, usegmt=True)
+            if self.path.startswith("/etag/"):
+                status = 304 if self.headers.get("If-None-Match") == etag else 200
+            else:
+                status = 304 if self.headers.get("If-Modified-Since") == last_modified else 200
+        with server.lock:
+            server.requests.append((self.path, status))
+
+        self.send_response(status)
+        if status == 200:
+            if self.path.startswith("/etag/"):
+                self.send_header("ETag", etag)
+            else:
+                self.send_header("Last-Modified", last_modified)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+
+@pytest.fixture
+def server():
+    server = FileServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_artifact_cache(server, tmp_path):
+    server.files["/etag/a.db"] = (b"a1", 1)
+    server.files["/date/a.db"] = (b"b1", 1)
+    urls = [server.url + "/etag/a.db", server.url + "/date/a.db"]
+
+    def fetch_all():
+        server.requests.clear()
+        with create_session(2) as session:
+            cache = ArtifactCache(str(tmp_path / "cache"), session)
+            result = []
+            for url, path in cache.fetch_all(urls, 2):
+                with open(path, "rb") as h:
+                    result.append((url, h.read()))
+            return result, sorted(server.requests)
+
+    assert fetch_all() == (
+        [(urls[0], b"a1"), (urls[1], b"b1")], [("/date/a.db", 200), ("/etag/a.db", 200)])
+    # nothing changed, nothing gets transferred
+    assert fetch_all() == (
+        [(urls[0], b"a1"), (urls[1], b"b1")], [("/date/a.db", 304), ("/etag/a.db", 304)])
+
+    server.files["/etag/a.db"] = (b"a2", 2)
+    server.files["/date/a.db"] = (b"b2", 2)
+    assert fetch_all() == (
+        [(urls[0], b"a2"), (urls[1], b"b2")], [("/date/a.db", 200), ("/etag/a.db", 200)])
+
+    # no leftover temp files, the data and the validators for each URL
+    assert len(list((tmp_path / "cache").iterdir())) == 4
+
+    del server.files["/etag/a.db"]
+    with pytest.raises(requests.HTTPError):
+        fetch_all()
@@ -0,0 +1,274 @@
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import pytest
+
+from msys2_devtools.backend import LinuxBackend
+from msys2_devtools.srcinfo_cache import ParseJob, Skipped, check_libmakepkg, get_srcinfo_for_pkgbuild, iter_srcinfo
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="needs a native bash")
+
+# Handles just enough of the makepkg command line for --printsrcinfo
+STUB_MAKEPKG = """#!/bin/bash
+while [[ $# -gt 0 ]]; do
+    case "$1" in
+        --config) config="$2"; shift 2;;
+        -p) pkgbuild="$2"; shift 2;;
+        *) shift;;
+    esac
+done
+source "$config"
+source "$pkgbuild"
+printf 'pkgbase = %s\\n\\tpkgver = %s\\n\\tarch = %s\\n\\npkgname = %s\\n' \\
+    "$pkgbase" "$pkgver" "$CARCH" "${MINGW_PACKAGE_PREFIX:-msys}-${_realname}"
+"""
+
+# Just enough of libmakepkg for doing the same as the stub makepkg
+STUB_LIBMAKEPKG = {
+    "util.sh": "source_safe() { source \"$1\"; }\n",
+    "lint_pkgbuild.sh": "lint_pkgbuild() { [[ -n $pkgver ]]; }\n",
+    "srcinfo.sh": """write_srcinfo_content() {
+    printf 'pkgbase = %s\\n\\tpkgver = %s\\n\\tarch = %s\\n\\npkgname = %s\\n' \\
+        "$pkgbase" "$pkgver" "$CARCH" "${MINGW_PACKAGE_PREFIX:-msys}-${_realname}"
+}
+""",
+}
+
+
+def write_pkgbuild(path, mingw_arch):
+    path.write_text(
+        "_realname=foo\n"
+        "pkgbase=mingw-w64-${_realname}\n"
+        "pkgver=1.0\n"
+        + (f"mingw_arch=({mingw_arch})\n" if mingw_arch is not None else "")
+        + "msys2_references=('pypi: foo')\n")
+
+
+def test_linux_backend(tmp_path):
+    makepkg = tmp_path / "makepkg"
+    makepkg.write_text(STUB_MAKEPKG)
+    makepkg.chmod(0o755)
+    pkgbuild = tmp_path / "PKGBUILD"
+    write_pkgbuild(pkgbuild, "'ucrt64' 'clangarm64'")
+
+    job = ParseJob(str(pkgbuild), "mingw", "key", "repo", "path", "date")
+    with LinuxBackend(makepkg=str(makepkg)) as backend:
+        with backend.create_pool(1) as pool:
+            result = get_srcinfo_for_pkgbuild(backend, pool, job)
+
+    assert result is not None
+    key, entry = result
+    assert key == "key"
+    assert entry["srcinfo"] == {
+        "ucrt64": "pkgbase = mingw-w64-foo\n\tpkgver = 1.0\n\tarch = x86_64\n\npkgname = mingw-w64-ucrt-x86_64-foo\n",
+        "clangarm64": "pkgbase = mingw-w64-foo\n\tpkgver = 1.0\n\tarch = aarch64\n\npkgname = mingw-w64-clang-aarch64-foo\n",
+    }
+    assert entry["extra"] == {"arch": ["ucrt64", "clangarm64"], "references": ["pypi: foo"]}
+
+
+def test_linux_backend_libmakepkg(tmp_path):
+    makepkg = tmp_path / "makepkg"
+    makepkg.write_text(STUB_MAKEPKG)
+    makepkg.chmod(0o755)
+    libmakepkg = tmp_path / "libmakepkg"
+    libmakepkg.mkdir()
+    for name, content in STUB_LIBMAKEPKG.items():
+        (libmakepkg / name).write_text(content)
+
+    pkg_dir = tmp_path / "pkg"
+    pkg_dir.mkdir()
+    pkgbuild = pkg_dir / "PKGBUILD"
+
+    def get_entries(libmakepkg):
+        entries = []
+        with LinuxBackend(makepkg=str(makepkg), libmakepkg=libmakepkg) as backend:
+            with backend.create_pool(1) as pool:
+                for mode in ["msys", "mingw"]:
+                    result = get_srcinfo_for_pkgbuild(backend, pool, ParseJob(str(pkgbuild), mode, "", "", "", ""))
+                    assert result is not None
+                    entries.append({k: v for k, v in result[1].items() if k != "duration"})
+        return entries
+
+    for mingw_arch in [None, "'clang64'"]:
+        write_pkgbuild(pkgbuild, mingw_arch)
+        expected = get_entries(None)
+        assert get_entries(str(libmakepkg)) == expected
+    assert list(expected[1]["srcinfo"].keys()) == ["clang64"]
+
+    # errors get reported the same way, after falling back to makepkg
+    makepkg.write_text(STUB_MAKEPKG + "[[ -n $pkgver ]]\n")
+    pkgbuild.write_text("pkgname=foo\n")
+    with LinuxBackend(makepkg=str(makepkg), libmakepkg=str(libmakepkg)) as backend:
+        with backend.create_pool(1) as pool:
+            assert get_srcinfo_for_pkgbuild(backend, pool, ParseJob(str(pkgbuild), "msys", "", "", "", "")) is None
+
+
+def test_libmakepkg_fallback(tmp_path, capsys):
+    makepkg = tmp_path / "bin" / "makepkg"
+    makepkg.parent.mkdir()
+    makepkg.write_text(STUB_MAKEPKG)
+    makepkg.chmod(0o755)
+    libmakepkg = tmp_path / "share" / "makepkg"
+    libmakepkg.mkdir(parents=True)
+    for name, content in STUB_LIBMAKEPKG.items():
+        (libmakepkg / name).write_text(content)
+    pkgbuild = tmp_path / "PKGBUILD"
+    write_pkgbuild(pkgbuild, None)
+    job = ParseJob(str(pkgbuild), "msys", "", "", "", "")
+
+    with LinuxBackend(makepkg=str(makepkg)) as backend:
+        assert backend.find_libmakepkg() == str(libmakepkg)
+        with backend.create_pool(1) as pool:
+            expected = get_srcinfo_for_pkgbuild(backend, pool, job)
+    assert expected is not None
+    assert LinuxBackend(makepkg=str(tmp_path / "missing")).find_libmakepkg() is None
+
+    # libmakepkg failing for a package falls back to makepkg
+    (libmakepkg / "lint_pkgbuild.sh").write_text("lint_pkgbuild() { false; }\n")
+    with LinuxBackend(makepkg=str(makepkg), libmakepkg=str(libmakepkg)) as backend:
+        with backend.create_pool(1) as pool:
+            assert check_libmakepkg(backend, pool, [job]) is False
+            result = get_srcinfo_for_pkgbuild(backend, pool, job)
+    assert result is not None and result[1]["srcinfo"] == expected[1]["srcinfo"]
+
+    # a different result for the first package disables it
+    (libmakepkg / "lint_pkgbuild.sh").write_text(STUB_LIBMAKEPKG["lint_pkgbuild.sh"])
+    (libmakepkg / "srcinfo.sh").write_text("write_srcinfo_content() { echo pkgbase = other; }\n")
+    repo_path = tmp_path / "repo"
+    (repo_path / "foo").mkdir(parents=True)
+    write_pkgbuild(repo_path / "foo" / "PKGBUILD", None)
+    for args in [["init", "-q"], ["add", "-A"], ["-c", "user.name=a", "-c", "user.email=a@b", "commit", "-q", "-m", "init"]]:
+        subprocess.check_call(["git"] + args, cwd=repo_path)
+    with LinuxBackend(makepkg=str(makepkg), libmakepkg=str(libmakepkg)) as backend:
+        results = list(iter_srcinfo(backend, str(repo_path), "msys", {}))
+        assert backend.libmakepkg is None
+    assert results[0][1]["srcinfo"] == expected[1]["srcinfo"]
+    assert "different result" in capsys.readouterr().out
+
+
+def test_iter_srcinfo_failed_and_skipped(tmp_path):
+    makepkg = tmp_path / "makepkg"
+    makepkg.write_text(STUB_MAKEPKG + "[[ -n $pkgver ]]\n")
+    makepkg.chmod(0o755)
+    repo_path = tmp_path / "repo"
+    for name in ["good", "bad"]:
+        (repo_path / name).mkdir(parents=True)
+    write_pkgbuild(repo_path / "good" / "PKGBUILD", None)
+    (repo_path / "bad" / "PKGBUILD").write_text("pkgname=bad\n")
+    for args in [["init", "-q"], ["add", "-A"], ["-c", "user.name=a", "-c", "user.email=a@b", "commit", "-q", "-m", "init"]]:
+        subprocess.check_call(["git"] + args, cwd=repo_path)
+
+    with LinuxBackend(makepkg=str(makepkg)) as backend:
+        results = list(iter_srcinfo(backend, str(repo_path), "msys", {}))
+        assert sorted(r is None for r in results) == [False, True]
+
+        results = list(iter_srcinfo(backend, str(repo_path), "msys", {}, deadline=time.monotonic() - 1))
+        assert sorted(results) == sorted(Skipped(str(p)) for p in repo_path.glob("*/PKGBUILD"))
+
+
+# PKGBUILDs covering what the libmakepkg path has to get right: split
+# packages, arch specific arrays and overrides in package functions
+PARITY_PKGBUILDS = {
+    "msys-split": ("msys", """pkgbase=foo
+pkgname=('foo' 'foo-devel')
+pkgver=1.2.3
+pkgrel=2
+pkgdesc="Foo library"
+arch=('i686' 'x86_64')
+url="https://example.com/foo"
+license=('MIT')
+depends=('bar')
+depends_x86_64=('baz')
+makedepends=('gcc')
+source=("https://example.com/foo-${pkgver}.tar.gz")
+source_x86_64=("fix-x86_64.patch")
+sha256sums=('SKIP')
+sha256sums_x86_64=('SKIP')
+
+package_foo() {
+    options=('!strip')
+}
+
+package_foo-devel() {
+    pkgdesc="Foo headers"
+    depends=("foo=${pkgver}")
+    depends_i686=('quux')
+    arch=('any')
+}
+"""),
+    "mingw-split": ("mingw", """_realname=foo
+pkgbase=mingw-w64-${_realname}
+pkgname=("${MINGW_PACKAGE_PREFIX}-${_realname}" "${MINGW_PACKAGE_PREFIX}-${_realname}-docs")
+pkgver=2.0
+pkgrel=1
+pkgdesc="Foo (mingw-w64)"
+arch=('any')
+mingw_arch=('ucrt64' 'clang64' 'clangarm64')
+url="https://example.com/foo"
+msys2_references=('pypi: foo')
+license=('spdx:MIT')
+depends=("${MINGW_PACKAGE_PREFIX}-bar")
+makedepends=("${MINGW_PACKAGE_PREFIX}-cc")
+if [[ ${CARCH} == aarch64 ]]; then
+    depends+=("${MINGW_PACKAGE_PREFIX}-arm-only")
+fi
+source=("https://example.com/foo-${pkgver}.tar.gz")
+sha256sums=('SKIP')
+
+package_foo() {
+    provides=("${MINGW_PACKAGE_PREFIX}-foo-compat")
+    replaces=("${MINGW_PACKAGE_PREFIX}-foo-old")
+}
+
+package_foo-docs() {
+    pkgdesc="Foo documentation (mingw-w64)"
+    depends=()
+}
+
+package_${MINGW_PACKAGE_PREFIX}-${_realname}() {
+    package_foo
+}
+
+package_${MINGW_PACKAGE_PREFIX}-${_realname}-docs() {
+    package_foo-docs
+}
+"""),
+    "mingw-default-arches": ("mingw", """_realname=simple
+pkgbase=mingw-w64-${_realname}
+pkgname="${MINGW_PACKAGE_PREFIX}-${_realname}"
+pkgver=0.1
+pkgrel=1
+pkgdesc="Simple (mingw-w64)"
+arch=('any')
+license=('spdx:MIT')
+source=()
+"""),
+}
+
+
+def check_pkgbuilddump_parity(tmp_path, name, create_backend, libmakepkg):
+    """Checks that the libmakepkg path gives the same result as running makepkg for each arch"""
+
+    mode, content = PARITY_PKGBUILDS[name]
+    pkgbuild = tmp_path / "PKGBUILD"
+    pkgbuild.write_text(content)
+
+    def get_entry(libmakepkg):
+        with create_backend(libmakepkg) as backend:
+            with backend.create_pool(1) as pool:
+                result = get_srcinfo_for_pkgbuild(backend, pool, ParseJob(str(pkgbuild), mode, "", "", "", ""))
+        assert result is not None
+        return {k: v for k, v in result[1].items() if k != "duration"}
+
+    assert get_entry(libmakepkg) == get_entry(None)
+
+
+@pytest.mark.skipif(shutil.which("makepkg") is None or not os.path.isfile("/usr/share/makepkg/srcinfo.sh"),
+                    reason="needs makepkg and libmakepkg")
+@pytest.mark.parametrize("name", sorted(PARITY_PKGBUILDS))
+def test_pkgbuilddump_parity(tmp_path, name):
+    check_pkgbuilddump_parity(
+        tmp_path, name, lambda libmakepkg: LinuxBackend(libmakepkg=libmakepkg), "/usr/share/makepkg")
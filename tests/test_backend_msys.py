@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+from msys2_devtools.backend import MsysBackend
+from msys2_devtools.pkgbuild import PKGBUILDDUMP
+
+from .test_backend import PARITY_PKGBUILDS, check_pkgbuilddump_parity
+
+MSYS2_ROOT = os.environ.get("MSYS2_ROOT", "C:\\msys64")
+
+# With MSYS2_ROOT set, like in CI, a missing MSYS2 is an error and not a reason to skip
+pytestmark = pytest.mark.skipif(
+    sys.platform != "win32" or (
+        "MSYS2_ROOT" not in os.environ
+        and not os.path.isfile(os.path.join(MSYS2_ROOT, "usr", "share", "makepkg", "srcinfo.sh"))),
+    reason="needs an MSYS2 installation, set MSYS2_ROOT if not in the default location")
+
+
+@pytest.mark.parametrize("name", sorted(PARITY_PKGBUILDS))
+def test_pkgbuilddump_parity_msys(tmp_path, name):
+    check_pkgbuilddump_parity(
+        tmp_path, name, lambda libmakepkg: MsysBackend(MSYS2_ROOT, libmakepkg), "/usr/share/makepkg")
+
+
+def test_msys_backend_paths():
+    with MsysBackend(MSYS2_ROOT) as backend:
+        assert backend.find_libmakepkg() == "/usr/share/makepkg"
+        path = backend.get_bash_path(PKGBUILDDUMP)
+        assert path.startswith("/") and path.endswith("/pkgbuilddump.sh")
@@ -0,0 +1,95 @@
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from msys2_devtools.bashpool import BashPool
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="needs a native bash")
+
+
+def test_bash_worker(tmp_path):
+    with BashPool("bash", 1) as pool:
+        with pool.worker() as worker:
+            assert worker.run(["echo", "-n", "foo"], str(tmp_path)) == (0, b"foo")
+            assert worker.run(["pwd"], str(tmp_path)) == (0, str(tmp_path).encode() + b"\n")
+            assert worker.run(["printenv", "FOO"], str(tmp_path), {"FOO": "a b\nc"}) == (0, b"a b\nc\n")
+            assert worker.run(["printf", "%s\n\n", "bar"], str(tmp_path)) == (0, b"bar\n\n")
+            assert worker.run(["false"], str(tmp_path)) == (1, b"")
+            assert worker.run(["bash", "-c", "exit 42"], str(tmp_path)) == (42, b"")
+            with pytest.raises(subprocess.CalledProcessError) as e:
+                worker.check_output(["bash", "-c", "echo -n error; exit 3"], str(tmp_path))
+            assert e.value.returncode == 3
+            assert e.value.output == b"error"
+
+
+def test_bash_worker_isolation(tmp_path):
+    pkgbuild = tmp_path / "PKGBUILD"
+    pkgbuild.write_text("mingw_arch=('ucrt64' 'clang64')\nexport FOO=bar\ncd /\n")
+    other = tmp_path / "other"
+    other.write_text("pkgname=foo\n")
+
+    with BashPool("bash", 1) as pool:
+        with pool.worker() as worker:
+            assert worker.check_output(
+                ["msys2_get_mingw_arch_list", "PKGBUILD"], str(tmp_path)) == b"1 ucrt64 clang64"
+            assert worker.check_output(
+                ["msys2_get_mingw_arch_list", "other"], str(tmp_path)) == b"0 "
+            assert worker.check_output(["source", "PKGBUILD"], str(tmp_path)) == b""
+            assert worker.check_output(["exit", "0"], str(tmp_path)) == b""
+            assert worker.run(["printenv", "FOO"], str(tmp_path)) == (1, b"")
+            assert worker.check_output(["pwd"], str(tmp_path)) == str(tmp_path).encode() + b"\n"
+
+
+def test_bash_pool_stub_makepkg(tmp_path):
+    makepkg = tmp_path / "makepkg"
+    makepkg.write_text(
+        "#!/bin/bash\n"
+        "source \"$2\"\n"
+        "printf 'pkgbase = %s\\n\\tpkgver = %s\\n' \"$pkgname\" \"$MINGW_ARCH\"\n")
+    makepkg.chmod(0o755)
+    for i in range(10):
+        pkg_dir = tmp_path / f"pkg{i}"
+        pkg_dir.mkdir()
+        (pkg_dir / "PKGBUILD").write_text(f"pkgname=pkg{i}\n")
+
+    results = {}
+
+    with BashPool("bash", 3) as pool:
+        def run(i):
+            output = pool.check_output(
+                [str(makepkg), "--printsrcinfo", "PKGBUILD"],
+                os.path.join(tmp_path, f"pkg{i}"), {"MINGW_ARCH": "ucrt64"})
+            results[i] = output
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(pool._workers) <= 3
+
+    for i in range(10):
+        assert results[i] == f"pkgbase = pkg{i}\n\tpkgver = ucrt64\n".encode()
+
+
+def test_bash_worker_errexit(tmp_path):
+    with BashPool("bash", 1) as pool:
+        with pool.worker() as worker:
+            assert worker.run(["eval", "false; echo -n after"], str(tmp_path)) == (1, b"")
+            assert worker.run(["eval", "false || echo -n after"], str(tmp_path)) == (0, b"after")
+
+
+def test_bash_pool_dead_worker(tmp_path):
+    with BashPool("bash", 1) as pool:
+        with pool.worker() as worker:
+            first = worker
+            with pytest.raises(RuntimeError):
+                worker.run(["eval", "kill -9 $$"], str(tmp_path))
+            assert not worker.is_alive()
+        with pool.worker() as worker:
+            assert worker is not first
+            assert worker.check_output(["echo", "-n", "foo"], str(tmp_path)) == b"foo"
+        assert pool._workers == [worker]
@@ -1,6 +1,6 @@
 import io
 import pytest
-from msys2_devtools.db import parse_desc
+from msys2_devtools.db import FileList, PathTable, iter_repo, iter_repo_records, parse_desc, parse_repo
 from msys2_devtools.exttarfile import tarfile
 
 
@@ -55,3 +55,92 @@ def test_zstd_invalid():
     with pytest.raises(tarfile.ReadError):
         fileobj = io.BytesIO(b"\x00\x00\x00")
         tarfile.TarFile.open(fileobj=fileobj, mode='r')
+
+
+class _Stream(io.RawIOBase):
+    """A non-seekable file, like a HTTP response"""
+
+    def __init__(self, data):
+        self._f = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        return self._f.readinto(b)
+
+
+def test_iter_repo():
+    fileobj = io.BytesIO()
+    with tarfile.TarFile.open(fileobj=fileobj, mode='w:zst') as tar:
+        for name, files in [("foo-1.0-1", ["a.py", "a.pyc"]), ("bar-2.0-1", [])]:
+            info = tarfile.TarInfo(name)
+            info.type = tarfile.DIRTYPE
+            tar.addfile(info)
+            for member, text in [
+                    ("desc", f"%NAME%\n{name.split('-')[0]}\n\n"),
+                    ("files", "%FILES%\n" + "".join(f + "\n" for f in files))]:
+                data = text.encode('utf-8')
+                info = tarfile.TarInfo(f"{name}/{member}")
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+    data = fileobj.getvalue()
+
+    items = iter_repo(_Stream(data))
+    package_id, desc = next(items)
+    assert package_id == "foo-1.0-1"
+    assert desc == {"%NAME%": ["foo"], "%FILES%": ["a.py", "a.pyc"]}
+    assert list(items) == [("bar-2.0-1", {"%NAME%": ["bar"], "%FILES%": []})]
+
+    assert list(parse_repo(data).keys()) == ["bar-2.0-1", "foo-1.0-1"]
+
+    table = PathTable()
+    records = list(iter_repo_records(io.BytesIO(data), table))
+    assert [r.package_id for r in records] == ["foo-1.0-1", "bar-2.0-1"]
+    assert records[0].get("%NAME%") == "foo"
+    assert records[0].get("%BASE%") is None
+    assert list(records[0].files) == ["a.py", "a.pyc"]
+    assert [r.to_desc() for r in records] == [desc for _, desc in iter_repo(io.BytesIO(data))]
+
+
+def test_iter_repo_interleaved():
+    fileobj = io.BytesIO()
+    with tarfile.TarFile.open(fileobj=fileobj, mode='w:gz') as tar:
+        for name, text in [
+                ("foo-1.0-1/desc", "%NAME%\nfoo\n\n"),
+                ("bar-2.0-1/desc", "%NAME%\nbar\n\n"),
+                ("foo-1.0-1/files", "%FILES%\na.py\n")]:
+            data = text.encode('utf-8')
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    data = fileobj.getvalue()
+
+    # foo was already yielded incomplete by then, so this has to be an error
+    with pytest.raises(ValueError, match="foo-1.0-1"):
+        list(iter_repo(io.BytesIO(data)))
+
+    assert parse_repo(data) == {
+        "bar-2.0-1": {"%NAME%": ["bar"]},
+        "foo-1.0-1": {"%NAME%": ["foo"], "%FILES%": ["a.py"]},
+    }
+
+
+def test_file_list():
+    paths = ["ucrt64/", "ucrt64/bin/", "ucrt64/bin/foo.exe", "ucrt64/bin/libfoo-1.dll", "ucrt64/share/é/", "x"]
+    table = PathTable()
+    files = FileList(table, paths)
+    assert len(files) == len(paths)
+    assert list(files) == paths
+    assert [files[i] for i in range(-len(paths), len(paths))] == paths * 2
+    assert files[1:3] == paths[1:3]
+    assert list(files.iter_split()) == [
+        ("", "ucrt64/"), ("ucrt64/", "bin/"), ("ucrt64/bin/", "foo.exe"), ("ucrt64/bin/", "libfoo-1.dll"),
+        ("ucrt64/share/", "é/"), ("", "x")]
+    with pytest.raises(IndexError):
+        files[len(paths)]
+
+    other = FileList(table, ["ucrt64/bin/bar.exe"])
+    assert list(other) == ["ucrt64/bin/bar.exe"]
+    assert len(table) == 4
+    assert list(FileList(table)) == []
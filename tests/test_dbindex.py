@@ -0,0 +1,74 @@
+import io
+import os
+import sys
+
+import pytest
+
+from msys2_devtools import dbindex
+from msys2_devtools.dbindex import find_dbs, open_db_index
+from msys2_devtools.exttarfile import tarfile
+
+
+def write_db(path, packages):
+    with tarfile.TarFile.open(path, mode="w:zst") as tar:
+        for name, version in packages:
+            data = f"%FILENAME%\n{name}-{version}-any.pkg.tar.zst\n\n%NAME%\n{name}\n\n%VERSION%\n{version}\n".encode()
+            info = tarfile.TarInfo(f"{name}-{version}/desc")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+def test_db_index(tmp_path, monkeypatch):
+    for repo in ["a", "b"]:
+        (tmp_path / "repo" / repo).mkdir(parents=True)
+    db_a = str(tmp_path / "repo" / "a" / "a.db")
+    db_b = str(tmp_path / "repo" / "b" / "b.db")
+    write_db(db_a, [("foo", "1.0-1"), ("bar", "2.0-1")])
+    write_db(db_b, [("baz", "3.0-1")])
+    index_path = str(tmp_path / "cache" / "index.sqlite")
+
+    parsed = []
+    iter_repo = dbindex.iter_repo
+
+    def counting_iter_repo(fileobj):
+        parsed.append(fileobj.name)
+        return iter_repo(fileobj)
+
+    monkeypatch.setattr(dbindex, "iter_repo", counting_iter_repo)
+
+    dbs = find_dbs(str(tmp_path / "repo"))
+    assert dbs == [db_a, db_b]
+    with open_db_index(dbs, index_path) as index:
+        assert index.get_filenames(db_a) == ["bar-2.0-1-any.pkg.tar.zst", "foo-1.0-1-any.pkg.tar.zst"]
+        assert list(index.iter_packages(db_b)) == [
+            ("baz-3.0-1", {"%FILENAME%": ["baz-3.0-1-any.pkg.tar.zst"], "%NAME%": ["baz"], "%VERSION%": ["3.0-1"]})]
+    assert parsed == [db_a, db_b]
+
+    # unchanged, nothing gets parsed
+    with open_db_index(dbs, index_path) as index:
+        assert index.get_filenames(db_b) == ["baz-3.0-1-any.pkg.tar.zst"]
+    assert parsed == [db_a, db_b]
+
+    # only the changed DB gets parsed again, the removed one is dropped
+    write_db(db_b, [("baz", "3.1-1")])
+    stat = os.stat(db_b)
+    os.utime(db_b, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    os.remove(db_a)
+    with open_db_index([db_b], index_path) as index:
+        assert index.get_filenames(db_b) == ["baz-3.1-1-any.pkg.tar.zst"]
+        assert index.get_filenames(db_a) == []
+    assert parsed == [db_a, db_b, db_b]
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="needs symlinks")
+def test_find_dbs_symlinks(tmp_path):
+    repo_dir = tmp_path / "repo" / "ucrt64"
+    repo_dir.mkdir(parents=True)
+    write_db(str(repo_dir / "ucrt64.db.tar.zst"), [("foo", "1.0-1")])
+    os.symlink("ucrt64.db.tar.zst", repo_dir / "ucrt64.db")
+
+    # the symlink path is kept, like the prune script expects
+    dbs = find_dbs(str(tmp_path / "repo"))
+    assert dbs == [os.path.join(os.path.realpath(repo_dir), "ucrt64.db")]
+    with open_db_index(dbs, str(tmp_path / "index.sqlite")) as index:
+        assert index.get_filenames(dbs[0]) == ["foo-1.0-1-any.pkg.tar.zst"]
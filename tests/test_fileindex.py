@@ -0,0 +1,73 @@
+from msys2_devtools.db import PackageRecord, PathTable
+from msys2_devtools.fileindex import FileIndex, find_missing_pycache, get_pycache_source, get_repo_name
+
+
+def create_index():
+    table = PathTable()
+
+    def record(package_id, files):
+        return PackageRecord.from_desc(package_id, {"%NAME%": [package_id], "%FILES%": files}, table)
+
+    site = "ucrt64/lib/python3.12/site-packages/"
+    return FileIndex.from_records([
+        ("ucrt64", [
+            record("foo-1.0-1", ["ucrt64/", "ucrt64/bin/", "ucrt64/bin/libfoo.dll", "ucrt64/bin/foo.py"]),
+            record("python-bar-1.0-1", [
+                "ucrt64/", site, site + "bar.py", site + "__pycache__/bar.cpython-312.pyc",
+                site + "__pycache__/bar.cpython-312.opt-1.pyc", site + "baz.py", site + "old.py", site + "old.pyc"]),
+            record("python-baz-1.0-1", [site + "__pycache__/baz.cpython-312.pyc", site + "baz.x.py"]),
+        ]),
+        ("clang64", [record("foo-1.0-1", ["clang64/bin/libfoo.dll"])]),
+    ])
+
+
+def test_file_index():
+    index = create_index()
+    assert len(index) == 15
+    assert index.owners("/ucrt64/bin/libfoo.dll") == [("ucrt64", "foo-1.0-1")]
+    assert index.owners("ucrt64/") == [("ucrt64", "foo-1.0-1"), ("ucrt64", "python-bar-1.0-1")]
+    assert index.owners("ucrt64/bin/libfoo") == []
+    assert index.owners("nope") == []
+    assert [p for p, _ in index.iter_prefix("/ucrt64/bin/")] == ["ucrt64/bin/", "ucrt64/bin/foo.py", "ucrt64/bin/libfoo.dll"]
+    assert list(index.glob("*/bin/*.dll")) == [
+        ("clang64/bin/libfoo.dll", ("clang64", "foo-1.0-1")), ("ucrt64/bin/libfoo.dll", ("ucrt64", "foo-1.0-1"))]
+    assert [o for _, o in index.glob("/ucrt64/lib/python3.*/site-packages/*.py")] == [
+        ("ucrt64", "python-bar-1.0-1"), ("ucrt64", "python-bar-1.0-1"), ("ucrt64", "python-baz-1.0-1"),
+        ("ucrt64", "python-bar-1.0-1")]
+
+    loaded = FileIndex.loads(index.dumps())
+    assert loaded.get_packages() == index.get_packages()
+    assert list(loaded.iter_prefix("")) == list(index.iter_prefix(""))
+    assert len(FileIndex.loads(FileIndex.from_records([]).dumps())) == 0
+
+
+def test_file_index_order():
+    # each record with its own table, the directories get merged by name
+    records = [
+        PackageRecord.from_desc("b-1-1", {"%FILES%": ["a/", "a/c", "a/b/x"]}, PathTable()),
+        PackageRecord.from_desc("a-1-1", {"%FILES%": ["a/b/", "a/a", "top"]}, PathTable()),
+    ]
+    index = FileIndex.from_records([("msys", records)])
+    # by directory, then base name
+    assert [p for p, _ in index.iter_prefix("")] == ["a/", "top", "a/a", "a/b/", "a/c", "a/b/x"]
+    assert [p for p, _ in index.iter_prefix("a/b")] == ["a/b/", "a/b/x"]
+    assert index.owners("a/b/x") == [("msys", "b-1-1")]
+    assert [p for p, _ in FileIndex.loads(index.dumps()).iter_prefix("a")] == ["a/", "a/a", "a/b/", "a/c", "a/b/x"]
+
+
+def test_find_missing_pycache():
+    site = "ucrt64/lib/python3.12/site-packages/"
+    # baz.py's pyc is in another package, baz.x.py has none
+    assert find_missing_pycache(create_index()) == {
+        ("ucrt64", "python-bar-1.0-1"): [site + "baz.py"],
+        ("ucrt64", "python-baz-1.0-1"): [site + "baz.x.py"],
+    }
+    assert get_pycache_source("a/__pycache__/b.cpython-312.opt-2.pyc") == "a/b.py"
+    assert get_pycache_source("__pycache__/b.cpython-312.pyc") == "b.py"
+    assert get_pycache_source("b.pyc") == "b.py"
+    assert get_pycache_source("b.py") is None
+
+
+def test_get_repo_name():
+    assert get_repo_name("https://repo.msys2.org/mingw/ucrt64/ucrt64.files.tar.zst") == "ucrt64"
+    assert get_repo_name("/srv/msys.files") == "msys"
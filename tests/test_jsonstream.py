@@ -0,0 +1,28 @@
+import io
+import json
+
+import pytest
+
+from msys2_devtools.jsonstream import iter_object_array
+
+
+def test_iter_object_array():
+    data = {
+        "before": {"matches": [1, 2], "x": "]},[\"\\u1234"},
+        "matches": [{"id": i, "text": "x" * i, "n": 1.5 * i, "l": [None, True, False]} for i in range(50)],
+        "after": 12345678901234567890,
+    }
+    for indent in [None, 2]:
+        text = json.dumps(data, indent=indent)
+        for chunk_size in [1, 3, 7, 1024]:
+            assert list(iter_object_array(io.StringIO(text), "matches", chunk_size)) == data["matches"]
+
+    assert list(iter_object_array(io.StringIO('{"matches": []}'), "matches", 2)) == []
+    assert list(iter_object_array(io.StringIO('{"other": [1]}'), "matches")) == []
+    assert list(iter_object_array(io.StringIO(' { } '), "matches")) == []
+    assert list(iter_object_array(io.StringIO('{"matches": 1234}'), "matches", 2)) == []
+
+    with pytest.raises(ValueError):
+        list(iter_object_array(io.StringIO('{"matches": [1, 2'), "matches", 2))
+    with pytest.raises(ValueError):
+        list(iter_object_array(io.StringIO('[1, 2]'), "matches"))
@@ -0,0 +1,120 @@
+import functools
+import io
+import json
+import threading
+import types
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from msys2_devtools import cmd_lint
+from msys2_devtools.db import PackageRecord, PathTable
+from msys2_devtools.exttarfile import tarfile
+from msys2_devtools.fileindex import FileIndex, write_file_index
+from msys2_devtools.lint import RULES, Finding, Rule, get_rules, lint_records, lint_repo_file
+
+SITE = "ucrt64/lib/python3.12/site-packages/"
+
+PACKAGES = {
+    "foo-1.0-1": {"%NAME%": ["foo"], "%BASE%": ["foo"], "%FILES%": [SITE + "foo.py"]},
+    "bar-1.0-1": {"%NAME%": ["bar"], "%FILES%": [SITE + "bar.py", SITE + "__pycache__/bar.cpython-312.pyc"]},
+}
+
+
+def get_records():
+    table = PathTable()
+    return [PackageRecord.from_desc(k, v, table) for k, v in PACKAGES.items()]
+
+
+def test_lint_records(monkeypatch):
+    result = lint_records("ucrt64", get_records())
+    assert result.findings == [
+        Finding("base-missing", "ucrt64", "bar-1.0-1", "pkgbase not found"),
+        Finding("pycache-missing", "ucrt64", "foo-1.0-1", "Missing .pyc files", (SITE + "foo.py",)),
+    ]
+    assert {name: s[1:] for name, s in result.stats.items()} == {"base-missing": (2, 1), "pycache-missing": (2, 1)}
+    # the records are only iterated once
+    assert lint_records("ucrt64", iter(get_records())).findings == result.findings
+
+    seen = []
+
+    class CountRule(Rule):
+        name = "count"
+        description = "Counts the packages"
+
+        def check_package(self, record):
+            seen.append(record.package_id)
+            return ()
+
+        def finish(self):
+            yield self.finding("", f"{len(seen)} packages")
+
+    monkeypatch.setitem(RULES, "count", CountRule)
+    result = lint_records("ucrt64", iter(get_records()), ["count"])
+    assert seen == ["foo-1.0-1", "bar-1.0-1"]
+    assert result.findings == [Finding("count", "ucrt64", "", "2 packages")]
+    assert list(result.stats) == ["count"]
+
+    with pytest.raises(ValueError):
+        get_rules(["nope"])
+
+
+def test_lint_with_index(tmp_path):
+    # an existing index gets used instead of the records, only for the repo being linted
+    other = [PackageRecord.from_desc("baz-1.0-1", {"%FILES%": [SITE + "baz.py"]}, PathTable())]
+    index = FileIndex.from_records([("ucrt64", get_records()[1:]), ("clang64", other)])
+    result = lint_records("ucrt64", get_records(), ["pycache-missing"], index)
+    assert result.findings == []
+    result = lint_records("clang64", [], ["pycache-missing"], index)
+    assert result.findings == [Finding("pycache-missing", "clang64", "baz-1.0-1", "Missing .pyc files", (SITE + "baz.py",))]
+
+    index_path = str(tmp_path / "files.index")
+    write_file_index(index_path, index)
+    with tarfile.TarFile.open(tmp_path / "clang64.files.tar.zst", mode="w:zst"):
+        pass
+    assert lint_repo_file("clang64", str(tmp_path / "clang64.files.tar.zst"), None, index_path).findings == result.findings
+
+
+def test_print_findings(capsys):
+    findings = lint_records("ucrt64", get_records()).findings
+    cmd_lint.print_findings(findings, "text")
+    assert capsys.readouterr().out.splitlines() == [
+        "pkgbase not found for bar-1.0-1", "Missing .pyc files for foo-1.0-1:", "  " + SITE + "foo.py"]
+    cmd_lint.print_findings(findings, "full")
+    assert capsys.readouterr().out.splitlines() == [
+        "ucrt64: bar-1.0-1: pkgbase not found [base-missing]",
+        "ucrt64: foo-1.0-1: Missing .pyc files [pycache-missing]", "  " + SITE + "foo.py"]
+
+
+def test_lint_repos(tmp_path, capsys, monkeypatch):
+    served = tmp_path / "served"
+    served.mkdir()
+    with tarfile.TarFile.open(served / "ucrt64.files.tar.zst", mode="w:zst") as tar:
+        for package_id, desc in PACKAGES.items():
+            data = "".join(f"{k}\n" + "".join(v + "\n" for v in values) + "\n" for k, values in desc.items()).encode()
+            info = tarfile.TarInfo(f"{package_id}/desc")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+    class Handler(SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(Handler, directory=str(served)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        url = "http://%s:%d/ucrt64.files.tar.zst" % server.server_address[:2]
+        monkeypatch.setattr(cmd_lint, "REPO_URLS", [url])
+        args = types.SimpleNamespace(
+            list_rules=False, rule=["pycache-missing"], jobs=1, concurrency=1, cache_dir=str(tmp_path / "cache"),
+            format="json", stats=True, index=None)
+        cmd_lint.lint_repos(args)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    out, err = capsys.readouterr()
+    assert [json.loads(line) for line in out.splitlines()] == [{
+        "rule": "pycache-missing", "repo": "ucrt64", "package": "foo-1.0-1", "message": "Missing .pyc files",
+        "paths": [SITE + "foo.py"]}]
+    assert "pycache-missing" in err
@@ -0,0 +1,10 @@
+from msys2_devtools.pkgextra import extra_to_pkgextra_entry, get_references
+
+
+def test_get_references():
+    for extra in [
+            {},
+            {"references": []},
+            {"references": ["pypi: foo", "purl: pkg:pypi/bar", "pypi: baz", "internal"]},
+            {"references": ["cpe: cpe:/a:foo:bar"], "changelog_url": "https://example.com"}]:
+        assert get_references(extra) == extra_to_pkgextra_entry(extra).references
@@ -0,0 +1,185 @@
+import gzip
+import json
+import os
+import threading
+import xmlrpc.client
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from msys2_devtools.pypi_cache import dump_pypi_metadata
+
+
+class FakePyPI(ThreadingHTTPServer):
+    """Serves canned JSON like PyPI, failing the first request for each project"""
+
+    def __init__(self, projects: dict[str, int]) -> None:
+        super().__init__(("127.0.0.1", 0), FakePyPIHandler)
+        self.projects = projects
+        self.changelog_available = True
+        self.requests: list[str] = []
+        self.failed: set[str] = set()
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return "http://%s:%d" % self.server_address[:2]
+
+    @property
+    def last_serial(self) -> int:
+        return max(self.projects.values())
+
+    def update(self, name: str) -> None:
+        self.projects[name] = self.last_serial + 1
+
+
+class FakePyPIHandler(BaseHTTPRequestHandler):
+
+    server: FakePyPI
+
+    def send_status(self, status: int) -> None:
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def send_body(self, body: bytes, headers: dict[str, str]) -> None:
+        self.send_response(200)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            first = self.path not in server.failed
+            server.failed.add(self.path)
+
+        if self.path == "/simple/":
+            data = {"projects": [{"name": n, "_last-serial": s} for n, s in server.projects.items()]}
+            self.send_body(json.dumps(data).encode("utf-8"), {"X-PyPI-Last-Serial": str(server.last_serial)})
+        elif self.path.startswith("/pypi/") and self.path.split("/")[2] in server.projects:
+            if first:
+                return self.send_status(503)
+            name = self.path.split("/")[2]
+            etag = '"%d"' % server.projects[name]
+            if self.headers.get("If-None-Match") == etag:
+                return self.send_status(304)
+            data = {"info": {"name": name}, "last_serial": server.projects[name], "releases": {}}
+            self.send_body(json.dumps(data).encode("utf-8"), {"ETag": etag})
+        else:
+            self.send_status(404)
+
+    def do_POST(self) -> None:
+        server = self.server
+        params, method = xmlrpc.client.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        request = f"{method}{params}"
+        with server.lock:
+            server.requests.append(request)
+            first = request not in server.failed
+            server.failed.add(request)
+        if first:
+            return self.send_status(503)
+        if not server.changelog_available:
+            fault = xmlrpc.client.Fault(1, "changelog not available")
+            return self.send_body(xmlrpc.client.dumps(fault, methodresponse=True).encode("utf-8"), {})
+        assert self.path == "/pypi" and method == "changelog_since_serial"
+        # one event per call, to test paging
+        events = [(n, "1.0", 0, "new release", s) for n, s in server.projects.items() if s > params[0]]
+        events = sorted(events, key=lambda e: e[-1])[:1]
+        self.send_body(xmlrpc.client.dumps((events,), methodresponse=True).encode("utf-8"), {})
+
+    def log_message(self, *args: object) -> None:
+        pass
+
+
+@pytest.fixture
+def fake_pypi():
+    server = FakePyPI({f"project{i}": i for i in range(20)})
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    thread.join()
+    server.server_close()
+
+
+def load(path):
+    with open(path, "rb") as h:
+        return json.loads(gzip.decompress(h.read()))
+
+
+def test_dump_pypi_metadata(tmp_path, fake_pypi):
+    output_path = str(tmp_path / "pypi.json.gz")
+    names = [f"project{i}" for i in reversed(range(20))]
+
+    dump_pypi_metadata(names, output_path, 4, fake_pypi.url)
+    assert os.listdir(tmp_path) == ["pypi.json.gz"]
+    metadata = load(output_path)
+    assert metadata["last_serial"] == 19
+    projects = metadata["projects"]
+    assert list(projects) == names
+    for name, project in projects.items():
+        assert project == {"info": {"name": name}, "last_serial": int(name[7:])}
+    # every project was retried once
+    assert fake_pypi.requests.count("/pypi/project3/json") == 2
+
+    # only updated projects get fetched again, using the changelog
+    fake_pypi.requests.clear()
+    fake_pypi.update("project3")
+    fake_pypi.update("project5")
+    dump_pypi_metadata(names, output_path, 4, fake_pypi.url)
+    # the changelog calls were retried once as well
+    assert sorted(fake_pypi.requests) == [
+        "/pypi/project3/json", "/pypi/project5/json",
+        "changelog_since_serial(19,)", "changelog_since_serial(19,)", "changelog_since_serial(20,)",
+        "changelog_since_serial(20,)", "changelog_since_serial(21,)", "changelog_since_serial(21,)"]
+    metadata = load(output_path)
+    assert metadata["last_serial"] == 21
+    assert metadata["projects"]["project3"]["last_serial"] == 20
+    assert list(metadata["projects"]) == names
+
+    # without the changelog, all projects get revalidated
+    fake_pypi.requests.clear()
+    fake_pypi.changelog_available = False
+    fake_pypi.update("project7")
+    dump_pypi_metadata(names, output_path, 4, fake_pypi.url)
+    assert len(fake_pypi.requests) == 1 + 20
+    metadata = load(output_path)
+    assert metadata["last_serial"] == 21
+    assert metadata["projects"]["project7"]["last_serial"] == 22
+    assert metadata["projects"]["project3"]["last_serial"] == 20
+
+    with pytest.raises(Exception, match="not found"):
+        dump_pypi_metadata(["unknown"], output_path, 4, fake_pypi.url)
+
+
+def test_dump_pypi_metadata_projection(tmp_path, fake_pypi):
+    output_path = str(tmp_path / "pypi.json.gz")
+    names = ["project1", "project2"]
+
+    # a file from before projections existed, with the full metadata
+    full = {"info": {"name": "project1", "description": "long"}, "urls": [{"url": "u", "md5_digest": "x"}],
+            "vulnerabilities": [], "last_serial": 1}
+    with open(output_path, "wb") as h:
+        h.write(gzip.compress(json.dumps({"projects": {"project1": full}}, indent=2).encode("utf-8")))
+
+    dump_pypi_metadata(names, output_path, 4, fake_pypi.url)
+    assert "/pypi/project1/json" not in fake_pypi.requests
+    metadata = load(output_path)
+    assert metadata["projects"]["project1"] == {
+        "info": {"name": "project1"}, "urls": [{"url": "u"}], "vulnerabilities": [], "last_serial": 1}
+
+    with open(output_path, "rb") as h:
+        first = h.read()
+    dump_pypi_metadata(names, output_path, 4, fake_pypi.url)
+    with open(output_path, "rb") as h:
+        assert h.read() == first
+
+    # a different projection needs everything to be fetched again
+    fake_pypi.requests.clear()
+    dump_pypi_metadata(names, output_path, 4, fake_pypi.url, projection=None)
+    assert "/pypi/project1/json" in fake_pypi.requests
+    assert load(output_path)["projects"]["project1"] == {"info": {"name": "project1"}, "last_serial": 1}
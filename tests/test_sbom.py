@@ -1,4 +1,15 @@
-from msys2_devtools.sbom import extract_upstream_version, generate_components
+import json
+import types
+
+import pytest
+from cyclonedx.model.bom import Bom
+from cyclonedx.schema import SchemaVersion
+
+from msys2_devtools import sbom
+from msys2_devtools.sbom import extract_upstream_version, generate_components, write_sbom, write_sbom_streaming, \
+    handle_fixup_command
+from msys2_devtools.srcinfo import compact_srcinfos
+from msys2_devtools.srcinfo_store import write_srcinfo_cache
 
 
 def test_extract_upstream_version():
@@ -58,3 +69,166 @@ def test_generate_components():
     assert components[0].version == "1.2.3"
     assert components[0].purl is None
     assert components[0].cpe == "cpe:/a:djangoproject:django:1.2.3"
+
+
+def test_generate_components_parsed():
+    srcinfo = {"mingw32": "pkgbase = foo\npkgver = 42-1"}
+    value = {"srcinfo": srcinfo, "extra": {"references": ["purl: pkg:pypi/django"]}}
+    expected = generate_components(value)
+    parsed_only = {"parsed": compact_srcinfos(srcinfo), "extra": value["extra"]}
+    components = generate_components(parsed_only)
+    assert [c.purl for c in components] == [c.purl for c in expected]
+    assert components[0].version == "42"
+
+
+def normalize_sbom(data):
+    """Replaces the bom-refs with the components they point to, and ignores the order"""
+
+    def freeze(value):
+        return json.dumps(value, sort_keys=True)
+
+    components = {c["bom-ref"]: {k: v for k, v in c.items() if k != "bom-ref"} for c in data["components"]}
+    root = data["metadata"]["component"]
+    components[root["bom-ref"]] = {k: v for k, v in root.items() if k != "bom-ref"}
+    dependencies = sorted(
+        freeze([components[d["ref"]], sorted(freeze(components[r]) for r in d.get("dependsOn", []))])
+        for d in data["dependencies"])
+    return {
+        "components": sorted(freeze(c) for c in components.values()),
+        "dependencies": dependencies,
+        "header": {k: data[k] for k in ["$schema", "bomFormat", "specVersion", "version"]},
+    }
+
+
+def test_write_sbom_streaming(tmp_path):
+    entries = [
+        ("a", {"srcinfo": {"ucrt64": "pkgbase = mingw-w64-foo\npkgver = 1.0-1"}, "extra": {"references": []}}),
+        ("b", {"srcinfo": {"msys": "pkgbase = bar\npkgver = 2:3.0-1"}, "extra": {"references": [
+            "cpe: cpe:/a:bar:bar", "purl: pkg:pypi/bar"]}}),
+        ("c", {"srcinfo": {}}),
+    ]
+    cache_path = str(tmp_path / "srcinfo.json.gz")
+    write_srcinfo_cache(cache_path, entries)
+
+    write_sbom(cache_path, str(tmp_path / "expected.json"))
+    write_sbom_streaming(cache_path, str(tmp_path / "streamed.json"))
+    with open(tmp_path / "expected.json", encoding="utf-8") as h:
+        expected = json.load(h)
+    with open(tmp_path / "streamed.json", encoding="utf-8") as h:
+        streamed = json.load(h)
+
+    assert len(streamed["components"]) == 3
+    assert normalize_sbom(streamed) == normalize_sbom(expected)
+    # can be loaded by the cyclonedx library
+    assert len(Bom.from_json(streamed).components) == 3
+
+    # equal components get merged
+    entries[1][1]["extra"]["references"].append("purl: pkg:pypi/bar")
+    write_srcinfo_cache(cache_path, entries)
+    write_sbom_streaming(cache_path, str(tmp_path / "streamed.json"))
+    with open(tmp_path / "streamed.json", encoding="utf-8") as h:
+        assert len(json.load(h)["components"]) == 3
+
+
+def test_write_sbom_streaming_schema(tmp_path):
+    pytest.importorskip("jsonschema")
+    from cyclonedx.validation.json import JsonStrictValidator
+
+    entries = [
+        ("a", {"srcinfo": {"ucrt64": "pkgbase = mingw-w64-foo\npkgver = 1.0-1"}, "extra": {"references": [
+            "cpe: cpe:/a:foo:foo", "purl: pkg:pypi/foo"]}}),
+        ("b", {"srcinfo": {"msys": "pkgbase = bar\npkgver = 2:3.0-1"}}),
+    ]
+    cache_path = str(tmp_path / "srcinfo.json.gz")
+    write_srcinfo_cache(cache_path, entries)
+    write_sbom_streaming(cache_path, str(tmp_path / "streamed.json"))
+    with open(tmp_path / "streamed.json", encoding="utf-8") as h:
+        error = JsonStrictValidator(SchemaVersion.V1_5).validate_str(h.read())
+    assert error is None
+
+
+def test_write_sbom_streaming_incremental(tmp_path, monkeypatch):
+    entries = [
+        ("a", {"srcinfo": {"ucrt64": "pkgbase = mingw-w64-foo\npkgver = 1.0-1"}}),
+        ("b", {"srcinfo": {"msys": "pkgbase = bar\npkgver = 3.0-1"}, "extra": {"references": ["purl: pkg:pypi/bar"]}}),
+    ]
+    cache_path = str(tmp_path / "srcinfo.json.gz")
+    components_cache = str(tmp_path / "components.json.gz")
+    sbom_path = str(tmp_path / "sbom.json")
+
+    def create():
+        write_sbom_streaming(cache_path, sbom_path, components_cache)
+        with open(sbom_path, encoding="utf-8") as h:
+            return json.load(h)
+
+    write_srcinfo_cache(cache_path, entries)
+    first = create()
+
+    # only the new entry gets generated, and the bom-refs stay the same
+    generated = []
+    monkeypatch.setattr(sbom, "generate_components", lambda value: generated.append(value) or generate_components(value))
+    entries[0] = ("c", {"srcinfo": {"ucrt64": "pkgbase = mingw-w64-foo\npkgver = 1.1-1"}})
+    write_srcinfo_cache(cache_path, entries)
+    second = create()
+    assert len(generated) == 1
+    assert first["components"][1] == second["components"][0]
+    assert first["components"][0]["bom-ref"] != second["components"][1]["bom-ref"]
+    assert first["metadata"]["component"] == second["metadata"]["component"]
+
+    # the same as without the cache
+    write_sbom_streaming(cache_path, sbom_path)
+    with open(sbom_path, encoding="utf-8") as h:
+        assert json.load(h)["components"] == second["components"]
+
+
+def test_fixup(tmp_path):
+    def component(ref, pkgbase, extra=()):
+        properties = [{"name": "syft:location:0:path", "value": pkgbase}, *extra]
+        return {"bom-ref": ref, "type": "library", "name": ref, "properties": properties}
+
+    target = {
+        "bomFormat": "CycloneDX",
+        "specVersion": "1.5",
+        "components": [
+            component("r1", "foo"),
+            component("r2", "bar", [{"name": "msys2:pkgbase", "value": "old"}]),
+        ],
+        "vulnerabilities": [
+            {"id": "CVE-1", "affects": [{"ref": "r1"}]},
+            {"id": "CVE-2", "affects": [{"ref": "r2"}], "analysis": {"state": "exploitable"}},
+            {"id": "CVE-3", "affects": [{"ref": "r1"}, {"ref": "r2"}]},
+        ],
+    }
+    target_path = tmp_path / "sbom.json"
+    target_path.write_text(json.dumps(target), encoding="utf-8")
+
+    grype = {
+        "matches": [
+            {"vulnerability": {"id": "CVE-1", "fix": {"state": "fixed", "versions": ["1.2", "2.1"]}}},
+            {"vulnerability": {"id": "CVE-3", "fix": {"state": "not-fixed", "versions": []}}},
+        ],
+        "source": {"type": "file"},
+    }
+    grype_path = tmp_path / "grype.json"
+    grype_path.write_text(json.dumps(grype), encoding="utf-8")
+
+    cache_path = str(tmp_path / "srcinfo.json.gz")
+    write_srcinfo_cache(cache_path, [
+        ("a", {"srcinfo": {"msys": "pkgbase = bar\npkgver = 1-1"}, "extra": {"ignore_vulnerabilities": ["CVE-3"]}}),
+    ])
+
+    handle_fixup_command(types.SimpleNamespace(
+        target_sbom=str(target_path), grype_json=str(grype_path), srcinfo_cache=cache_path))
+    result = json.loads(target_path.read_text(encoding="utf-8"))
+
+    assert result["components"][0]["properties"][-1] == {"name": "msys2:pkgbase", "value": "foo"}
+    assert result["components"][1]["properties"][-1] == {"name": "msys2:pkgbase", "value": "bar"}
+    vulns = result["vulnerabilities"]
+    assert vulns[0]["affects"] == [{"ref": "r1", "versions": [
+        {"version": "1.2", "status": "unaffected"}, {"version": "2.1", "status": "unaffected"}]}]
+    assert "analysis" not in vulns[0] and "analysis" not in vulns[1]
+    assert vulns[2]["analysis"] == {"state": "not_affected"}
+    assert "versions" not in vulns[2]["affects"][0]
+
+    # the result can be loaded by the cyclonedx library
+    assert len(Bom.from_json(result).vulnerabilities) == 3
@@ -1,4 +1,4 @@
-from msys2_devtools.srcinfo import parse_srcinfo
+from msys2_devtools.srcinfo import parse_srcinfo, compact_srcinfos, iter_entry_srcinfos, get_entry_base
 
 
 def test_for_srcinfo():
@@ -43,3 +43,32 @@ pkgname = libarchive-devel
     assert sub['pkgname'] == ['libarchive-devel']
     assert sub['pkgdesc'] == ['sub-desc']
     assert sub['pkgbase'] == ['libarchive']
+
+
+def test_compact_srcinfos():
+    info = """
+pkgbase = libarchive
+\tpkgver = 3.5.1
+\tdepends = gcc-libs
+pkgname = libarchive
+pkgname = libarchive-devel
+\tdepends = libxml2-devel
+"""
+    other = info.replace("3.5.1", "3.5.2")
+    srcinfos = {"ucrt64": info, "clang64": other, "mingw64": info}
+
+    parsed = compact_srcinfos(srcinfos)
+    assert parsed["arches"] == {"ucrt64": 0, "clang64": 1, "mingw64": 0}
+    assert len(parsed["variants"]) == 2
+    assert parsed["variants"][0]["packages"]["libarchive"] == {"pkgname": ["libarchive"]}
+
+    expected = [(arch, *parse_srcinfo(srcinfo)) for arch, srcinfo in srcinfos.items()]
+    assert list(iter_entry_srcinfos({"srcinfo": srcinfos})) == expected
+    assert list(iter_entry_srcinfos({"srcinfo": srcinfos, "parsed": parsed})) == expected
+    # results don't leak into the stored form
+    assert parsed["variants"][0]["packages"]["libarchive"] == {"pkgname": ["libarchive"]}
+
+    assert get_entry_base({"srcinfo": srcinfos, "parsed": parsed})["pkgver"] == ["3.5.1"]
+    assert get_entry_base({"srcinfo": srcinfos})["pkgver"] == ["3.5.1"]
+    assert get_entry_base({"srcinfo": {}}) is None
+    assert get_entry_base({"srcinfo": {}, "parsed": compact_srcinfos({})}) is None
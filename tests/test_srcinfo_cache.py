@@ -0,0 +1,240 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+from pydantic import ValidationError
+
+from msys2_devtools.srcinfo_cache import RepoIndex, get_cache_key, iter_pkgbuild_paths, Journal, read_journal, \
+    ParseJob, sort_jobs, get_changed_package_dirs, get_head_commit, validate_srcinfo, \
+    add_parsed_field, read_stats, write_stats, read_validated, write_validated
+
+
+def git(cwd, *args, date="2020-01-01T00:00:00+00:00"):
+    env = dict(os.environ, GIT_AUTHOR_DATE=date, GIT_COMMITTER_DATE=date)
+    subprocess.check_call(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@example.com"] + list(args),
+        cwd=cwd, stdout=subprocess.DEVNULL, env=env)
+
+
+def create_repo(path):
+    os.makedirs(path)
+    git(path, "init", "-q")
+    git(path, "remote", "add", "origin", "https://example.com/packages.git")
+    for name in ["foo", "bar", os.path.join("sub", "baz")]:
+        pkg_dir = os.path.join(path, name)
+        os.makedirs(pkg_dir)
+        with open(os.path.join(pkg_dir, "PKGBUILD"), "w") as h:
+            h.write(f"pkgname={os.path.basename(name)}\n")
+    git(path, "add", ".")
+    git(path, "commit", "-q", "-m", "initial")
+
+
+def test_repo_index_cache_key(tmp_path):
+    repo_path = str(tmp_path / "repo")
+    create_repo(repo_path)
+    untracked = os.path.join(repo_path, "untracked")
+    os.makedirs(untracked)
+    with open(os.path.join(untracked, "PKGBUILD"), "w") as h:
+        h.write("pkgname=untracked\n")
+
+    for path in [repo_path, os.path.join(repo_path, "sub")]:
+        index = RepoIndex(path)
+        assert index.repo == "https://example.com/packages"
+        paths = list(iter_pkgbuild_paths(path))
+        assert paths
+        for pkgbuild_path in paths:
+            assert index.get_cache_key(pkgbuild_path) == get_cache_key(pkgbuild_path)
+
+
+def test_repo_index_metadata(tmp_path):
+    repo_path = str(tmp_path / "repo")
+    create_repo(repo_path)
+    with open(os.path.join(repo_path, "foo", "PKGBUILD"), "a") as h:
+        h.write("pkgver=2\n")
+    git(repo_path, "commit", "-q", "-a", "-m", "update", date="2021-02-03T04:05:06+00:00")
+
+    index = RepoIndex(repo_path)
+    paths = list(iter_pkgbuild_paths(repo_path))
+    index.load_dates(paths)
+    for pkgbuild_path in paths:
+        git_cwd = os.path.dirname(pkgbuild_path)
+        date = subprocess.check_output(
+            ["git", "log", "-1", "--format=%aI", "PKGBUILD"], cwd=git_cwd).decode("utf-8").strip()
+        assert index.get_date(pkgbuild_path) == date
+        assert index.get_repo(pkgbuild_path) == "https://example.com/packages"
+
+    assert index.get_date(os.path.join(repo_path, "foo", "PKGBUILD")) == "2021-02-03T04:05:06+00:00"
+    assert index.get_date(os.path.join(repo_path, "bar", "PKGBUILD")) == "2020-01-01T00:00:00+00:00"
+    assert index.get_relpath(os.path.join(repo_path, "sub", "baz", "PKGBUILD")) == "sub/baz"
+    assert RepoIndex(os.path.join(repo_path, "sub")).get_relpath(
+        os.path.join(repo_path, "sub", "baz", "PKGBUILD")) == "sub/baz"
+
+
+def test_repo_index_dates_merge(tmp_path):
+    repo_path = str(tmp_path / "repo")
+    create_repo(repo_path)
+    git(repo_path, "checkout", "-q", "-b", "side")
+    with open(os.path.join(repo_path, "foo", "PKGBUILD"), "a") as h:
+        h.write("pkgver=2\n")
+    git(repo_path, "commit", "-q", "-a", "-m", "side", date="2021-01-01T00:00:00+00:00")
+    git(repo_path, "checkout", "-q", "-")
+    with open(os.path.join(repo_path, "bar", "PKGBUILD"), "a") as h:
+        h.write("pkgver=2\n")
+    git(repo_path, "commit", "-q", "-a", "-m", "main", date="2022-01-01T00:00:00+00:00")
+    # the merge changes bar/PKGBUILD compared to both parents, foo/PKGBUILD only compared to one
+    git(repo_path, "merge", "-q", "--no-commit", "side")
+    with open(os.path.join(repo_path, "bar", "PKGBUILD"), "a") as h:
+        h.write("pkgrel=2\n")
+    git(repo_path, "commit", "-q", "-a", "-m", "merge", date="2023-01-01T00:00:00+00:00")
+
+    index = RepoIndex(repo_path)
+    paths = list(iter_pkgbuild_paths(repo_path))
+    index.load_dates(paths)
+    for pkgbuild_path in paths:
+        assert index.get_date(pkgbuild_path) == RepoIndex(repo_path).get_date(pkgbuild_path)
+    assert index.get_date(os.path.join(repo_path, "foo", "PKGBUILD")) == "2021-01-01T00:00:00+00:00"
+    assert index.get_date(os.path.join(repo_path, "bar", "PKGBUILD")) == "2023-01-01T00:00:00+00:00"
+
+
+def test_repo_index_dates_error(tmp_path):
+    repo_path = str(tmp_path / "repo")
+    create_repo(repo_path)
+    index = RepoIndex(repo_path)
+    shutil.rmtree(os.path.join(repo_path, ".git", "objects"))
+    with pytest.raises(subprocess.CalledProcessError):
+        index.load_dates(list(iter_pkgbuild_paths(repo_path)))
+
+
+def test_journal(tmp_path):
+    journal_path = str(tmp_path / "srcinfo.json.gz.journal")
+    assert read_journal(journal_path) == ([], 0)
+
+    journal = Journal(journal_path, 0)
+    journal.append(("a", {"path": "foo"}))
+    journal.append(("b", {"path": "bar"}))
+    journal.close()
+    entries, end = read_journal(journal_path)
+    assert entries == [("a", {"path": "foo"}), ("b", {"path": "bar"})]
+    assert end == os.path.getsize(journal_path)
+
+    # an interrupted write is ignored, appending continues after it
+    with open(journal_path, "ab") as h:
+        h.write(b'["c", {"pa')
+    entries, end = read_journal(journal_path)
+    assert entries == [("a", {"path": "foo"}), ("b", {"path": "bar"})]
+
+    journal = Journal(journal_path, end)
+    journal.append(("d", {"path": "quux"}))
+    journal.close()
+    assert [k for k, v in read_journal(journal_path)[0]] == ["a", "b", "d"]
+
+    # a corrupt line in the middle is skipped, the following ones are still used
+    with open(journal_path, "rb") as h:
+        lines = h.readlines()
+    lines[1] = b'["b", {"pa\x00\n'
+    with open(journal_path, "wb") as h:
+        h.writelines(lines)
+    entries, end = read_journal(journal_path)
+    assert [k for k, v in entries] == ["a", "d"]
+    assert end == os.path.getsize(journal_path)
+
+
+def test_stats(tmp_path):
+    stats_path = str(tmp_path / "srcinfo.json.gz.stats.json")
+    assert read_stats(stats_path) == {}
+    stats = {"foo": {"duration": 1.5, "generated": "2024-01-01T00:00:00+00:00"}}
+    write_stats(stats_path, stats)
+    assert read_stats(stats_path) == stats
+
+
+def test_validated(tmp_path):
+    cache_path = str(tmp_path / "srcinfo.json.gz")
+    validated_path = cache_path + ".validated"
+    assert not read_validated(validated_path, cache_path)
+    with open(cache_path, "wb") as h:
+        h.write(b"old")
+    write_validated(validated_path, cache_path)
+    assert read_validated(validated_path, cache_path)
+
+    # only applies to the cache file it was written for
+    with open(cache_path, "wb") as h:
+        h.write(b"new content")
+    assert not read_validated(validated_path, cache_path)
+
+
+def test_sort_jobs():
+    jobs = [ParseJob(f"{name}/PKGBUILD", "mingw", name, "", name, "") for name in ["a", "b", "c", "d"]]
+    previous = {
+        "a": {"duration": 10.0, "generated": "2023-01-01T00:00:00+00:00"},
+        "b": {"duration": 1.0, "generated": "2021-01-01T00:00:00+00:00"},
+        "c": {"duration": 5.0, "generated": "2022-01-01T00:00:00+00:00"},
+    }
+
+    assert [(j.key, c) for j, c in sort_jobs(jobs, "walk", previous)] == [("a", 10.0), ("b", 1.0), ("c", 5.0), ("d", 5.0)]
+    assert [j.key for j, c in sort_jobs(jobs, "cost", previous)] == ["b", "c", "d", "a"]
+    assert [j.key for j, c in sort_jobs(jobs, "stale", previous)] == ["d", "b", "c", "a"]
+    assert [c for j, c in sort_jobs(jobs, "cost", {})] == [0.0] * 4
+
+
+def test_changed_package_dirs(tmp_path):
+    repo_path = str(tmp_path / "repo")
+    create_repo(repo_path)
+    old_commit = get_head_commit(repo_path)
+    assert old_commit is not None
+    assert get_changed_package_dirs(repo_path, "", old_commit) == (set(), [])
+    assert get_changed_package_dirs(repo_path, "", "0" * 40) is None
+
+    with open(os.path.join(repo_path, "foo", "PKGBUILD"), "a") as h:
+        h.write("pkgver=2\n")
+    assert get_head_commit(repo_path) is None
+    shutil.rmtree(os.path.join(repo_path, "bar"))
+    with open(os.path.join(repo_path, "sub", "baz", "fix.patch"), "w") as h:
+        h.write("")
+    os.makedirs(os.path.join(repo_path, "sub", "new", "nested"))
+    with open(os.path.join(repo_path, "sub", "new", "PKGBUILD"), "w") as h:
+        h.write("pkgname=new\n")
+    with open(os.path.join(repo_path, "sub", "new", "nested", "PKGBUILD"), "w") as h:
+        h.write("pkgname=nested\n")
+    git(repo_path, "add", "-A")
+    git(repo_path, "commit", "-q", "-m", "update")
+    assert get_head_commit(repo_path) not in (None, old_commit)
+
+    touched, paths = get_changed_package_dirs(repo_path, "", old_commit)
+    assert touched == {"foo", "bar", "sub", "sub/baz", "sub/new", "sub/new/nested"}
+    assert paths == sorted(os.path.join(repo_path, *p, "PKGBUILD") for p in [("foo",), ("sub", "baz"), ("sub", "new")])
+
+    touched, paths = get_changed_package_dirs(os.path.join(repo_path, "sub"), "sub/", old_commit)
+    assert touched == {"sub/baz", "sub/new", "sub/new/nested"}
+    assert len(paths) == 2
+
+    # uncommitted changes and untracked files count as well
+    old_commit = get_head_commit(repo_path)
+    with open(os.path.join(repo_path, "foo", "PKGBUILD"), "a") as h:
+        h.write("pkgver=3\n")
+    os.makedirs(os.path.join(repo_path, "sub", "untracked"))
+    with open(os.path.join(repo_path, "sub", "untracked", "PKGBUILD"), "w") as h:
+        h.write("pkgname=untracked\n")
+    touched, paths = get_changed_package_dirs(repo_path, "", old_commit)
+    assert touched == {"foo", "sub", "sub/untracked"}
+    assert paths == [os.path.join(repo_path, "foo", "PKGBUILD"), os.path.join(repo_path, "sub", "untracked", "PKGBUILD")]
+    touched, paths = get_changed_package_dirs(os.path.join(repo_path, "sub"), "sub/", old_commit)
+    assert touched == {"sub/untracked"}
+
+
+def test_validate_srcinfo():
+    validate_srcinfo({"extra": {"references": ["pypi: foo"]}})
+    validate_srcinfo({})
+
+    with pytest.raises(ValidationError):
+        validate_srcinfo({"extra": {"changelog_url": 42}})
+
+
+def test_add_parsed_field():
+    srcinfo = "pkgbase = foo\n\tpkgver = 1.0\n\tpkgrel = 1\n\npkgname = foo\n"
+    entry = {"srcinfo": {"ucrt64": srcinfo}}
+    add_parsed_field(entry)
+    assert entry["parsed"]["arches"] == {"ucrt64": 0}
+    parsed = entry["parsed"]
+    add_parsed_field(entry)
+    assert entry["parsed"] is parsed
@@ -0,0 +1,70 @@
+import pytest
+
+from msys2_devtools.srcinfo_store import open_srcinfo_cache, parse_srcinfo_cache, write_srcinfo_cache, \
+    dump_srcinfo_cache, get_srcinfo_cache_format, SrcinfoCache
+
+ENTRIES = {
+    "b": {
+        "repo": "https://github.com/msys2/MINGW-packages",
+        "path": "mingw-w64-bar",
+        "srcinfo": {"ucrt64": "pkgbase = mingw-w64-bar\n\tpkgver = 1\n"},
+        "extra": {"references": ["pypi: bar"]},
+    },
+    "a": {
+        "repo": "https://github.com/msys2/MINGW-packages",
+        "path": "mingw-w64-foo",
+        "srcinfo": {"ucrt64": "pkgbase = mingw-w64-foo\n\tpkgver = 1\n",
+                    "clang64": "pkgbase = mingw-w64-foo\n\tpkgver = 1\n"},
+    },
+}
+
+
+@pytest.mark.parametrize("format", ["json", "indexed"])
+def test_srcinfo_cache_roundtrip(tmp_path, format):
+    path = str(tmp_path / "srcinfo.cache")
+    write_srcinfo_cache(path, ENTRIES.items(), format, {"commit": "abc"})
+    assert get_srcinfo_cache_format(path) == format
+
+    with open_srcinfo_cache(path) as cache:
+        assert list(cache) == ["a", "b"]
+        assert len(cache) == 2
+        assert "a" in cache and "c" not in cache
+        assert cache["a"] == ENTRIES["a"]
+        assert dict(cache.items()) == ENTRIES
+        assert cache.get_fields("a", ["path", "extra"]) == {"path": "mingw-w64-foo"}
+        assert list(cache.iter_field("extra")) == [("b", {"references": ["pypi: bar"]})]
+        assert dict(cache.iter_entries(["path"])) == {"a": {"path": "mingw-w64-foo"}, "b": {"path": "mingw-w64-bar"}}
+        assert cache.get_pkgbase("b") == "mingw-w64-bar"
+        assert cache.find_pkgbase("mingw-w64-foo") == ["a"]
+        assert cache.find_pkgbase("nope") == []
+        assert cache.meta == ({"commit": "abc"} if format == "indexed" else {})
+
+
+def test_srcinfo_cache_formats():
+    data = dump_srcinfo_cache(ENTRIES.items(), "indexed")
+    assert dict(parse_srcinfo_cache(data).items()) == ENTRIES
+    assert dump_srcinfo_cache(ENTRIES.items(), "indexed") == data
+
+    data = dump_srcinfo_cache(ENTRIES.items(), "json")
+    assert dict(parse_srcinfo_cache(data).items()) == ENTRIES
+
+    with pytest.raises(ValueError):
+        dump_srcinfo_cache(ENTRIES.items(), "yaml")
+
+
+def test_srcinfo_cache_missing(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        open_srcinfo_cache(str(tmp_path / "missing"))
+    assert get_srcinfo_cache_format(str(tmp_path / "missing")) is None
+
+
+def test_srcinfo_cache_abstract():
+    class Incomplete(SrcinfoCache):
+        def __iter__(self):
+            return iter([])
+
+        def __len__(self):
+            return 0
+
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -1,4 +1,7 @@
-from msys2_devtools.utils import vercmp
+from functools import cmp_to_key
+
+from benchmarks.bench_vercmp import reference_vercmp
+from msys2_devtools.utils import VersionKey, vercmp, version_key
 
 
 def test_vercmp():
@@ -32,3 +35,40 @@ def test_vercmp():
 
     # FIXME:
     # test_ver(".0", "0", 1)
+
+
+def get_version_corpus():
+    versions = [
+        "", ".", "..", "0", "00", "1", "1.0", "1.0.0", "1.0.0.r101", "1.0a", "1.0.a", "1.0-1", "1.0-2", "1.0-1.1",
+        "1~1.0", "2~0.1", "0~1.0-1", "1.0rc1", "1.0-rc1", "1.0_rc1", "1.0+git", "r2991.1771b556", "0.161.r3039.544c61f",
+        "2019.10.06", "1.3_20200327", "6.8.", "a", "A", "Z", "aa", "1r", "r1", "r", "a1", ".0", "..0", "1..0",
+        "1.0é", "1.0ä1", "١.٢", "1.0-", "-", "~", "1~", "~1", "1.0.0-1-1", "9999999999999999999999.1",
+    ]
+    # and some generated ones
+    state = 42
+    alphabet = "0129.-_+~ar"
+    for i in range(300):
+        version = ""
+        for j in range(i % 9):
+            state = (state * 1103515245 + 12345) % 2 ** 31
+            version += alphabet[state % len(alphabet)]
+        versions.append(version)
+    return versions
+
+
+def test_vercmp_reference():
+    versions = get_version_corpus()
+    for a in versions:
+        for b in versions:
+            assert vercmp(a, b) == reference_vercmp(a, b), (a, b)
+
+    assert sorted(versions, key=version_key) == sorted(versions, key=cmp_to_key(reference_vercmp))
+
+
+def test_version_key():
+    assert version_key("1.0") is version_key("1.0")
+    assert VersionKey("1.0") == VersionKey("1.0-1")
+    assert VersionKey("1.0") == VersionKey("1.0-2")
+    assert VersionKey("1.0-1") < VersionKey("1.0-2") <= VersionKey("1.0-2")
+    assert VersionKey("1.0-2") > VersionKey("1.0a-3") >= VersionKey("1.0a")
+    assert len({VersionKey("1.0"), VersionKey("1.0-1"), VersionKey("01.0")}) == 1